@@ -13,32 +13,112 @@ import cv2
 import numpy as np
 import traceback
 import sys
+import httplib
+import urlparse
+import base64
 
 #Globals
 _cameras = []
-_camera_polling_thread = ""
 _index = []
 
 class FrameBufferThread(threading.Thread):
     """
     **SUMMARY**
 
-    This is a helper thread which continually debuffers the camera frames.  If
+    This is a helper thread which continually debuffers a camera's frames.  If
     you don't do this, cameras may constantly give you a frame behind, which
     causes problems at low sample rates.  This makes sure the frames returned
     by your camera are fresh.
 
+    Each camera device gets its own thread, so every camera runs at its own
+    frame rate. Frames are kept in a small ring of preallocated arrays along
+    with their capture time and a sequence number, which lets Camera.getImage
+    hand out the newest frame, or the next one, without repeating frames.
+
     """
+    def __init__(self, camera, size=4):
+        super(FrameBufferThread, self).__init__()
+        self.daemon = True
+        self.name = 'Thread-Camera-ID-' + str(camera.index)
+        self.camera = camera
+        self.size = size
+        self.frames = None #preallocated once we know the frame size
+        self.timestamps = [0] * size
+        self.sequence = 0 #sequence number of the newest frame, the first is 1
+        self.condition = threading.Condition()
+        self._stop = threading.Event()
+
     def run(self):
-        global _cameras
-        while (1):
-            for cam in _cameras:
-                if cam.pygame_camera:
-                    cam.pygame_buffer = cam.capture.get_image(cam.pygame_buffer)
-                else:
-                    cv.GrabFrame(cam.capture)
-                cam._threadcapturetime = time.time()
-            time.sleep(0.04)    #max 25 fps, if you're lucky
+        while not self._stop.isSet():
+            frame = self._grab()
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            now = time.time()
+            with self.condition:
+                if self.frames is None or self.frames[0].shape != frame.shape:
+                    self.frames = [np.empty(frame.shape, dtype=np.uint8) for i in range(self.size)]
+                slot = self.sequence % self.size
+                self.frames[slot][...] = frame
+                self.timestamps[slot] = now
+                self.sequence += 1
+                self.condition.notifyAll()
+            del frame
+
+    def _grab(self):
+        """
+        Wait for the next frame from the device and return it as a (rows, cols, BGR)
+        array, or None if the device didn't give us anything.
+        """
+        cam = self.camera
+        if cam.pygame_camera:
+            cam.pygame_buffer = cam.capture.get_image(cam.pygame_buffer)
+            return pg.surfarray.array3d(cam.pygame_buffer).transpose([1, 0, 2])[:, :, ::-1]
+        if not cv.GrabFrame(cam.capture):
+            return None
+        return np.asarray(cv.GetMat(cv.RetrieveFrame(cam.capture)))
+
+    def getFrame(self, camera, sequence=0, latest=True, timeout=2.0):
+        """
+        **SUMMARY**
+
+        Wait for a frame newer than sequence and return it.
+
+        **PARAMETERS**
+
+        * *camera* - The Camera the image is for.
+        * *sequence* - Only frames with a larger sequence number are returned.
+        * *latest* - If True return the newest frame, otherwise the oldest one
+          still in the ring.
+        * *timeout* - How many seconds to wait for a frame.
+
+        **RETURNS**
+
+        A tuple of (Image, capture time, sequence number), or None if no frame
+        arrived in time.
+
+        """
+        end = time.time() + timeout
+        with self.condition:
+            while self.sequence <= sequence:
+                remaining = end - time.time()
+                if remaining <= 0 or not self.isAlive():
+                    return None
+                self.condition.wait(remaining)
+            if latest:
+                seq = self.sequence
+            else:
+                seq = max(sequence + 1, self.sequence - self.size + 1)
+            slot = (seq - 1) % self.size
+            #the Image takes its own copy, so the slot can be reused afterwards
+            img = Image(self.frames[slot], camera, cv2image=True)
+            return img, self.timestamps[slot], seq
+
+    def stop(self):
+        self._stop.set()
+
+    def stopped(self):
+        return self._stop.isSet()
 
 
 
@@ -401,9 +481,11 @@ class Camera(FrameSource):
     control than just basic frame retrieval
     """
     capture = ""   #cvCapture object
-    thread = ""
+    thread = ""    #the FrameBufferThread debuffering this device
     pygame_camera = False
     pygame_buffer = ""
+    sequence = 0   #sequence number of the last frame returned by getImage
+    droppedFrames = 0 #frames captured but never returned by getImage
 
 
     prop_map = {"width": cv.CV_CAP_PROP_FRAME_WIDTH,
@@ -418,7 +500,6 @@ class Camera(FrameSource):
 
     def __init__(self, camera_index = -1, prop_set = {}, threaded = True, calibrationfile = ''):
         global _cameras
-        global _camera_polling_thread
         global _index
         """
         **SUMMARY**
@@ -428,9 +509,11 @@ class Camera(FrameSource):
         Supported props are currently: height, width, brightness, contrast,
         saturation, hue, gain, and exposure.
 
-        You can also specify whether you want the FrameBufferThread to continuously
+        You can also specify whether you want a FrameBufferThread to continuously
         debuffer the camera.  If you specify True, the camera is essentially 'on' at
         all times.  If you specify off, you will have to manage camera buffers.
+        Every camera device gets its own thread, so several cameras can each run at
+        their own frame rate.
 
         **PARAMETERS**
 
@@ -468,6 +551,8 @@ class Camera(FrameSource):
             if camera_index == cam.index:
                 self.threaded = cam.threaded
                 self.capture = cam.capture
+                self.thread = cam.thread
+                self.pygame_camera = cam.pygame_camera
                 self.index = cam.index
                 _cameras.append(self)
                 return
@@ -524,11 +609,9 @@ class Camera(FrameSource):
         if (threaded):
             self.threaded = True
             _cameras.append(self)
-            if (not _camera_polling_thread):
-                _camera_polling_thread = FrameBufferThread()
-                _camera_polling_thread.daemon = True
-                _camera_polling_thread.start()
-                time.sleep(0) #yield to thread
+            self.thread = FrameBufferThread(self)
+            self.thread.start()
+            time.sleep(0) #yield to thread
 
         if calibrationfile:
             self.loadCalibration(calibrationfile)
@@ -589,19 +672,30 @@ class Camera(FrameSource):
 
         return props
 
-    def getImage(self):
+    def getImage(self, latest=True, next=False):
         """
         **SUMMARY**
 
-        Retrieve an Image-object from the camera.  If you experience problems
-        with stale frames from the camera's hardware buffer, increase the flushcache
-        number to dequeue multiple frames before retrieval
+        Retrieve an Image-object from the camera.
+
+        When the camera is threaded the frames come from the camera's
+        FrameBufferThread, which keeps the last few frames along with their
+        capture time (see capturetime) and sequence number (see sequence). An
+        image is never returned twice; if the camera hasn't captured a new frame
+        since the last call this waits for one. Frames that were captured but
+        never returned are counted in droppedFrames.
+
+        **PARAMETERS**
 
-        We're working on how to solve this problem.
+        * *latest* - If True (the default) return the newest frame. If False
+          return the oldest frame this camera hasn't returned yet, so frames
+          are only dropped when the ring buffer overflows.
+        * *next* - If True wait for a frame captured after this call.
 
         **RETURNS**
 
-        A SimpleCV Image from the camera.
+        A SimpleCV Image from the camera, or None if the camera stopped sending
+        frames.
 
         **EXAMPLES**
 
@@ -609,21 +703,29 @@ class Camera(FrameSource):
         >>> while True:
         >>>    cam.getImage().show()
 
-        """
+        >>> img = cam.getImage(next=True)
+        >>> print cam.sequence, cam.capturetime, cam.droppedFrames
 
-        if self.pygame_camera:
-            return Image(self.pygame_buffer.copy())
+        """
 
         if (not self.threaded):
             cv.GrabFrame(self.capture)
             self.capturetime = time.time()
-        else:
-            self.capturetime = self._threadcapturetime
-
-        frame = cv.RetrieveFrame(self.capture)
-        newimg = cv.CreateImage(cv.GetSize(frame), cv.IPL_DEPTH_8U, 3)
-        cv.Copy(frame, newimg)
-        return Image(newimg, self)
+            return Image(cv.RetrieveFrame(self.capture), self)
+
+        sequence = self.sequence
+        if next:
+            sequence = max(sequence, self.thread.sequence)
+        frame = self.thread.getFrame(self, sequence, latest)
+        if frame is None:
+            logger.warning("Timed out waiting for a frame from camera " + str(self.index))
+            return None
+        img, self.capturetime, seq = frame
+        if self.sequence:
+            self.droppedFrames += seq - self.sequence - 1
+        self.sequence = seq
+        self._threadcapturetime = self.capturetime
+        return img
 
 
 class VirtualCamera(FrameSource):
@@ -1057,90 +1159,183 @@ class JpegStreamReader(threading.Thread):
     A Threaded class for pulling down JPEG streams and breaking up the images. This
     is handy for reading the stream of images from a IP CAmera.
 
+    The stream is read in large chunks into a reusable buffer and split on the
+    multipart boundaries. Only the newest complete JPEG is kept, undecoded, and
+    every frame gets a sequence number. Frames that were replaced before anyone
+    asked for them are counted in droppedFrames.
+
     """
     url = ""
     currentframe = ""
     _threadcapturetime = ""
+    sequence = 0 #sequence number of currentframe, the first frame is 1
+    droppedFrames = 0
+    chunksize = 65536
 
-    def run(self):
+    def __init__(self, url=""):
+        super(JpegStreamReader, self).__init__()
+        self.url = url
+        self._taken = 0
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
 
-        f = ''
+    def run(self):
+        response = self._connect()
+        if response is None:
+            return
 
-        if re.search('@', self.url):
-            authstuff = re.findall('//(\S+)@', self.url)[0]
-            self.url = re.sub("//\S+@", "//", self.url)
-            user, password = authstuff.split(":")
+        headers = response.msg
+        if not headers.has_key("Content-type"):
+            logger.warning("Tried to load a JpegStream from " + self.url + ", but didn't find a content-type header!")
+            return
 
-            #thank you missing urllib2 manual
-            #http://www.voidspace.org.uk/python/articles/urllib2.shtml#id5
-            password_mgr = urllib2.HTTPPasswordMgrWithDefaultRealm()
-            password_mgr.add_password(None, self.url, user, password)
+        contenttype = headers["Content-type"]
+        if not re.search("multipart", contenttype, re.I) or "boundary=" not in contenttype:
+            logger.warning("Tried to load a JpegStream from " + self.url + ", but the content type header was " + contenttype + " not multipart/replace!")
+            return
+        boundary = contenttype.split("boundary=")[1].split(";")[0].strip().strip('"')
+
+        #read straight from the socket so we get whatever has arrived,
+        #httplib only gives us blocking reads of a fixed size
+        sock = None
+        if not response.chunked and hasattr(response.fp, "_sock"):
+            sock = response.fp._sock
+        buff = bytearray(self.chunksize * 4)
+        end = 0
+        while not self._stop.isSet():
+            if len(buff) - end < self.chunksize:
+                buff.extend(bytearray(len(buff)))
+            try:
+                if sock is not None:
+                    n = sock.recv_into(memoryview(buff)[end:], self.chunksize)
+                else:
+                    data = response.read(4096)
+                    n = len(data)
+                    buff[end:end + n] = data
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                logger.warning("JpegStream from " + self.url + " failed: " + str(e))
+                break
+            if not n:
+                logger.warning("JpegStream from " + self.url + " closed")
+                break
+            end = self._parse(buff, end + n, boundary)
+        response.close()
 
-            handler = urllib2.HTTPBasicAuthHandler(password_mgr)
-            opener = urllib2.build_opener(handler)
+    def _connect(self):
+        """
+        Open the stream, sending the username and password from the url (if any)
+        as basic authentication.
+        """
+        url = urlparse.urlsplit(self.url)
+        path = url.path or "/"
+        if url.query:
+            path = path + "?" + url.query
+        headers = {}
+        if url.username:
+            auth = base64.b64encode(url.username + ":" + (url.password or ""))
+            headers["Authorization"] = "Basic " + auth
+        try:
+            conn = httplib.HTTPConnection(url.hostname, url.port or 80, timeout=5)
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+        except (httplib.HTTPException, socket.error) as e:
+            logger.warning("Could not open JpegStream at " + self.url + ": " + str(e))
+            return None
+        if response.status != 200:
+            logger.warning("Tried to load a JpegStream from " + self.url + ", but the server said " + str(response.status) + " " + response.reason)
+            return None
+        return response
 
-            f = opener.open(self.url)
-        else:
-            f = urllib2.urlopen(self.url)
+    def _parse(self, buff, end, boundary):
+        """
+        Pull every complete part out of buff[0:end], publish the newest JPEG
+        and move the unfinished remainder to the front of buff. Returns the
+        length of the remainder.
+        """
+        pos = 0
+        keep = None
+        frames = []
+        while True:
+            start = buff.find(boundary, pos, end)
+            if start < 0:
+                #hold on to anything that might be the start of a boundary
+                keep = max(pos, end - len(boundary))
+                break
+            headerEnd = buff.find("\r\n\r\n", start, end)
+            skip = 4
+            if headerEnd < 0:
+                headerEnd = buff.find("\n\n", start, end)
+                skip = 2
+            if headerEnd < 0:
+                keep = start
+                break
+            headers = str(buff[start:headerEnd]).lower()
+            body = headerEnd + skip
+            match = re.search("content-length:\s*(\d+)", headers)
+            if match:
+                bodyEnd = body + int(match.group(1))
+                if bodyEnd > end:
+                    keep = start
+                    break
+            else:
+                bodyEnd = buff.find(boundary, body, end)
+                if bodyEnd < 0:
+                    keep = start
+                    break
+            if "content-type" not in headers or "jpeg" in headers:
+                frames.append((body, bodyEnd))
+            pos = bodyEnd
+
+        if frames:
+            body, bodyEnd = frames[-1]
+            soi = buff.find("\xff\xd8", body, bodyEnd)
+            eoi = buff.rfind("\xff\xd9", body, bodyEnd)
+            if soi >= 0 and eoi > soi:
+                self._publish(memoryview(buff)[soi:eoi + 2].tobytes(), len(frames) - 1)
+
+        remainder = end - keep
+        buff[0:remainder] = buff[keep:end]
+        return remainder
+
+    def _publish(self, frame, skipped):
+        with self._condition:
+            self.droppedFrames += skipped
+            if self._taken < self.sequence:
+                self.droppedFrames += 1
+            self.sequence += skipped + 1
+            self.currentframe = frame
+            self._threadcapturetime = time.time()
+            self._condition.notifyAll()
+
+    def getFrame(self, sequence=0, timeout=5):
+        """
+        **SUMMARY**
 
-        headers = f.info()
-        if (headers.has_key("content-type")):
-            headers['Content-type'] = headers['content-type'] #force ucase first char
+        Wait for a frame newer than sequence.
 
-        if not headers.has_key("Content-type"):
-            logger.warning("Tried to load a JpegStream from " + self.url + ", but didn't find a content-type header!")
-            return
+        **RETURNS**
 
-        (multipart, boundary) = headers['Content-type'].split("boundary=")
-        if not re.search("multipart", multipart, re.I):
-            logger.warning("Tried to load a JpegStream from " + self.url + ", but the content type header was " + multipart + " not multipart/replace!")
-            return
+        A tuple of (JPEG data, capture time, sequence number), or None if no new
+        frame arrived within timeout seconds.
 
-        buff = ''
-        data = f.readline().strip()
-        length = 0
-        contenttype = "jpeg"
-
-        #the first frame contains a boundarystring and some header info
-        while (1):
-            #print data
-            if (re.search(boundary, data.strip()) and len(buff)):
-                #we have a full jpeg in buffer.  Convert to an image
-                if contenttype == "jpeg":
-                    self.currentframe = buff
-                    self._threadcapturetime = time.time()
-                buff = ''
-
-            if (re.match("Content-Type", data, re.I)):
-                #set the content type, if provided (default to jpeg)
-                (header, typestring) = data.split(":")
-                (junk, contenttype) = typestring.strip().split("/")
-
-            if (re.match("Content-Length", data, re.I)):
-                #once we have the content length, we know how far to go jfif
-                (header, length) = data.split(":")
-                length = int(length.strip())
-
-            if (re.search("JFIF", data, re.I) or re.search("\xff\xd8\xff\xdb", data) or len(data) > 55):
-                # we have reached the start of the image
-                buff = ''
-                if length and length > len(data):
-                    buff += data + f.read(length - len(data)) #read the remainder of the image
-                    if contenttype == "jpeg":
-                        self.currentframe = buff
-                        self._threadcapturetime = time.time()
-                else:
-                    while (not re.search(boundary, data)):
-                        buff += data
-                        data = f.readline()
+        """
+        end = time.time() + timeout
+        with self._condition:
+            while self.sequence <= sequence:
+                remaining = end - time.time()
+                if remaining <= 0 or not self.isAlive():
+                    return None
+                self._condition.wait(remaining)
+            self._taken = self.sequence
+            return self.currentframe, self._threadcapturetime, self.sequence
 
-                    endimg, junk = data.split(boundary)
-                    buff += endimg
-                    data = boundary
-                    continue
+    def stop(self):
+        self._stop.set()
 
-            data = f.readline() #load the next (header) line
-            time.sleep(0) #let the other threads go
+    def stopped(self):
+        return self._stop.isSet()
 
 class JpegStreamCamera(FrameSource):
     """
@@ -1161,6 +1356,7 @@ class JpegStreamCamera(FrameSource):
     """
     url = ""
     camthread = ""
+    sequence = 0 #sequence number of the last frame returned by getImage
 
     def __init__(self, url):
         if not PIL_ENABLED:
@@ -1169,8 +1365,7 @@ class JpegStreamCamera(FrameSource):
         if not url.startswith('http://'):
             url = "http://" + url
         self.url = url
-        self.camthread = JpegStreamReader()
-        self.camthread.url = self.url
+        self.camthread = JpegStreamReader(self.url)
         self.camthread.daemon = True
         self.camthread.start()
 
@@ -1178,19 +1373,22 @@ class JpegStreamCamera(FrameSource):
         """
         **SUMMARY**
 
-        Return the current frame of the JpegStream being monitored
+        Return the newest frame of the JpegStream being monitored. Each frame
+        is only returned once, if no new frame has arrived since the last call
+        this waits for one. Frames the stream sent in between are never
+        decoded, the count of them is in camthread.droppedFrames.
 
         """
-        if not self.camthread._threadcapturetime:
-            now = time.time()
-            while not self.camthread._threadcapturetime:
-                if time.time() - now > 5:
-                    warnings.warn("Timeout fetching JpegStream at " + self.url)
-                    return
-                time.sleep(0.1)
+        frame = self.camthread.getFrame(self.sequence)
+        if frame is None:
+            warnings.warn("Timeout fetching JpegStream at " + self.url)
+            return
 
-        self.capturetime = self.camthread._threadcapturetime
-        return Image(pil.open(StringIO(self.camthread.currentframe)), self)
+        jpeg, self.capturetime, self.sequence = frame
+        img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), 1)
+        if img is None:
+            return Image(pil.open(StringIO(jpeg)), self)
+        return Image(img, self, cv2image=True, copy=False)
 
 
 _SANE_INIT = False
@@ -1989,133 +2187,12 @@ class StereoImage:
         >>> stereo.get3DImage(Q, "BM", state).show()
         >>> stereo.get3DImage(Q, "SGBM", state).show()
         """
-        imgLeft = self.ImageLeft
-        imgRight = self.ImageRight
-        cv2flag = True
-        try:
-            import cv2
-        except ImportError:
-            cv2flag = False
-        import cv2.cv as cv
-        (r, c) = self.size
-        if method == "BM":
-            sbm = cv.CreateStereoBMState()
-            disparity = cv.CreateMat(c, r, cv.CV_32F)
-            if state:
-                SADWindowSize = state.get("SADWindowSize")
-                preFilterCap = state.get("preFilterCap")
-                minDisparity = state.get("minDisparity")
-                numberOfDisparities = state.get("nDisparity")
-                uniquenessRatio = state.get("uniquenessRatio")
-                speckleRange = state.get("speckleRange")
-                speckleWindowSize = state.get("speckleWindowSize")
-                textureThreshold = state.get("textureThreshold")
-                speckleRange = state.get("speckleRange")
-                speckleWindowSize = state.get("speckleWindowSize")
-                preFilterType = state.get("perFilterType")
-
-                if SADWindowSize is not None:
-                    sbm.SADWindowSize = SADWindowSize
-                if preFilterCap is not None:
-                    sbm.preFilterCap = preFilterCap
-                if minDisparity is not None:
-                    sbm.minDisparity = minDisparity
-                if numberOfDisparities is not None:
-                    sbm.numberOfDisparities = numberOfDisparities
-                if uniquenessRatio is not None:
-                    sbm.uniquenessRatio = uniquenessRatio
-                if speckleRange is not None:
-                    sbm.speckleRange = speckleRange
-                if speckleWindowSize is not None:
-                    sbm.speckleWindowSize = speckleWindowSize
-                if textureThreshold is not None:
-                    sbm.textureThreshold = textureThreshold
-                if preFilterType is not None:
-                    sbm.preFilterType = preFilterType
-            else:
-                sbm.SADWindowSize = 9
-                sbm.preFilterType = 1
-                sbm.preFilterSize = 5
-                sbm.preFilterCap = 61
-                sbm.minDisparity = -39
-                sbm.numberOfDisparities = 112
-                sbm.textureThreshold = 507
-                sbm.uniquenessRatio= 0
-                sbm.speckleRange = 8
-                sbm.speckleWindowSize = 0
-
-            gray_left = imgLeft.getGrayscaleMatrix()
-            gray_right = imgRight.getGrayscaleMatrix()
-            cv.FindStereoCorrespondenceBM(gray_left, gray_right, disparity, sbm)
-            disparity_visual = cv.CreateMat(c, r, cv.CV_8U)
-
-        elif method == "SGBM":
-            if not cv2flag:
-                warnings.warn("Can't Use SGBM without OpenCV >= 2.4. Use SBM instead.")
-            sbm = cv2.StereoSGBM()
-            if state:
-                SADWindowSize = state.get("SADWindowSize")
-                preFilterCap = state.get("preFilterCap")
-                minDisparity = state.get("minDisparity")
-                numberOfDisparities = state.get("nDisparity")
-                P1 = state.get("P1")
-                P2 = state.get("P2")
-                uniquenessRatio = state.get("uniquenessRatio")
-                speckleRange = state.get("speckleRange")
-                speckleWindowSize = state.get("speckleWindowSize")
-                fullDP = state.get("fullDP")
-
-                if SADWindowSize is not None:
-                    sbm.SADWindowSize = SADWindowSize
-                if preFilterCap is not None:
-                    sbm.preFilterCap = preFilterCap
-                if minDisparity is not None:
-                    sbm.minDisparity = minDisparity
-                if numberOfDisparities is not None:
-                    sbm.numberOfDisparities = numberOfDisparities
-                if P1 is not None:
-                    sbm.P1 = P1
-                if P2 is not None:
-                    sbm.P2 = P2
-                if uniquenessRatio is not None:
-                    sbm.uniquenessRatio = uniquenessRatio
-                if speckleRange is not None:
-                    sbm.speckleRange = speckleRange
-                if speckleWindowSize is not None:
-                    sbm.speckleWindowSize = speckleWindowSize
-                if fullDP is not None:
-                    sbm.fullDP = fullDP
-            else:
-                sbm.SADWindowSize = 9;
-                sbm.numberOfDisparities = 96;
-                sbm.preFilterCap = 63;
-                sbm.minDisparity = -21;
-                sbm.uniquenessRatio = 7;
-                sbm.speckleWindowSize = 0;
-                sbm.speckleRange = 8;
-                sbm.disp12MaxDiff = 1;
-                sbm.fullDP = False;
-
-            disparity = sbm.compute(imgLeft.getGrayNumpyCv2(), imgRight.getGrayNumpyCv2())
-            
-        else:
-            warnings.warn("Unknown method. Returning None")
+        pipeline = StereoPipeline(size=self.size, method=method, state=state, Q=Q)
+        Image3D = pipeline.getPointCloud(self.ImageLeft, self.ImageRight)
+        if Image3D is None:
             return None
-
-        if cv2flag:
-            if not isinstance(Q, np.ndarray):
-                Q = np.array(Q)
-            if not isinstance(disparity, np.ndarray):
-                disparity = np.array(disparity)
-            Image3D = cv2.reprojectImageTo3D(disparity, Q, ddepth=cv2.cv.CV_32F)
-            Image3D_normalize = cv2.normalize(Image3D, alpha=0, beta=255, norm_type=cv2.cv.CV_MINMAX, dtype=cv2.cv.CV_8UC3)
-            retVal = Image(Image3D_normalize, cv2image=True)
-        else:
-            Image3D = cv.CreateMat(self.LeftImage.size()[1], self.LeftImage.size()[0], cv2.cv.CV_32FC3)
-            Image3D_normalize = cv.CreateMat(self.LeftImage.size()[1], self.LeftImage.size()[0], cv2.cv.CV_8UC3)
-            cv.ReprojectImageTo3D(disparity, Image3D, Q)
-            cv.Normalize(Image3D, Image3D_normalize, 0, 255, cv.CV_MINMAX, CV_8UC3)
-            retVal = Image(Image3D_normalize)
+        Image3D_normalize = cv2.normalize(Image3D, alpha=0, beta=255, norm_type=cv2.cv.CV_MINMAX, dtype=cv2.cv.CV_8UC3)
+        retVal = Image(Image3D_normalize, cv2image=True)
         self.Image3D = Image3D
         return retVal
 
@@ -2182,8 +2259,38 @@ class StereoCamera :
       -> Disparity-to-depth mapping matrix (Q)
     """
     def __init__(self):
+        self._undistortMaps = None
+        self._pipeline = None
         return
 
+    def getPipeline(self, calibration, WinSize=(352,288), method="BM", state=None):
+        """
+        **SUMMARY**
+
+        Build a StereoPipeline for this rig. The rectification maps and the
+        stereo matcher are set up once, so each new pair of frames only pays
+        for the remap and the matching.
+
+        **PARAMETERS**
+
+        * *calibration* - A calibration tuple of the format (CM1, CM2, D1, D2, R, T, E, F)
+        * *WinSize* - The resolution of the cameras.
+        * *method* - "BM" or "SGBM", see StereoPipeline.
+        * *state* - A dictionary of stereo correspondence parameters, see get3DImage.
+
+        **RETURNS**
+
+        A StereoPipeline.
+
+        **EXAMPLE**
+
+        >>> StereoCam = StereoCamera()
+        >>> calibration = StereoCam.loadCalibration(fname="Stereo1")
+        >>> pipeline = StereoCam.getPipeline(calibration)
+        >>> points = pipeline.getPointCloud(camLeft.getImage(), camRight.getImage())
+        """
+        return StereoPipeline(calibration, WinSize, method, state)
+
     def stereoCalibration(self,camLeft, camRight, nboards=30, chessboard=(8, 5), gridsize=0.027, WinSize = (352,288)):
         """
         
@@ -2507,14 +2614,20 @@ class StereoCamera :
 
         dst1 = cv.CloneMat(imgLeft)
         dst2 = cv.CloneMat(imgRight)
-        map1x = cv.CreateMat(WinSize[1], WinSize[0], cv.CV_32FC1)
-        map2x = cv.CreateMat(WinSize[1], WinSize[0], cv.CV_32FC1)
-        map1y = cv.CreateMat(WinSize[1], WinSize[0], cv.CV_32FC1)
-        map2y = cv.CreateMat(WinSize[1], WinSize[0], cv.CV_32FC1)
-
-        #print "Rectifying images..."
-        cv.InitUndistortRectifyMap(CM1, D1, R1, P1, map1x, map1y)
-        cv.InitUndistortRectifyMap(CM2, D2, R2, P2, map2x, map2y)
+        # the maps only depend on the calibration, keep them for the next pair
+        cached = self._undistortMaps
+        if( cached is None or cached[0] is not calibration or
+            cached[1] is not rectification or cached[2] != WinSize ):
+            map1x = cv.CreateMat(WinSize[1], WinSize[0], cv.CV_32FC1)
+            map2x = cv.CreateMat(WinSize[1], WinSize[0], cv.CV_32FC1)
+            map1y = cv.CreateMat(WinSize[1], WinSize[0], cv.CV_32FC1)
+            map2y = cv.CreateMat(WinSize[1], WinSize[0], cv.CV_32FC1)
+
+            #print "Rectifying images..."
+            cv.InitUndistortRectifyMap(CM1, D1, R1, P1, map1x, map1y)
+            cv.InitUndistortRectifyMap(CM2, D2, R2, P2, map2x, map2y)
+            self._undistortMaps = (calibration, rectification, WinSize, (map1x, map1y, map2x, map2y))
+        (map1x, map1y, map2x, map2y) = self._undistortMaps[3]
 
         cv.Remap(imgLeft, dst1, map1x, map1y)
         cv.Remap(imgRight, dst2, map2x, map2y)
@@ -2607,10 +2720,223 @@ class StereoCamera :
         del camLeft
         del camRight
 
-        stereoImages = StereoImage(imgLeft, imgRight)
-        Image3D_normalize = stereoImages.get3DImage(Q, method, state)
-        self.Image3D = stereoImages.Image3D
-        return Image3D_normalize
+        # keep the matcher around for as long as the settings stay the same
+        pipeline = self._pipeline
+        if( pipeline is None or pipeline.Q is not Q or pipeline.method != method or
+            pipeline.state != state or pipeline.size != imgLeft.size() ):
+            pipeline = StereoPipeline(size=imgLeft.size(), method=method, state=state, Q=Q)
+            self._pipeline = pipeline
+        Image3D = pipeline.getPointCloud(imgLeft, imgRight)
+        if Image3D is None:
+            return None
+        self.Image3D = Image3D.copy()
+        Image3D_normalize = cv2.normalize(Image3D, alpha=0, beta=255, norm_type=cv2.cv.CV_MINMAX, dtype=cv2.cv.CV_8UC3)
+        return Image(Image3D_normalize, cv2image=True)
+
+
+class StereoPipeline(object):
+    """
+    **SUMMARY**
+
+    A StereoPipeline keeps everything that stays the same from one stereo
+    pair to the next on a fixed rig: the rectification maps worked out from
+    the calibration, a configured stereo matcher and the output buffers.
+    Feeding it frames from a calibrated rig then costs a remap and a
+    match per pair, and the results come back as float32 numpy arrays rather
+    than 8 bit images.
+
+    The arrays returned by getRectified, getDisparity and getPointCloud are
+    the pipeline's own buffers and are overwritten by the next call, copy
+    them to keep them.
+
+    **PARAMETERS**
+
+    * *calibration* - A calibration tuple of the format (CM1, CM2, D1, D2, R, T, E, F),
+      as returned by StereoCamera.loadCalibration. None if the images are
+      already rectified.
+    * *size* - The (width, height) of the images. If there is no calibration
+      this can be None and it is taken from the first pair.
+    * *method* - "BM" for block matching or "SGBM" for semi global block matching.
+    * *state* - A dictionary of stereo correspondence parameters, the same
+      as StereoImage.get3DImage takes.
+    * *Q* - The disparity to depth matrix. This comes from the calibration
+      when one is given.
+
+    **EXAMPLE**
+
+    >>> StereoCam = StereoCamera()
+    >>> calibration = StereoCam.loadCalibration(fname="Stereo1")
+    >>> pipeline = StereoPipeline(calibration, (352,288), "SGBM")
+    >>> while True:
+    >>>     disparity = pipeline.getDisparity(camLeft.getImage(), camRight.getImage())
+
+    """
+    # the defaults StereoImage.get3DImage has always used
+    BM_DEFAULTS = {"SADWindowSize":9, "preFilterType":1, "preFilterSize":5,
+                   "preFilterCap":61, "minDisparity":-39, "nDisparity":112,
+                   "textureThreshold":507, "uniquenessRatio":0, "speckleRange":8,
+                   "speckleWindowSize":0}
+    SGBM_DEFAULTS = {"SADWindowSize":9, "nDisparity":96, "preFilterCap":63,
+                     "minDisparity":-21, "uniquenessRatio":7, "speckleWindowSize":0,
+                     "speckleRange":8, "disp12MaxDiff":1, "fullDP":False}
+
+    def __init__(self, calibration=None, size=(352,288), method="BM", state=None, Q=None):
+        self.size = size
+        self.method = method
+        self.state = state
+        self.Q = Q
+        self.roi = None
+        self.maps = None
+        self.matcher = self._makeMatcher(method, state)
+        self._left = None
+        self._right = None
+        self._disparity16 = None
+        self._disparity = None
+        self._cloud = None
+        if calibration is not None:
+            self._makeMaps(calibration)
+
+    def _makeMaps(self, calibration):
+        """
+        Work out the rectification and the fixed point remap tables for both
+        cameras.
+        """
+        (CM1, CM2, D1, D2, R, T, E, F) = [np.asarray(m, dtype=np.float64) for m in calibration]
+        (R1, R2, P1, P2, Q, leftroi, rightroi) = cv2.stereoRectify(CM1, D1, CM2, D2, tuple(self.size), R, T)
+        self.roi = [max(leftroi[0], rightroi[0]), max(leftroi[1], rightroi[1]),
+                    min(leftroi[2], rightroi[2]), min(leftroi[3], rightroi[3])]
+        if self.Q is None:
+            self.Q = Q
+        self.maps = (cv2.initUndistortRectifyMap(CM1, D1, R1, P1, tuple(self.size), cv2.CV_16SC2),
+                     cv2.initUndistortRectifyMap(CM2, D2, R2, P2, tuple(self.size), cv2.CV_16SC2))
+
+    def _makeMatcher(self, method, state):
+        """
+        Create and configure the stereo matcher once.
+        """
+        if method == "BM":
+            matcher = cv.CreateStereoBMState()
+            params = dict(self.BM_DEFAULTS)
+        elif method == "SGBM":
+            matcher = cv2.StereoSGBM()
+            params = dict(self.SGBM_DEFAULTS)
+        else:
+            logger.warning("Unknown stereo method " + str(method) + ", use BM or SGBM.")
+            return None
+        if state:
+            params.update(state)
+        for key, val in params.items():
+            if key == "nDisparity":
+                key = "numberOfDisparities"
+            try:
+                setattr(matcher, key, val)
+            except AttributeError:
+                logger.warning("The " + method + " matcher has no parameter " + key)
+        return matcher
+
+    def _getGray(self, img):
+        if isinstance(img, np.ndarray):
+            if img.ndim == 3:
+                return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            return img
+        return img.getGrayNumpyCv2()
+
+    def getRectified(self, imgLeft, imgRight):
+        """
+        **SUMMARY**
+
+        Get the rectified grayscale versions of a stereo pair.
+
+        **PARAMETERS**
+
+        * *imgLeft* - The left Image, or a numpy array in OpenCV layout.
+        * *imgRight* - The right Image, or a numpy array in OpenCV layout.
+
+        **RETURNS**
+
+        A tuple of two (height, width) uint8 numpy arrays, or None if the
+        images are the wrong size.
+
+        """
+        left = self._getGray(imgLeft)
+        right = self._getGray(imgRight)
+        if self.size is None:
+            self.size = (left.shape[1], left.shape[0])
+        shape = (self.size[1], self.size[0])
+        if left.shape != shape or right.shape != shape:
+            logger.warning("The stereo pipeline expects images of size " + str(tuple(self.size)))
+            return None
+        if self.maps is None:
+            return left, right
+        if self._left is None:
+            self._left = np.zeros(shape, dtype=np.uint8)
+            self._right = np.zeros(shape, dtype=np.uint8)
+        cv2.remap(left, self.maps[0][0], self.maps[0][1], cv2.INTER_LINEAR, self._left)
+        cv2.remap(right, self.maps[1][0], self.maps[1][1], cv2.INTER_LINEAR, self._right)
+        return self._left, self._right
+
+    def getDisparity(self, imgLeft, imgRight):
+        """
+        **SUMMARY**
+
+        Get the disparity of a stereo pair in pixels.
+
+        **PARAMETERS**
+
+        * *imgLeft* - The left Image, or a numpy array in OpenCV layout.
+        * *imgRight* - The right Image, or a numpy array in OpenCV layout.
+
+        **RETURNS**
+
+        A (height, width) float32 numpy array, or None on failure.
+
+        """
+        if self.matcher is None:
+            return None
+        pair = self.getRectified(imgLeft, imgRight)
+        if pair is None:
+            return None
+        (left, right) = pair
+        if self._disparity is None or self._disparity.shape != left.shape:
+            self._disparity = np.zeros(left.shape, dtype=np.float32)
+            self._disparity16 = np.zeros(left.shape, dtype=np.int16)
+            self._cloud = None
+        if self.method == "BM":
+            cv.FindStereoCorrespondenceBM(cv.fromarray(left), cv.fromarray(right),
+                                          cv.fromarray(self._disparity), self.matcher)
+        else:
+            # SGBM gives fixed point disparities with four fractional bits
+            self.matcher.compute(left, right, self._disparity16)
+            np.multiply(self._disparity16, 1.0/16.0, out=self._disparity, casting='unsafe')
+        return self._disparity
+
+    def getPointCloud(self, imgLeft, imgRight):
+        """
+        **SUMMARY**
+
+        Get the 3D position of every pixel of a stereo pair using the
+        disparity to depth matrix Q.
+
+        **PARAMETERS**
+
+        * *imgLeft* - The left Image, or a numpy array in OpenCV layout.
+        * *imgRight* - The right Image, or a numpy array in OpenCV layout.
+
+        **RETURNS**
+
+        A (height, width, 3) float32 numpy array of X,Y,Z, or None on failure.
+
+        """
+        if self.Q is None:
+            logger.warning("The stereo pipeline needs a calibration or a Q matrix for 3D points.")
+            return None
+        disparity = self.getDisparity(imgLeft, imgRight)
+        if disparity is None:
+            return None
+        if self._cloud is None:
+            self._cloud = np.zeros(disparity.shape + (3,), dtype=np.float32)
+        cv2.reprojectImageTo3D(disparity, np.asarray(self.Q, dtype=np.float64), self._cloud)
+        return self._cloud
 
 
 class AVTCameraThread(threading.Thread):
@@ -19,13 +19,13 @@ class ColorModel:
     #TODO: Discretize the colorspace into smaller intervals,eg r=[0-7][8-15] etc
     #TODO: Work in HSV space
     mIsBackground = True
-    mData = {}
+    mLUT = None #dense boolean lookup table indexed by the shifted color
     mBits = 1
 
     def __init__(self, data = None, isBackground=True):
         self.mIsBackground = isBackground
-        self.mData = {}
         self.mBits = 1
+        self.reset()
 
         if data:
             try:
@@ -36,8 +36,8 @@ class ColorModel:
 
     def _makeCanonical(self, data):
         """
-        Turn input types in a common form used by the rest of the class -- a
-        4-bit shifted list of unique colors
+        Turn input types in a common form used by the rest of the class -- an
+        Nx3 array of mBits shifted colors
         """
         ret = ''
 
@@ -60,16 +60,23 @@ class ColorModel:
             logger.warning("ColorModel: color is not in an accepted format!")
             return None
 
-        rs = np.right_shift(ret, self.mBits)  #right shift 4 bits
+        #right shift mBits, duplicates are harmless when indexing the table
+        return np.right_shift(np.asarray(ret, dtype='uint8'), self.mBits).reshape(-1, 3)
 
-        if( len(rs.shape) > 1 ):
-            uniques = np.unique(rs.view([('',rs.dtype)]*rs.shape[1])).view(rs.dtype).reshape(-1, 3)
-        else:
-            uniques = [rs]
-        #create a unique set of colors.  I had to look this one up
+    def _keysToColors(self, keys):
+        """
+        Convert the encoded string keys of the old dictionary model (and of
+        saved model files) to an Nx3 array of shifted colors.
+        """
+        return np.fromstring(''.join(keys), dtype='uint8').reshape(-1, 3)
 
-        #create a dict of encoded strings
-        return dict.fromkeys(map(np.ndarray.tostring, uniques), 1)
+    def _colorsToKeys(self):
+        """
+        Encode the colors in the table as the string keyed dictionary used by
+        saved model files.
+        """
+        colors = np.transpose(np.nonzero(self.mLUT)).astype('uint8')
+        return dict.fromkeys(map(np.ndarray.tostring, colors), 1)
 
     def reset(self):
         """
@@ -88,7 +95,8 @@ class ColorModel:
         >>> cm.clear()
 
         """
-        self.mData = {}
+        sz = 256 >> self.mBits
+        self.mLUT = np.zeros((sz, sz, sz), dtype=bool)
 
     def add(self, data):
         """
@@ -111,7 +119,9 @@ class ColorModel:
         >>> cm.clear()
 
         """
-        self.mData.update(self._makeCanonical(data))
+        colors = self._makeCanonical(data)
+        if colors is not None:
+            self.mLUT[colors[:, 0], colors[:, 1], colors[:, 2]] = True
 
     def remove(self, data):
         """
@@ -134,16 +144,18 @@ class ColorModel:
         >>> cm.remove(Color.BLACK)
 
         """
-        self.mData = dict.fromkeys(set(self.mData) ^ set(self._makeCanonical(data)), 1)
+        colors = self._makeCanonical(data)
+        if colors is not None:
+            self.mLUT[colors[:, 0], colors[:, 1], colors[:, 2]] = False
 
     def threshold(self, img):
         """
         **SUMMARY**
 
-        Perform a threshold operation on the given image. This involves iterating
-        over the image and comparing each pixel to the model. If the pixel is in the
-        model it is set to be either the foreground (white) or background (black) based
-        on the setting of mIsBackground.
+        Perform a threshold operation on the given image. Every pixel is looked up
+        in the model in one pass. If the pixel is in the model it is set to be either
+        the foreground (white) or background (black) based on the setting of
+        mIsBackground.
 
         **PARAMETERS**
 
@@ -168,10 +180,10 @@ class ColorModel:
             a = 255
             b = 0
 
-        rs = np.right_shift(img.getNumpy(), self.mBits).reshape(-1, 3) #bitshift down and reshape to Nx3
-        mapped = np.array(map(self.mData.has_key, map(np.ndarray.tostring, rs))) #map to True/False based on the model
-        thresh = np.where(mapped, a, b) #replace True and False with fg and bg
-        return Image(thresh.reshape(img.width, img.height))
+        rs = np.right_shift(img.getNumpyCv2(), self.mBits) #bitshift down, rows x cols x BGR
+        mapped = self.mLUT[rs[:, :, 2], rs[:, :, 1], rs[:, :, 0]] #map to True/False based on the model
+        thresh = np.where(mapped, np.uint8(a), np.uint8(b)) #replace True and False with fg and bg
+        return Image(thresh, cv2image=True, copy=False)
 
     def contains(self, c):
         """
@@ -197,8 +209,9 @@ class ColorModel:
 
 
        """
-        #reverse the color, cast to uint8, right shift, convert to string, check dict
-        return self.mData.has_key(np.right_shift(np.cast['uint8'](c[::-1]), self.mBits).tostring())
+        #reverse the color, cast to uint8, right shift, look it up
+        rs = np.right_shift(np.cast['uint8'](c[::-1]), self.mBits)
+        return bool(self.mLUT[rs[0], rs[1], rs[2]])
 
     def setIsForeground(self):
         """
@@ -256,7 +269,11 @@ class ColorModel:
         >>> cm.save("mymodel)
 
         """
-        self.mData =  load(open(filename))
+        self.reset()
+        keys = load(open(filename))
+        if len(keys):
+            colors = self._keysToColors(keys)
+            self.mLUT[colors[:, 0], colors[:, 1], colors[:, 2]] = True
 
     def save(self, filename):
         """
@@ -284,4 +301,18 @@ class ColorModel:
         This should be converted to pickle.
 
         """
-        dump(self.mData, open(filename, "wb"))
+        dump(self._colorsToKeys(), open(filename, "wb"))
+
+    def __getstate__(self):
+        #pickle the colors, not the whole table
+        return dict( isBackground = self.mIsBackground, bits = self.mBits, data = self._colorsToKeys() )
+
+    def __setstate__(self, mydict):
+        self.mIsBackground = mydict.get('isBackground', mydict.get('mIsBackground', True))
+        self.mBits = mydict.get('bits', mydict.get('mBits', 1))
+        self.reset()
+        #models pickled before the lookup table kept their colors in mData
+        keys = mydict.get('data', mydict.get('mData', {}))
+        if len(keys):
+            colors = self._keysToColors(keys)
+            self.mLUT[colors[:, 0], colors[:, 1], colors[:, 2]] = True
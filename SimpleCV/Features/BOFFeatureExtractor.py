@@ -1,6 +1,7 @@
 from SimpleCV.base import *
 from SimpleCV.ImageClass import Image
 from SimpleCV.Features.FeatureExtractorBase import *
+from scipy.spatial import cKDTree
 
 class BOFFeatureExtractor(object):
     """
@@ -21,6 +22,8 @@ class BOFFeatureExtractor(object):
     mLayout = (8,16)
     mCodebookImg = None
     mCodebook = None
+    mCodeTree = None
+    mTreeCodebook = None
 
     def __init__(self,patchsz=(11,11),numcodes=128,imglayout=(8,16),padding=0):
 
@@ -60,9 +63,11 @@ class BOFFeatureExtractor(object):
         self.mLayout = img_layout
         self.mNumCodes = numcodes
         self.mPatchSize = sz
-        rawFeatures = np.zeros(sz[0]*sz[1])#fakeout numpy so we can use vstack
+        # the patches are kept as uint8 in one buffer that grows by doubling,
+        # rather than being vstacked onto a new array for every image
+        rawFeatures = None
+        count = 0
         for path in imgdirs:
-            fcount = 0
             files = []
             for ext in IMAGE_FORMATS:
                 files.extend(glob.glob( os.path.join(path, ext)))
@@ -76,9 +81,20 @@ class BOFFeatureExtractor(object):
                 newFeat = self._getPatches(img,sz)
                 if verbose:
                     print "     Got " + str(len(newFeat)) + " features."
-                rawFeatures = np.vstack((rawFeatures,newFeat))
+                if rawFeatures is None:
+                    estimate = len(newFeat)*imgs_per_dir*len(imgdirs)
+                    rawFeatures = np.zeros((max(estimate,1),sz[0]*sz[1]),dtype=np.uint8)
+                elif count+len(newFeat) > len(rawFeatures):
+                    grown = np.zeros((max(2*len(rawFeatures),count+len(newFeat)),sz[0]*sz[1]),dtype=np.uint8)
+                    grown[0:count] = rawFeatures[0:count]
+                    rawFeatures = grown
+                rawFeatures[count:count+len(newFeat)] = newFeat
+                count = count + len(newFeat)
                 del img
-        rawFeatures = rawFeatures[1:,:] # pop the fake value we put on the top
+        if rawFeatures is None:
+            warnings.warn("No images found to build the codebook from.")
+            return None
+        rawFeatures = rawFeatures[0:count]
         if verbose:
             print "=================================="
             print "Got " + str(len(rawFeatures)) + " features "
@@ -93,22 +109,53 @@ class BOFFeatureExtractor(object):
         user will need to maintain the list of features. See the generate method
         as a guide to doing this by hand. Sz is the image patch size.
         """
-        return self._getPatches(img,sz)
+        return self._getPatches(img,sz).astype(np.float64)
 
-    def makeCodebook(self, featureStack,ncodes=128):
+    def makeCodebook(self, featureStack,ncodes=128,batchsize=1000,iterations=100):
         """
         This method will return the centroids of the k-means analysis of a large
         number of images. Ncodes is the number of centroids to find.
+        The k-means is done in mini-batches of batchsize patches, so only
+        a small random sample of the feature stack is looked at on each of
+        the iterations.
         """
-        return self._makeCodebook(featureStack,ncodes)
+        return self._makeCodebook(featureStack,ncodes,batchsize,iterations)
 
-    def _makeCodebook(self,data,ncodes=128):
+    def _makeCodebook(self,data,ncodes=128,batchsize=1000,iterations=100,tol=1e-3):
         """
-        Do the k-means ... this is slow as as shit
+        Mini-batch k-means (Sculley, "Web-Scale K-Means Clustering"). Each
+        iteration assigns a random batch of patches to their nearest centroid
+        and moves every centroid to the running mean of all the patches it
+        has been given so far.
         """
-        [centroids, membership] = cluster.kmeans2(data,ncodes, minit='points')
+        data = np.asarray(data)
+        npts = len(data)
+        seeds = np.random.choice(npts,ncodes,replace=(npts < ncodes))
+        centroids = data[seeds].astype(np.float64)
+        counts = np.zeros(ncodes)
+        batchsize = min(batchsize,npts)
+        for i in range(iterations):
+            batch = data[np.random.randint(0,npts,batchsize)].astype(np.float64)
+            codes = self._assignCodes(batch,centroids)
+            n = np.bincount(codes,minlength=ncodes).astype(np.float64)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums,codes,batch)
+            counts += n
+            hit = n > 0
+            step = (sums[hit]-n[hit,np.newaxis]*centroids[hit])/counts[hit,np.newaxis]
+            centroids[hit] += step
+            if( np.abs(step).max() < tol ):
+                break
         return(centroids)
 
+    def _assignCodes(self,data,centroids):
+        """
+        The index of the nearest centroid for each row of data, worked out
+        with one matrix product instead of a full distance matrix.
+        """
+        dist = (centroids*centroids).sum(axis=1)-2.0*np.dot(data,centroids.T)
+        return np.argmin(dist,axis=1)
+
     def _img2Codebook(self, img, patchsize, count, patch_arrangement, spacersz):
         """
         img = the image
@@ -117,23 +164,18 @@ class BOFFeatureExtractor(object):
         patch_arrangement = how are the patches grided in the image (eg 128 = (8x16) 256=(16x16) )
         spacersz = the number of pixels between patches
         """
-        img = img.toHLS()
-        lmat = cv.CreateImage((img.width,img.height), cv.IPL_DEPTH_8U, 1)
-        patch = cv.CreateImage(patchsize,cv.IPL_DEPTH_8U,1)
-        cv.Split(img.getBitmap(),None,lmat,None,None)
+        lum = img.toHLS().getNumpyCv2()[:,:,1]
         w = patchsize[0]
         h = patchsize[1]
         length = w*h
-        retVal = np.zeros(length)
+        retVal = np.zeros((patch_arrangement[0]*patch_arrangement[1],length))
+        count = 0
         for widx in range(patch_arrangement[0]):
             for hidx in range(patch_arrangement[1]):
                 x = (widx*patchsize[0])+((widx+1)*spacersz)
                 y = (hidx*patchsize[1])+((hidx+1)*spacersz)
-                cv.SetImageROI(lmat,(x,y,w,h))
-                cv.Copy(lmat,patch)
-                cv.ResetImageROI(lmat)
-                retVal = np.vstack((retVal,np.array(patch[:,:]).reshape(length)))
-        retVal = retVal[1:,:]
+                retVal[count] = lum[y:y+h,x:x+w].reshape(length)
+                count = count + 1
         return retVal
 
 
@@ -162,33 +204,62 @@ class BOFFeatureExtractor(object):
         return img
 
     def _getPatches(self,img,sz=None):
-        #retVal = [] # may need to go to np.array
+        """
+        Cut the lightness channel of the image into a grid of sz patches and
+        histogram equalize each one. The result is a uint8 array with one row
+        per patch, ordered column by column.
+        """
         if( sz is None ):
             sz = self.mPatchSize
-        img2 = img.toHLS()
-        lmat = cv.CreateImage((img.width,img.height), cv.IPL_DEPTH_8U, 1)
-        patch = cv.CreateImage(self.mPatchSize,cv.IPL_DEPTH_8U,1)
-        cv.Split(img2.getBitmap(),None,lmat,None,None)
-        wsteps = img2.width/sz[0]
-        hsteps = img2.height/sz[1]
+        lum = img.toHLS().getNumpyCv2()[:,:,1]
         w=sz[0]
         h=sz[1]
-        length = w*h
-        retVal = np.zeros(length)
-        for widx in range(wsteps):
-            for hidx in range(hsteps):
-                x = (widx*sz[0])
-                y = (hidx*sz[1])
-                cv.SetImageROI(lmat,(x,y,w,h))
-                cv.EqualizeHist(lmat,patch)
-                #cv.Copy(lmat,patch)
-                cv.ResetImageROI(lmat)
-
-                retVal = np.vstack((retVal,np.array(patch[:,:]).reshape(length)))
-                #retVal.append()
-        retVal = retVal[1:,:] # pop the fake value we put on top of the stack
+        wsteps = lum.shape[1]/w
+        hsteps = lum.shape[0]/h
+        # split the image into its grid of patches with a reshaped view
+        grid = lum[0:hsteps*h,0:wsteps*w].reshape(hsteps,h,wsteps,w)
+        patches = grid.transpose(2,0,1,3).reshape(wsteps*hsteps,h*w)
+        return self._equalizePatches(patches)
+
+    def _equalizePatches(self,patches):
+        """
+        Histogram equalize every row of a uint8 patch array at once, the
+        same way cv.EqualizeHist does for a single image.
+        """
+        npatch,length = patches.shape
+        if( npatch == 0 ):
+            return patches
+        idx = patches + (np.arange(npatch,dtype=np.intp)*256)[:,np.newaxis]
+        hist = np.bincount(idx.ravel(),minlength=npatch*256).reshape(npatch,256)
+        cdf = np.cumsum(hist,axis=1)
+        cdfmin = cdf[np.arange(npatch),patches.min(axis=1)]
+        span = length-cdfmin
+        flat = (span == 0)
+        span[flat] = 1
+        lut = np.rint((cdf-cdfmin[:,np.newaxis])*(255.0/span[:,np.newaxis]))
+        lut = np.clip(lut,0,255).astype(np.uint8)
+        retVal = lut.ravel()[idx]
+        # a patch of one value equalizes to itself
+        retVal[flat] = patches[flat]
         return retVal
 
+    def _getCodeTree(self):
+        """
+        The KD-tree of the codebook, built the first time it is needed and
+        again whenever the codebook is replaced.
+        """
+        if( self.mCodeTree is None or self.mTreeCodebook is not self.mCodebook ):
+            self.mCodeTree = cKDTree(np.asarray(self.mCodebook,dtype=np.float64))
+            self.mTreeCodebook = self.mCodebook
+        return self.mCodeTree
+
+    def _nearestCodes(self,data):
+        """
+        The index of the nearest codebook entry for each patch.
+        """
+        dist,codes = self._getCodeTree().query(data)
+        return codes
+
 
 
     def load(self,datafile):
@@ -237,15 +308,17 @@ class BOFFeatureExtractor(object):
         myFile.write(imgfname+"\n")
         myFile.close()
         if(self.mCodebookImg is None):
-            self._codebook2Img(self.mCodebook,self.mPatchSize,self.mNumCodes,self.mLayout,self.mPadding)
+            self.mCodebookImg = self._codebook2Img(self.mCodebook,self.mPatchSize,self.mNumCodes,self.mLayout,self.mPadding)
         self.mCodebookImg.save(imgfname)
         return
 
     def __getstate__(self):
         if(self.mCodebookImg is None):
-            self._codebook2Img(self.mCodebook,self.mPatchSize,self.mNumCodes,self.mLayout,self.mPadding)
+            self.mCodebookImg = self._codebook2Img(self.mCodebook,self.mPatchSize,self.mNumCodes,self.mLayout,self.mPadding)
         mydict = self.__dict__.copy()
         del mydict['mCodebook']
+        mydict.pop('mCodeTree',None)
+        mydict.pop('mTreeCodebook',None)
         return mydict
 
     def __setstate__(self, mydict):
@@ -262,9 +335,10 @@ class BOFFeatureExtractor(object):
         the provided codebook. The result are the bin counts for each codebook code.
         """
         data = self._getPatches(img)
-        p = spsd.cdist(data,self.mCodebook)
-        codes = np.argmin(p,axis=1)
-        [retVal,foo] = np.histogram(codes,self.mNumCodes,normed=True,range=(0,self.mNumCodes-1))
+        codes = self._nearestCodes(data)
+        # the same values np.histogram(codes,n,normed=True,range=(0,n-1)) gives
+        retVal = np.bincount(codes,minlength=self.mNumCodes).astype(np.float64)
+        retVal *= float(self.mNumCodes)/((self.mNumCodes-1)*len(codes))
         return retVal
 
     def reconstruct(self,img):
@@ -275,9 +349,7 @@ class BOFFeatureExtractor(object):
         """
         retVal = cv.CreateImage((img.width,img.height), cv.IPL_DEPTH_8U, 1)
         data = self._getPatches(img)
-        p = spsd.cdist(data,self.mCodebook)
-        foo = p.shape[0]
-        codes = np.argmin(p,axis=1)
+        codes = self._nearestCodes(data)
         count = 0
         wsteps = img.width/self.mPatchSize[0]
         hsteps = img.height/self.mPatchSize[1]
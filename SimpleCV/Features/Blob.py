@@ -5,6 +5,16 @@ from SimpleCV.ImageClass import Image
 from SimpleCV.Features.Detection import ShapeContextDescriptor
 import math
 import scipy.stats as sps
+import cv2
+
+def _lazyMoment(name):
+    """
+    A lazily computed spatial moment of the blob's contour.
+    """
+    def moment(self):
+        return self._mMoments.get(name, 0)
+    moment.__name__ = name
+    return LazyProperty(moment)
 
 class Blob(Feature):
     """
@@ -34,33 +44,29 @@ class Blob(Feature):
     """
     seq = '' #the cvseq object that defines this blob
     mContour = [] # the blob's outer perimeter as a set of (x,y) tuples
-    mConvexHull = [] # the convex hull contour as a set of (x,y) tuples
-    mMinRectangle = [] #the smallest box rotated to fit the blob
-    # mMinRectangle[0] = centroid (x,y)
-    # mMinRectangle[1] = (w,h)
-    # mMinRectangle[2] = angle
+    # These are computed from the contour the first time they are used:
+    # mConvexHull - the convex hull contour as a set of (x,y) tuples
+    # mMinRectangle - the smallest box rotated to fit the blob
+    #   mMinRectangle[0] = centroid (x,y)
+    #   mMinRectangle[1] = (w,h)
+    #   mMinRectangle[2] = angle
+    # mAspectRatio - the aspect ratio of mMinRectangle
+    # mHu - The seven Hu Moments
+    # mPerimeter - the length of the perimeter in pixels
+    # m01 ... m12 - the spatial moments
+    # mContourAppx - the approximated polygon
+    # mAvgColor - The average color of the blob's area.
+    # mHoleContour - list of hole contours
 
     #mBoundingBox = [] #get W/H and X/Y from this
-    mHu = [] # The seven Hu Moments
-    mPerimeter = 0 # the length of the perimeter in pixels
     mArea = 0 # the area in pixels
     m00 = 0
-    m01 = 0
-    m10 = 0
-    m11 = 0
-    m20 = 0
-    m02 = 0
-    m21 = 0
-    m12 = 0
-    mContourAppx = None
     mLabel = "" # A user label
     mLabelColor = [] # what color to draw the label
-    mAvgColor = []#The average color of the blob's area.
     #mImg =  '' #Image()# the segmented image of the blob
     #mHullImg = '' # Image() the image from the hull.
     #mMask = '' #Image()# A mask of the blob area
     #xmHullMask = '' #Image()#A mask of the hull area ... we may want to use this for the image mask.
-    mHoleContour = []  # list of hole contours
     #mVertEdgeHist = [] #vertical edge histogram
     #mHortEdgeHist = [] #horizontal edge histgram
     pickle_skip_properties = set(
@@ -68,26 +74,15 @@ class Blob(Feature):
 
     def __init__(self):
         self._scdescriptors = None
+        self._mContourArray = None #the contour as found by OpenCV
+        self._mHoleArrays = None #the holes as found by OpenCV
+        self._mAppxLevel = 3
         self.mContour = []
-        self.mConvexHull = []
-        self.mMinRectangle = [-1,-1,-1,-1,-1] #angle from this
-        self.mContourAppx = []
-        self.mHu = [-1,-1,-1,-1,-1,-1,-1]
-        self.mPerimeter = 0
         self.mArea = 0
         self.m00 = 0
-        self.m01 = 0
-        self.m10 = 0
-        self.m11 = 0
-        self.m20 = 0
-        self.m02 = 0
-        self.m21 = 0
-        self.m12 = 0
         self.mLabel = "UNASSIGNED"
         self.mLabelColor = []
-        self.mAvgColor = [-1,-1,-1]
         self.image = None
-        self.mHoleContour = []
         self.points = []
         #TODO
         # I would like to clean up the Hull mask parameters
@@ -119,6 +114,90 @@ class Blob(Feature):
             self.__dict__[realkey] = cv.CreateImageHeader((self.width(), self.height()), cv.IPL_DEPTH_8U, 1)
             cv.SetData(self.__dict__[realkey], mydict[k])
 
+    def _contourArray(self):
+        """
+        The outer contour as an OpenCV point array.
+        """
+        if self._mContourArray is None:
+            return np.array(self.mContour, dtype=np.int32).reshape(-1, 1, 2)
+        return self._mContourArray
+
+    @LazyProperty
+    def mPerimeter(self):
+        if not len(self.mContour):
+            return 0
+        return cv2.arcLength(self._contourArray(), True)
+
+    @LazyProperty
+    def mMinRectangle(self):
+        if not len(self.mContour):
+            return [-1,-1,-1,-1,-1] #angle from this
+        return cv2.minAreaRect(self._contourArray())
+
+    @LazyProperty
+    def mAspectRatio(self):
+        if( self.mMinRectangle[1][1] == 0 ):
+            return 0.0
+        return self.mMinRectangle[1][0]/self.mMinRectangle[1][1]
+
+    @LazyProperty
+    def mConvexHull(self):
+        if not len(self.mContour):
+            return []
+        return [tuple(p) for p in cv2.convexHull(self._contourArray()).reshape(-1, 2).tolist()]
+
+    @LazyProperty
+    def mContourAppx(self):
+        if not len(self.mContour):
+            return []
+        appx = cv2.approxPolyDP(self._contourArray(), self._mAppxLevel, True)
+        return [(int(p[0]), int(p[1])) for p in appx.reshape(-1, 2)]
+
+    @LazyProperty
+    def _mMoments(self):
+        if not len(self.mContour):
+            return {}
+        return cv2.moments(self._contourArray())
+
+    m01 = _lazyMoment('m01')
+    m10 = _lazyMoment('m10')
+    m11 = _lazyMoment('m11')
+    m20 = _lazyMoment('m20')
+    m02 = _lazyMoment('m02')
+    m21 = _lazyMoment('m21')
+    m12 = _lazyMoment('m12')
+
+    @LazyProperty
+    def mHu(self):
+        if not len(self.mContour):
+            return [-1,-1,-1,-1,-1,-1,-1]
+        return tuple(cv2.HuMoments(self._mMoments).flatten())
+
+    @LazyProperty
+    def mHoleContour(self):
+        if self._mHoleArrays is None:
+            return []
+        if not len(self._mHoleArrays):
+            return None
+        retVal = [[tuple(p) for p in self._mHoleArrays[0].reshape(-1, 2).tolist()]]
+        for h in self._mHoleArrays[1:]:
+            if( len(h) >= 3 ): #exclude single pixel holes
+                retVal.append([tuple(p) for p in h.reshape(-1, 2).tolist()])
+        return retVal
+
+    @LazyProperty
+    def mAvgColor(self):
+        if self.image is None or not len(self.mContour):
+            return [-1,-1,-1]
+        contour = self._contourArray()
+        x, y, w, h = cv2.boundingRect(contour)
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.drawContours(mask, [contour], -1, 255, -1, offset=(-x, -y))
+        if self._mHoleArrays:
+            cv2.drawContours(mask, self._mHoleArrays, -1, 0, -1, offset=(-x, -y))
+        avg = cv2.mean(self.image.getNumpyCv2()[y:y+h, x:x+w], mask=mask)
+        return avg[0:3]
+
     def perimeter(self):
         """
         **SUMMARY**
@@ -1214,29 +1293,39 @@ class Blob(Feature):
 
 
     def _respacePoints(self,contour, min_distance=1, max_distance=5):
-        p0 = np.array(contour[-1])
+        """
+        Walk the contour backwards from its last point, keeping each point
+        that is more than min_distance from the last kept point and filling
+        any gap longer than max_distance with evenly spaced new points.
+        """
+        if( len(contour) == 0 ):
+            return []
         min_d = min_distance**2
         max_d = max_distance**2
-        contour = [p0]+contour[:-1]
-        contour = contour[:-1]
-        retVal = [p0]
-        while len(contour) > 0:
-            pt = np.array(contour.pop())
-            dist = ((p0[0]-pt[0])**2)+((p0[1]-pt[1])**2)
-            if( dist > max_d ): # create the new point
-                # get the unit vector from p0 to pt
-                # from p0 to pt
-                a = float((pt[0]-p0[0]))
-                b = float((pt[1]-p0[1]))
-                l = np.sqrt((a**2)+(b**2))
-                punit = np.array([a/l,b/l])
-                # make it max_distance long and add it to p0
-                pn = (max_distance*punit)+p0
-                retVal.append((pn[0],pn[1]))# push the new point onto the return value
-                contour.append(pt)# push the new point onto the contour too
-                p0 = pn
-            elif( dist > min_d ):
-                p0 = np.array(pt)
+        x0,y0 = contour[-1]
+        retVal = [contour[-1]]
+        # the same visiting order as popping [p0]+contour[:-2] from the back
+        order = range(len(contour)-3,-1,-1)+[len(contour)-1]
+        for i in order:
+            pt = contour[i]
+            dx = float(pt[0]-x0)
+            dy = float(pt[1]-y0)
+            dist = (dx*dx)+(dy*dy)
+            if( dist > max_d ):
+                # step along the line to pt max_distance at a time
+                l = math.sqrt(dist)
+                nsteps = max(int(math.ceil(l/max_distance))-1,1)
+                steps = np.arange(1,nsteps+1)*(max_distance/l)
+                newx = x0+(steps*dx)
+                newy = y0+(steps*dy)
+                retVal.extend(zip(newx,newy))
+                x0 = newx[-1]
+                y0 = newy[-1]
+                dx = float(pt[0]-x0)
+                dy = float(pt[1]-y0)
+                dist = (dx*dx)+(dy*dy)
+            if( dist > min_d ):
+                x0,y0 = pt
                 retVal.append(pt)
         return retVal
 
@@ -1258,7 +1347,7 @@ class Blob(Feature):
         if( self._scdescriptors is not None ):
             return self._scdescriptors,self._completeContour
         completeContour = self._filterSCPoints()
-        descriptor = self._generateSC(completeContour)
+        descriptors = self._generateSC(completeContour)
         self._scdescriptors = descriptors
         self._completeContour = completeContour
         return descriptors,completeContour
@@ -1271,33 +1360,36 @@ class Blob(Feature):
         completeContour - All of the edge points as a long list
         r_bound - Bounds on the log part of the shape context descriptor
         """
-        data = []
-        for pt in completeContour: #
-            temp = []
-            # take each other point in the contour, center it on pt, and covert it to log polar
-            for b in completeContour:
-                r = np.sqrt((b[0]-pt[0])**2+(b[1]-pt[1])**2)
-#                if( r > 100 ):
-#                    continue
-                if( r == 0.00 ): # numpy throws an inf here that mucks the system up
-                    continue
-                r = np.log10(r)
-                theta = np.arctan2(b[0]-pt[0],b[1]-pt[1])
-                if(np.isfinite(r) and np.isfinite(theta) ):
-                    temp.append((r,theta))
-            data.append(temp)
-
-        #UHG!!! need to repeat this for all of the interior contours too
-        descriptors = []
-        #dsz = 6
-        # for each point in the contour
-        for d in data:
-            test = np.array(d)
-            # generate a 2D histrogram, and flatten it out.
-            hist,a,b = np.histogram2d(test[:,0],test[:,1],dsz,[r_bound,[np.pi*-1/2,np.pi/2]],normed=True)
-            hist = hist.reshape(1,dsz**2)
-            if(np.all(np.isfinite(hist[0]))):
-                descriptors.append(hist[0])
+        npts = len(completeContour)
+        if( npts == 0 ):
+            return np.zeros((0,dsz**2))
+        pts = np.asarray(completeContour,dtype=np.float64)
+        # every other point centered on each point, as one npts x npts array
+        dx = pts[np.newaxis,:,0]-pts[:,np.newaxis,0]
+        dy = pts[np.newaxis,:,1]-pts[:,np.newaxis,1]
+        r = np.hypot(dx,dy)
+        keep = r > 0.00 # numpy throws an inf here that mucks the system up
+        rows = np.nonzero(keep)[0]
+        r = np.log10(r[keep])
+        theta = np.arctan2(dx[keep],dy[keep])
+
+        # bin them the way np.histogram2d does, right edge included
+        bins = []
+        valid = np.ones(len(r),dtype=bool)
+        for vals,bound in [(r,r_bound),(theta,[np.pi*-1/2,np.pi/2])]:
+            edges = np.linspace(bound[0],bound[1],dsz+1)
+            idx = np.searchsorted(edges,vals,side='right')
+            idx[vals == edges[-1]] -= 1
+            valid &= (idx >= 1) & (idx <= dsz)
+            bins.append(idx-1)
+        flat = (rows*dsz+bins[0])*dsz+bins[1]
+        hist = np.bincount(flat[valid],minlength=npts*dsz*dsz).reshape(npts,dsz*dsz)
+
+        # normalize each histogram to a density, like normed=True
+        area = ((r_bound[1]-r_bound[0])/float(dsz))*(np.pi/dsz)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            descriptors = hist/(hist.sum(axis=1)[:,np.newaxis]*area)
+        descriptors = descriptors[np.all(np.isfinite(descriptors),axis=1)]
 
         self._scdescriptors = descriptors
         return descriptors
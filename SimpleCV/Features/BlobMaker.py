@@ -1,5 +1,6 @@
 from SimpleCV.base import *
-#import cv2 as cv2
+from collections import deque
+import cv2
 
 class BlobMaker:
     """
@@ -31,7 +32,7 @@ class BlobMaker:
         if (maxsize <= 0):
             maxsize = img.width * img.height
         gray = colormodel.threshold(img)
-        blobs = self.extractFromBinary(gray,img,minArea=minsize,maxArea=maxsize)
+        blobs = self.extractFromBinary(gray,img,minsize=minsize,maxsize=maxsize)
         retVal = sorted(blobs,key=lambda x: x.mArea, reverse=True)
         return FeatureSet(retVal)
 
@@ -65,12 +66,6 @@ class BlobMaker:
         maxSize  - The maximum blob size in pixels.
         * *appx_level* - The blob approximation level - an integer for the maximum distance between the true edge and the approximation edge - lower numbers yield better approximation.
         """
-        #If you hit this recursion limit may god have mercy on your soul.
-        #If you really are having problems set the value higher, but this means
-        # you have over 10,000,000 blobs in your image.
-        sys.setrecursionlimit(5000)
-        #h_next moves to the next external contour
-        #v_next() moves to the next internal contour
         if (maxsize <= 0):
             maxsize = colorImg.width * colorImg.height
 
@@ -89,84 +84,69 @@ class BlobMaker:
         if( test[0]<=ptest and test[1]<=ptest and test[2]<=ptest):
             return retVal
 
-        seq = cv.FindContours( binaryImg._getGrayscaleBitmap(), self.mMemStorage, cv.CV_RETR_TREE, cv.CV_CHAIN_APPROX_SIMPLE)
-        if not list(seq):
+        #findContours writes into its input, so hand it a copy
+        contours, hierarchy = cv2.findContours(binaryImg.getGrayNumpyCv2().copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        if not len(contours):
             warnings.warn("Unable to find Blobs. Retuning Empty FeatureSet.")
             return FeatureSet([])
-        try:
-            # note to self
-            # http://code.activestate.com/recipes/474088-tail-call-optimization-decorator/
-            retVal = self._extractFromBinary(seq,False,colorImg,minsize,maxsize,appx_level)
-        except RuntimeError,e:
-            logger.warning("You exceeded the recursion limit. This means you probably have too many blobs in your image. We suggest you do some morphological operations (erode/dilate) to reduce the number of blobs in your image. This function was designed to max out at about 5000 blobs per image.")
-        except e:
-            logger.warning("SimpleCV Find Blobs Failed - This could be an OpenCV python binding issue")
-        del seq
+        retVal = self._extractFromBinary(contours,hierarchy[0],colorImg,minsize,maxsize,appx_level)
         return FeatureSet(retVal)
 
-    def _extractFromBinary(self, seq, isaHole, colorImg,minsize,maxsize,appx_level):
+    def _extractFromBinary(self, contours, hierarchy, colorImg,minsize,maxsize,appx_level):
         """
-        The recursive entry point for the blob extraction. The blobs and holes are presented
-        as a tree and we traverse up and across the tree.
+        Walk the contour tree without recursion. Each hierarchy row is
+        (next, previous, first child, parent). Contours at even depths are blobs
+        and their children are holes, the children of holes are blobs again.
         """
         retVal = []
-
-        if( seq is None ):
-            return retVal
-
-        nextLayerDown = []
-        while True:
-            if( not isaHole ): #if we aren't a hole then we are an object, so get and return our featuress
-                temp =  self._extractData(seq,colorImg,minsize,maxsize,appx_level)
+        #breadth first, so parents are visited (and get their depth) before their children
+        depth = np.zeros(len(contours), dtype=np.int32)
+        queue = deque(np.nonzero(hierarchy[:, 3] < 0)[0])
+        while queue:
+            idx = queue.popleft()
+            child = hierarchy[idx][2]
+            while child >= 0:
+                depth[child] = depth[idx] + 1
+                queue.append(child)
+                child = hierarchy[child][0]
+            if( depth[idx] % 2 == 0 ): #if we aren't a hole then we are an object
+                temp = self._extractData(contours,hierarchy,idx,colorImg,minsize,maxsize,appx_level)
                 if( temp is not None ):
                     retVal.append(temp)
-
-            nextLayer = seq.v_next()
-
-            if nextLayer is not None:
-                nextLayerDown.append(nextLayer)
-
-            seq = seq.h_next()
-
-            if seq is None:
-                break
-
-        for nextLayer in nextLayerDown:
-            retVal += self._extractFromBinary(nextLayer, not isaHole, colorImg, minsize,maxsize,appx_level)
-
         return retVal
 
-    def _extractData(self,seq,color,minsize,maxsize,appx_level):
+    def _extractData(self,contours,hierarchy,idx,color,minsize,maxsize,appx_level):
         """
-        Extract the bulk of the data from a give blob. If the blob's are is too large
-        or too small the method returns none.
+        Extract the data we need to filter a given blob, its area and bounding box.
+        If the blob's area is too large or too small the method returns none.
+        Everything else is computed by the blob the first time it is asked for.
         """
-        if( seq is None or not len(seq)):
+        contour = contours[idx]
+        if( not len(contour) ):
+            return None
+        bb = cv2.boundingRect(contour)
+        if( bb[2]*bb[3] < minsize ): #the area can't be bigger than the box
             return None
-        area = cv.ContourArea(seq)
+        area = cv2.contourArea(contour)
         if( area < minsize or area > maxsize):
             return None
 
         retVal = Blob()
         retVal.image = color
         retVal.mArea = area
-
-        retVal.mMinRectangle = cv.MinAreaRect2(seq)
-        bb = cv.BoundingRect(seq)
+        retVal.m00 = area
         retVal.x = bb[0]+(bb[2]/2)
         retVal.y = bb[1]+(bb[3]/2)
-        retVal.mPerimeter = cv.ArcLength(seq)
-        if( seq is not None):  #KAS
-            retVal.mContour = list(seq)
-            try:
-                import cv2
-                if( retVal.mContour is not None):
-                    retVal.mContourAppx = []
-                    appx = cv2.approxPolyDP(np.array([retVal.mContour],'float32'),appx_level,True)
-                    for p in appx:
-                        retVal.mContourAppx.append((int(p[0][0]),int(p[0][1])))
-            except:
-                pass
+        retVal.mContour = [tuple(p) for p in contour.reshape(-1, 2).tolist()]
+        retVal._mContourArray = contour
+        retVal._mAppxLevel = appx_level
+
+        holes = []
+        child = hierarchy[idx][2]
+        while child >= 0:
+            holes.append(contours[child])
+            child = hierarchy[child][0]
+        retVal._mHoleArrays = holes
 
         # so this is a bit hacky....
 
@@ -181,95 +161,9 @@ class BlobMaker:
         hh = bb[3]
         retVal.points = [(xx,yy),(xx+ww,yy),(xx+ww,yy+hh),(xx,yy+hh)]
         retVal._updateExtents()
-        chull = cv.ConvexHull2(seq,cv.CreateMemStorage(),return_points=1)
-        retVal.mConvexHull = list(chull)
-        # KAS -- FLAG FOR REPLACE 6/6/2012
-        #hullMask = self._getHullMask(chull,bb)
-
-        # KAS -- FLAG FOR REPLACE 6/6/2012
-        #retVal.mHullImg = self._getBlobAsImage(chull,bb,color.getBitmap(),hullMask)
-
-        # KAS -- FLAG FOR REPLACE 6/6/2012
-        #retVal.mHullMask = Image(hullMask)
-
-        del chull
-
-        moments = cv.Moments(seq)
-
-        #This is a hack for a python wrapper bug that was missing
-        #the constants required from the ctype
-        retVal.m00 = area
-        try:
-            retVal.m10 = moments.m10
-            retVal.m01 = moments.m01
-            retVal.m11 = moments.m11
-            retVal.m20 = moments.m20
-            retVal.m02 = moments.m02
-            retVal.m21 = moments.m21
-            retVal.m12 = moments.m12
-        except:
-            retVal.m10 = cv.GetSpatialMoment(moments,1,0)
-            retVal.m01 = cv.GetSpatialMoment(moments,0,1)
-            retVal.m11 = cv.GetSpatialMoment(moments,1,1)
-            retVal.m20 = cv.GetSpatialMoment(moments,2,0)
-            retVal.m02 = cv.GetSpatialMoment(moments,0,2)
-            retVal.m21 = cv.GetSpatialMoment(moments,2,1)
-            retVal.m12 = cv.GetSpatialMoment(moments,1,2)
-
-        retVal.mHu = cv.GetHuMoments(moments)
-
-
-        # KAS -- FLAG FOR REPLACE 6/6/2012
-        mask = self._getMask(seq,bb)
-        #retVal.mMask = Image(mask)
-
-        retVal.mAvgColor = self._getAvg(color.getBitmap(),bb,mask)
-        retVal.mAvgColor = retVal.mAvgColor[0:3]
-        #retVal.mAvgColor = self._getAvg(color.getBitmap(),retVal.mBoundingBox,mask)
-        #retVal.mAvgColor = retVal.mAvgColor[0:3]
-
-        # KAS -- FLAG FOR REPLACE 6/6/2012
-        #retVal.mImg = self._getBlobAsImage(seq,bb,color.getBitmap(),mask)
-
-        retVal.mHoleContour = self._getHoles(seq)
-        retVal.mAspectRatio = retVal.mMinRectangle[1][0]/retVal.mMinRectangle[1][1]
 
         return retVal
 
-
-    def _getHoles(self,seq):
-        """
-        This method returns the holes associated with a blob as a list of tuples.
-        """
-        retVal = None
-        holes = seq.v_next()
-        if( holes is not None ):
-            retVal = [list(holes)]
-            while( holes.h_next() is not None ):
-                holes = holes.h_next();
-                temp = list(holes)
-                if( len(temp) >= 3 ): #exclude single pixel holes
-                    retVal.append(temp)
-        return retVal
-
-
-    def _getMask(self,seq,bb):
-        """
-        Return a binary image of a particular contour sequence.
-        """
-        #bb = cv.BoundingRect(seq)
-        mask = cv.CreateImage((bb[2],bb[3]),cv.IPL_DEPTH_8U,1)
-        cv.Zero(mask)
-        cv.DrawContours(mask,seq,(255),(0),0,thickness=-1, offset=(-1*bb[0],-1*bb[1]))
-        holes = seq.v_next()
-        if( holes is not None ):
-            cv.DrawContours(mask,holes,(0),(255),0,thickness=-1, offset=(-1*bb[0],-1*bb[1]))
-            while( holes.h_next() is not None ):
-                holes = holes.h_next();
-                if(holes is not None):
-                    cv.DrawContours(mask,holes,(0),(255),0,thickness=-1, offset=(-1*bb[0],-1*bb[1]))
-        return mask
-
     def _getHullMask(self,hull,bb):
         """
         Return a mask of the convex hull of a blob.
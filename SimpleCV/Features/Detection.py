@@ -115,6 +115,37 @@ class Line(Feature):
         """
         self.image.drawLine(self.end_points[0], self.end_points[1], color,width)
 
+    @classmethod
+    def measure(cls, endpoints):
+        """
+        **SUMMARY**
+
+        Get the lengths and angles of many lines at once, without making Line
+        objects for them.
+
+        **PARAMETERS**
+
+        * *endpoints* - An N x 2 x 2 array of line end points, ((x1,y1),(x2,y2)) per line.
+
+        **RETURNS**
+
+        A tuple of two numpy arrays (lengths, angles), the same values
+        length() and angle() give for each line. Angles are in degrees.
+
+        **EXAMPLE**
+
+        >>> endpoints, lengths, angles = img.findLines(returnArrays=True)
+        >>> lengths, angles = Line.measure(endpoints[lengths > 100])
+
+        """
+        endpoints = np.asarray(endpoints, dtype=np.float64).reshape(-1, 2, 2)
+        d = endpoints[:, 1, :] - endpoints[:, 0, :]
+        lengths = np.hypot(d[:, 0], d[:, 1])
+        # the angle is measured from the leftmost point
+        d[d[:, 0] < 0] *= -1
+        angles = np.degrees(np.arctan2(d[:, 1], d[:, 0]))
+        return lengths, angles
+
     def length(self):
         """
 
@@ -1515,6 +1546,48 @@ class Motion(Feature):
         points  = [(at_x+sz,at_y+sz),(at_x-sz,at_y+sz),(at_x+sz,at_y+sz),(at_x+sz,at_y-sz)]
         super(Motion, self).__init__(i, at_x, at_y, points)
 
+    @classmethod
+    def fromField(cls, i, positions, vectors, wndw):
+        """
+        **SUMMARY**
+
+        Turn a motion field from Image.findMotion(returnArrays=True) into a
+        FeatureSet of Motion features, normalized to the longest vector.
+
+        **PARAMETERS**
+
+        * *i* - the source image.
+        * *positions* - an N x 2 array of the sample (x,y) positions.
+        * *vectors* - an N x 2 array of the (dx,dy) flow vectors.
+        * *wndw* - the size of the sample window.
+
+        **RETURNS**
+
+        A FeatureSet of Motion features.
+
+        **EXAMPLE**
+
+        >>> pos, vec, mag = img2.findMotion(img1, returnArrays=True)
+        >>> moving = mag > 2.0
+        >>> Motion.fromField(img2, pos[moving], vec[moving], 11).draw()
+
+        """
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 2)
+        max_mag = 0.00
+        if len(vectors):
+            max_mag = np.hypot(vectors[:, 0], vectors[:, 1]).max()
+        norm = vectors
+        if( max_mag > 0 ):
+            norm = vectors / max_mag
+        fs = FeatureSet()
+        for (x, y), (dx, dy), (ndx, ndy) in zip(np.asarray(positions).tolist(), vectors.tolist(), norm.tolist()):
+            m = cls(i, x, y, dx, dy, wndw)
+            if( max_mag > 0 ):
+                m.norm_dx = ndx
+                m.norm_dy = ndy
+            fs.append(m)
+        return fs
+
     def draw(self, color = Color.GREEN, width=1,normalize=True):
         """
         **SUMMARY**
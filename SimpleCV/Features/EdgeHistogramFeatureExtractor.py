@@ -26,9 +26,8 @@ class EdgeHistogramFeatureExtractor(FeatureExtractorBase):
         p = max(img.width,img.height)/2
         minLine = 0.01*p
         gap = 0.1*p
-        fs = img.findLines(threshold=10,minlinelength=minLine,maxlinegap=gap)
-        ls = fs.length()/p #normalize to image length
-        angs = fs.angle()
+        endpoints,ls,angs = img.findLines(threshold=10,minlinelength=minLine,maxlinegap=gap,returnArrays=True)
+        ls = ls/p #normalize to image length
         lhist = np.histogram(ls,self.mNBins,normed=True,range=(0,1))
         ahist = np.histogram(angs,self.mNBins,normed=True,range=(-180,180))
         retVal.extend(lhist[0].tolist())
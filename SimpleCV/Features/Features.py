@@ -399,6 +399,9 @@ class FeatureSet(list):
 
 
         """
+        measures = self._measureLines()
+        if measures is not None:
+            return measures[1]
         return np.array([f.angle() for f in self])
 
     def sortAngle(self, theta = 0):
@@ -438,9 +441,21 @@ class FeatureSet(list):
         >>> lengt[0] # length of the 0th element.
 
         """
-
+        measures = self._measureLines()
+        if measures is not None:
+            return measures[0]
         return np.array([f.length() for f in self])
 
+    def _measureLines(self):
+        """
+        If every feature is a Line, measure all of them together from one
+        array of end points with Line.measure, otherwise None.
+        """
+        from SimpleCV.Features.Detection import Line
+        if len(self) == 0 or any(type(f) is not Line for f in self):
+            return None
+        return Line.measure([f.end_points for f in self])
+
     def sortLength(self):
         """
         **SUMMARY**
@@ -5,10 +5,18 @@ class HaarCascade():
     This class wraps HaarCascade files for the findHaarFeatures file.
     To use the class provide it with the path to a Haar cascade XML file and
     optionally a name.
+
+    Cascade files are parsed once per process. The classifiers are kept in a
+    registry keyed by the cascade path and handed out to findHaarFeatures, one
+    per concurrent caller, so detection loops on several threads neither
+    re-parse the XML nor share a classifier. Use HaarCascade.preload() to do
+    the parsing at startup instead of on the first frame.
     """
     _mCascade = None
     _mName = None
-    _cache = {}
+    _cache = {} #cascade path -> the cv.Load()ed cascade
+    _classifiers = {} #cascade path -> idle cv2.CascadeClassifier objects
+    _lock = threading.Lock()
     _fhandle = None
 
 
@@ -21,23 +29,8 @@ class HaarCascade():
         else:
             self._mName = name
 
-        #First checks the path given by the user, if not then checks SimpleCV's default folder
         if fname is not None:
-            if os.path.exists(fname):
-                self._fhandle = os.path.abspath(fname)
-            else:
-                self._fhandle = os.path.join(LAUNCH_PATH, 'Features','HaarCascades',fname)
-                if (not os.path.exists(self._fhandle)):
-                    logger.warning("Could not find Haar Cascade file " + fname)
-                    logger.warning("Try running the function img.listHaarFeatures() to see what is available")
-                    return None
-            
-            self._mCascade = cv.Load(self._fhandle)
-
-            if HaarCascade._cache.has_key(self._fhandle):
-                self._mCascade = HaarCascade._cache[self._fhandle]
-                return
-            HaarCascade._cache[self._fhandle] = self._mCascade
+            self._load(fname)
 
     def load(self, fname=None, name = None):
         if( name is None ):
@@ -46,24 +39,26 @@ class HaarCascade():
             self._mName = name
 
         if fname is not None:
-            if os.path.exists(fname):
-                self._fhandle = os.path.abspath(fname)
-            else:
-                self._fhandle = os.path.join(LAUNCH_PATH, 'Features','HaarCascades',fname)
-                if (not os.path.exists(self._fhandle)):
-                    logger.warning("Could not find Haar Cascade file " + fname)
-                    logger.warning("Try running the function img.listHaarFeatures() to see what is available")
-                    return None
-            
-            self._mCascade = cv.Load(self._fhandle)
-
-            if HaarCascade._cache.has_key(self._fhandle):
-                self._mCascade = HaarCascade._cache[fname]
-                return
-            HaarCascade._cache[self._fhandle] = self._mCascade
+            self._load(fname)
         else:
             logger.warning("No file path mentioned.")
 
+    def _load(self, fname):
+        #First checks the path given by the user, if not then checks SimpleCV's default folder
+        if os.path.exists(fname):
+            self._fhandle = os.path.abspath(fname)
+        else:
+            self._fhandle = os.path.join(LAUNCH_PATH, 'Features','HaarCascades',fname)
+            if (not os.path.exists(self._fhandle)):
+                logger.warning("Could not find Haar Cascade file " + fname)
+                logger.warning("Try running the function img.listHaarFeatures() to see what is available")
+                return None
+
+        with HaarCascade._lock:
+            if not HaarCascade._cache.has_key(self._fhandle):
+                HaarCascade._cache[self._fhandle] = cv.Load(self._fhandle)
+            self._mCascade = HaarCascade._cache[self._fhandle]
+
     def getCascade(self):
         return self._mCascade
 
@@ -75,3 +70,67 @@ class HaarCascade():
 
     def getFHandle(self):
         return self._fhandle
+
+    def acquireClassifier(self):
+        """
+        **SUMMARY**
+
+        Take a cv2.CascadeClassifier for this cascade out of the registry,
+        loading a new one only if every loaded classifier is in use. Hand it
+        back with releaseClassifier() when you are done with it.
+
+        **RETURNS**
+
+        A cv2.CascadeClassifier.
+
+        """
+        import cv2
+        with HaarCascade._lock:
+            idle = HaarCascade._classifiers.setdefault(self._fhandle, [])
+            if len(idle):
+                return idle.pop()
+        return cv2.CascadeClassifier(self._fhandle)
+
+    def releaseClassifier(self, classifier):
+        """
+        **SUMMARY**
+
+        Return a classifier taken with acquireClassifier() to the registry.
+
+        """
+        with HaarCascade._lock:
+            HaarCascade._classifiers.setdefault(self._fhandle, []).append(classifier)
+
+    @staticmethod
+    def preload(cascades, count=1):
+        """
+        **SUMMARY**
+
+        Load cascades into the registry ahead of time, e.g. at startup.
+
+        **PARAMETERS**
+
+        * *cascades* - A list of cascade file names or paths (anything
+          findHaarFeatures accepts).
+        * *count* - The number of classifiers to load for each cascade. Use
+          the number of threads that will run the cascade at the same time.
+
+        **RETURNS**
+
+        A list of the HaarCascade objects.
+
+        **EXAMPLE**
+
+        >>> HaarCascade.preload(["face.xml", "eye.xml"], count=4)
+
+        """
+        retVal = []
+        for fname in cascades:
+            cascade = HaarCascade(fname)
+            if not cascade.getCascade():
+                continue
+            loaded = [cascade.acquireClassifier() for i in range(count)]
+            for classifier in loaded:
+                cascade.releaseClassifier(classifier)
+            retVal.append(cascade)
+        return retVal
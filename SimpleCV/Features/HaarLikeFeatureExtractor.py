@@ -2,6 +2,7 @@ from SimpleCV.base import *
 from SimpleCV.ImageClass import Image
 from SimpleCV.Features.HaarLikeFeature import *
 from SimpleCV.Features.FeatureExtractorBase import *
+import scipy.sparse as sps
 
 class HaarLikeFeatureExtractor(FeatureExtractorBase):
     """
@@ -12,10 +13,15 @@ class HaarLikeFeatureExtractor(FeatureExtractorBase):
 
     For a more in-depth review of Haar Like features see:
     http://en.wikipedia.org/wiki/Haar-like_features
+
+    The wavelets are compiled into a sparse matrix of integral image lookups
+    and signs (once per image size), so the whole feature vector of an image
+    comes from a single sparse product with its integral image.
     """
 
     mFeatureSet = None
     mDo45 = True
+    mCompiled = None #integral image shape -> compiled wavelet bank
     def __init__(self, fname=None, do45=True):
         """
         fname - The feature file name
@@ -24,8 +30,9 @@ class HaarLikeFeatureExtractor(FeatureExtractorBase):
         """
         #we define the black (positive) and white (negative) regions of an image
         #to get our haar wavelet
-        self.mDo45 = True
-        self.mFeatureset=None;
+        self.mDo45 = do45
+        self.mFeatureSet = []
+        self.mCompiled = None
         if(fname is not None):
             self.readWavelets(fname)
 
@@ -49,10 +56,9 @@ class HaarLikeFeatureExtractor(FeatureExtractorBase):
         f.close()
         data = temp.split()
         count = int(data.pop(0))
-        self.mFeatureset = []
         if(nfeats > -1):
             count = min(count,nfeats)
-        while len(data) > 0:
+        while len(data) > 0 and len(self.mFeatureSet) < count:
             name = data.pop(0)
             nRegions = int(data.pop(0))
             region = []
@@ -62,6 +68,7 @@ class HaarLikeFeatureExtractor(FeatureExtractorBase):
 
             feat = HaarLikeFeature(name,region)
             self.mFeatureSet.append(feat)
+        self.mCompiled = None
         return None
 
     def saveWavelets(self, fname):
@@ -80,17 +87,79 @@ class HaarLikeFeatureExtractor(FeatureExtractorBase):
         This extractor takes in an image, creates the integral image, applies
         the Haar cascades, and returns the result as a feature vector.
         """
-        regular = img.integralImage()
-        retVal = []
+        return self.extractBatch([img])[0].tolist()
 
-        for i in range(len(self.mFeatureSet)):
-            retVal.append(self.mFeatureSet[i].apply(regular))
-        if(self.mDo45):
-            slant = img.integralImage(tilted=True)
-            for i in range(len(self.mFeatureSet)):
-                retVal.append(self.mFeatureSet[i].apply(regular))
+    def extractBatch(self, images):
+        """
+        **SUMMARY**
+
+        Extract the features of many images at once. The integral images of
+        images with the same size are stacked and the whole batch goes through
+        the compiled wavelet bank in one product.
+
+        **PARAMETERS**
+
+        * *images* - A list of images or an ImageSet.
+
+        **RETURNS**
+
+        A numpy array with one row per image and getNumFields() columns, in the
+        same order as extract.
+
+        **EXAMPLE**
+
+        >>> haar = HaarLikeFeatureExtractor(fname="haar.txt")
+        >>> feats = haar.extractBatch(ImageSet("./data/cats"))
+
+        """
+        nfeats = len(self.mFeatureSet)
+        retVal = np.zeros((len(images), self.getNumFields()))
+        sizes = {}
+        for i in range(len(images)):
+            sizes.setdefault((images[i].height+1, images[i].width+1), []).append(i)
+
+        for shape, members in sizes.items():
+            bank = self._compile(shape)
+            regular = np.vstack([images[i].integralImage().ravel() for i in members])
+            retVal[members, 0:nfeats] = bank.dot(regular.T).T
+            if(self.mDo45):
+                slant = np.vstack([images[i].integralImage(tilted=True).ravel() for i in members])
+                retVal[members, nfeats:] = bank.dot(slant.T).T
         return retVal
 
+    def _compile(self, shape):
+        """
+        Build the sparse (features x integral image pixels) matrix of signed
+        lookups for integral images of the given shape. These are the same
+        lookups HaarLikeFeature.apply does.
+        """
+        if(self.mCompiled is None):
+            self.mCompiled = {}
+        if(shape in self.mCompiled):
+            return self.mCompiled[shape]
+
+        w = shape[0]-1
+        h = shape[1]-1
+        rows = []
+        cols = []
+        signs = []
+        for i in range(len(self.mFeatureSet)):
+            for (p, q, r, s, t) in self.mFeatureSet[i].mRegions:
+                # sum = A - B - C + D where A is the lower right corner, B the
+                # upper right, C the lower left and D the upper left
+                for (x, y, sign) in ((r, s, t), (r, q, -t), (p, s, -t), (p, q, t)):
+                    rows.append(i)
+                    cols.append(int(w*x)*shape[1] + int(h*y))
+                    signs.append(sign)
+        bank = sps.csr_matrix((signs, (rows, cols)), shape=(len(self.mFeatureSet), shape[0]*shape[1]))
+        self.mCompiled[shape] = bank
+        return bank
+
+    def __getstate__(self):
+        mydict = self.__dict__.copy()
+        mydict['mCompiled'] = None #rebuilt on demand
+        return mydict
+
     def getFieldNames(self):
         """
         This method gives the names of each field in the feature vector in the
@@ -113,4 +182,4 @@ class HaarLikeFeatureExtractor(FeatureExtractorBase):
         mult = 1
         if(self.mDo45):
             mult = 2
-        return mult*len(self.mFeatureset)
+        return mult*len(self.mFeatureSet)
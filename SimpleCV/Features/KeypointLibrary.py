@@ -0,0 +1,231 @@
+from SimpleCV.base import *
+from SimpleCV.ImageClass import Image
+from SimpleCV.Features.Features import FeatureSet
+from SimpleCV.Features.Detection import KeypointMatch
+
+# flann has no python enums for these
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+class KeypointLibrary(object):
+    """
+    **SUMMARY**
+
+    A library of keypoint templates, e.g. the packaging of a few hundred
+    products, that can all be looked for in an image at once.
+
+    Image.findKeypointMatch builds a new FLANN index for every template it is
+    given. The library instead keeps the descriptors of every template in one
+    FLANN index (LSH for binary descriptors like ORB and BRISK) that is built
+    once, so finding all of the templates in a frame costs one query of the
+    frame's descriptors. The index can be saved so other processes can start
+    with it already built.
+
+    **PARAMETERS**
+
+    * *flavor* - The keypoint flavor, see Image.findKeypoints.
+    * *quality* - The keypoint quality threshold, see Image.findKeypoints.
+    * *highQuality* - Use the 128 value SURF descriptors.
+
+    **EXAMPLE**
+
+    >>> lib = KeypointLibrary()
+    >>> for fname in glob.glob('./products/*.png'):
+    >>>     lib.addTemplate(Image(fname), fname)
+    >>> lib.save('products.lib')
+    >>> ...
+    >>> lib = KeypointLibrary.load('products.lib')
+    >>> for name, match in lib.match(cam.getImage()).items():
+    >>>     print name, match.getHomography()
+
+    """
+    mFlavor = "SURF"
+    mQuality = 500.00
+    mHighQuality = 1
+    mNames = []         # the template names
+    mSizes = []         # the (width,height) of each template
+    mTemplates = []     # the template images, None once saved and loaded
+    mPoints = None      # N x 2 template keypoint positions
+    mOwners = None      # the template each keypoint belongs to
+    mDescriptors = None # N x D keypoint descriptors
+    mIndex = None       # the FLANN index over mDescriptors, built on first use
+
+    def __init__(self, flavor="SURF", quality=500.00, highQuality=1):
+        self.mFlavor = flavor
+        self.mQuality = quality
+        self.mHighQuality = highQuality
+        self.mNames = []
+        self.mSizes = []
+        self.mTemplates = []
+        self.mPoints = np.zeros((0,2),dtype=np.float32)
+        self.mOwners = np.zeros(0,dtype=np.int32)
+        self.mDescriptors = None
+        self.mIndex = None
+
+    def __len__(self):
+        return len(self.mNames)
+
+    def addTemplate(self, img, name=None):
+        """
+        **SUMMARY**
+
+        Find the keypoints of a template and add them to the library.
+
+        **PARAMETERS**
+
+        * *img* - The template image.
+        * *name* - The name matches of the template are reported under. The
+          image file name is used if this is None.
+
+        **RETURNS**
+
+        True if the template had keypoints and was added, False otherwise.
+
+        """
+        if( name is None ):
+            name = img.filename
+        kp,desc = img._getRawKeypoints(self.mQuality,self.mFlavor,self.mHighQuality)
+        if( kp is None or desc is None or len(kp) == 0 ):
+            logger.warning("KeypointLibrary.addTemplate: no keypoints in template " + str(name))
+            return False
+        if( self.mDescriptors is not None and
+            (desc.shape[1] != self.mDescriptors.shape[1] or desc.dtype != self.mDescriptors.dtype) ):
+            logger.warning("KeypointLibrary.addTemplate: template " + str(name) + " has a different kind of descriptor")
+            return False
+        owner = len(self.mNames)
+        self.mNames.append(name)
+        self.mSizes.append((img.width,img.height))
+        self.mTemplates.append(img)
+        pts = np.array([k.pt for k in kp],dtype=np.float32)
+        self.mPoints = np.concatenate((self.mPoints,pts))
+        self.mOwners = np.concatenate((self.mOwners,np.repeat(np.int32(owner),len(kp))))
+        if( self.mDescriptors is None ):
+            self.mDescriptors = desc.copy()
+        else:
+            self.mDescriptors = np.concatenate((self.mDescriptors,desc))
+        self.mIndex = None
+        return True
+
+    def _indexParams(self):
+        if( self.mDescriptors.dtype == np.uint8 ): # binary descriptors
+            return dict(algorithm = FLANN_INDEX_LSH, table_number = 6, key_size = 12, multi_probe_level = 1)
+        return dict(algorithm = FLANN_INDEX_KDTREE, trees = 4)
+
+    def _getIndex(self):
+        """
+        The FLANN index over every template descriptor, built on first use.
+        """
+        if( self.mIndex is None and self.mDescriptors is not None ):
+            import cv2
+            self.mIndex = cv2.flann_Index(self.mDescriptors, self._indexParams())
+        return self.mIndex
+
+    def match(self, img, ratio=0.75, minMatch=10, ransacThreshold=5.0):
+        """
+        **SUMMARY**
+
+        Find which of the templates are in an image.
+
+        **PARAMETERS**
+
+        * *img* - The image to search.
+        * *ratio* - A keypoint matches its nearest template keypoint only if that
+          one is closer than ratio times the second nearest (Lowe's ratio test).
+        * *minMatch* - The number of keypoint matches (and homography inliers) a
+          template needs to be reported.
+        * *ransacThreshold* - The RANSAC reprojection error for the homographies.
+
+        **RETURNS**
+
+        A dictionary of template name to KeypointMatch feature, one for every
+        template that was found. An empty dictionary if none were found.
+
+        """
+        found = {}
+        index = self._getIndex()
+        if( index is None ):
+            logger.warning("KeypointLibrary.match: the library is empty")
+            return found
+        skp,sd = img._getRawKeypoints(self.mQuality,self.mFlavor,self.mHighQuality)
+        if( skp is None or sd is None or len(skp) < 2 ):
+            return found
+        import cv2
+        idx,dist = index.knnSearch(sd, 2, params = {}) # one query for every template
+        idx = idx.reshape(-1,2)
+        dist = dist.reshape(-1,2).astype(np.float64)
+        if( self.mDescriptors.dtype != np.uint8 ): # the kd-tree gives squared distances
+            dist = np.sqrt(dist)
+        good = (idx[:,0] >= 0) & (dist[:,0] < ratio*dist[:,1])
+        scene = np.array([k.pt for k in skp],dtype=np.float32)[good]
+        hits = idx[good,0]
+        owners = self.mOwners[hits]
+
+        counts = np.bincount(owners, minlength=len(self.mNames))
+        for t in np.flatnonzero(counts >= max(minMatch,4)):
+            mine = owners == t
+            src = self.mPoints[hits[mine]]
+            dst = scene[mine]
+            homography,mask = cv2.findHomography(src,dst,cv2.RANSAC,ransacThreshold)
+            if( homography is None or mask.sum() < minMatch ):
+                continue
+            w,h = self.mSizes[t]
+            corners = np.array([[[0,0],[0,h],[w,h],[w,0]]],dtype=np.float32)
+            corners = cv2.perspectiveTransform(corners,homography)[0]
+            found[self.mNames[t]] = KeypointMatch(img,self.mTemplates[t],
+                                                  tuple(tuple(c) for c in corners.tolist()),homography)
+        return found
+
+    def save(self, fname):
+        """
+        **SUMMARY**
+
+        Save the library and its FLANN index. The index goes in a second file
+        next to fname, fname + '.flann'. The template images are not saved.
+
+        """
+        lib = {'flavor':self.mFlavor,
+               'quality':self.mQuality,
+               'highQuality':self.mHighQuality,
+               'names':self.mNames,
+               'sizes':self.mSizes,
+               'points':self.mPoints,
+               'owners':self.mOwners,
+               'descriptors':self.mDescriptors}
+        output = open(fname, 'wb')
+        pickle.dump(lib,output,2)
+        output.close()
+        index = self._getIndex()
+        if( index is not None ):
+            index.save(fname + '.flann')
+
+    def load(cls, fname):
+        """
+        **SUMMARY**
+
+        Load a library written by save. The saved FLANN index is read back if
+        it is there, otherwise it is rebuilt the first time it is needed.
+
+        """
+        lib = pickle.load(open(fname, 'rb'))
+        retVal = cls(lib['flavor'],lib['quality'],lib['highQuality'])
+        retVal.mNames = lib['names']
+        retVal.mSizes = lib['sizes']
+        retVal.mTemplates = [None]*len(retVal.mNames)
+        retVal.mPoints = lib['points']
+        retVal.mOwners = lib['owners']
+        retVal.mDescriptors = lib['descriptors']
+        if( retVal.mDescriptors is not None and os.path.exists(fname + '.flann') ):
+            import cv2
+            index = cv2.flann_Index()
+            if( index.load(retVal.mDescriptors, fname + '.flann') ):
+                retVal.mIndex = index
+            else:
+                logger.warning("KeypointLibrary.load: could not read " + fname + ".flann, rebuilding the index")
+        return retVal
+    load = classmethod(load)
+
+    def __getstate__(self):
+        mydict = self.__dict__.copy()
+        # the index is rebuilt from the descriptors when it is needed
+        mydict['mIndex'] = None
+        return mydict
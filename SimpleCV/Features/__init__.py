@@ -13,3 +13,4 @@ from SimpleCV.Features.HaarLikeFeature import *
 from SimpleCV.Features.PlayingCards import *
 from SimpleCV.Features.FeatureUtils import *
 from SimpleCV.Features.FaceRecognizer import *
+from SimpleCV.Features.KeypointLibrary import *
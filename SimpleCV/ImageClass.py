@@ -17,6 +17,9 @@ import scipy.cluster.vq as scv
 import scipy.linalg as nla  # for linear algebra / least squares
 import math # math... who does that
 import copy # for deep copy
+import Queue # for ImageSet prefetching
+import weakref
+from collections import OrderedDict
 #import scipy.stats.mode as spsmode
 
 class ColorSpace:
@@ -73,6 +76,16 @@ class ImageSet(list):
     >>> imgs.filelist
     >>> logo = imgs.find('simplecv.png')
 
+    Large directories can be opened lazily. Only the paths and image sizes
+    (read from the file headers) are indexed up front, and images are decoded
+    when they are accessed. Decoded images are kept in a least recently used
+    cache bounded by cache_size bytes, and the next prefetch images can be
+    decoded in a background thread while you work on the current one:
+
+    >>> imgs = ImageSet('/path/to/training/', lazy=True, prefetch=4)
+    >>> for img in imgs:
+    >>>     process(img)
+
     **TO DO**
 
     Eventually this should allow us to pull image urls / paths from csv files.
@@ -82,13 +95,31 @@ class ImageSet(list):
     """
 
     filelist = None
-    def __init__(self, directory = None):
+    _lazy = False
+    _size = None
+    def __init__(self, directory = None, lazy = False, cache_size = 256*1024*1024, prefetch = 0):
+        #lazy mode state, the list holds paths that are decoded on access
+        self._lazy = lazy
+        self._cacheSize = cache_size
+        self._prefetch = prefetch
+        self._cache = OrderedDict()
+        self._cacheBytes = 0
+        self._cacheLock = threading.RLock()
+        self._pending = {}
+        self._prefetchQueue = None
+        self._dims = {}
+        self._size = None #resize decoded images to this (width, height)
+
         if not directory:
             return
 
         if isinstance(directory,list):
             if isinstance(directory[0], Image):
                 super(ImageSet,self).__init__(directory)
+            elif (isinstance(directory[0], str) or isinstance(directory[0], unicode)) and lazy:
+                for path in directory:
+                    if self._indexPath(path):
+                        self.append(path)
             elif isinstance(directory[0], str) or isinstance(directory[0], unicode):
                 super(ImageSet,self).__init__(map(Image, directory))
 
@@ -565,6 +596,12 @@ class ImageSet(list):
 
         The number of images in the image set.
 
+        **NOTES**
+
+        If the set was created with lazy=True only the file headers are read
+        here, and filelist maps the file names to their paths instead of to
+        loaded images.
+
         **EXAMPLE**
 
         >>> imgs = ImageSet()
@@ -609,6 +646,14 @@ class ImageSet(list):
 
         self.filelist = dict()
 
+        if self._lazy:
+            #only read the headers, the images are decoded on access
+            for i in file_set:
+                if self._indexPath(i):
+                    self.filelist[os.path.basename(i)] = i
+                    self.append(i)
+            return len(self)
+
         for i in file_set:
             tmp = None
             try:
@@ -646,6 +691,12 @@ class ImageSet(list):
         >>>>   t.show()
 
         """
+        if self._lazy:
+            #resize as each image is decoded rather than all of them now
+            retVal = self._spawn(self._items())
+            retVal._size = (width, height)
+            return retVal
+
         retVal = ImageSet()
         for i in self:
             retVal.append(i.resize(width,height))
@@ -672,8 +723,13 @@ class ImageSet(list):
 
         """
         retVal = []
-        for i in self:
-            retVal.append((i.width,i.height))
+        for i in self._items():
+            if isinstance(i, Image):
+                retVal.append((i.width,i.height))
+            elif self._size is not None:
+                retVal.append(self._size)
+            else:
+                retVal.append(self._dims[i])
         return np.array(retVal)
 
     def average(self, mode="first", size=(None,None)):
@@ -716,8 +772,8 @@ class ImageSet(list):
 
         vals = self.dimensions()
         if( mode.lower()  == "first" ):
-            fw = self[0].width
-            fh = self[0].height
+            fw = vals[0][0]
+            fh = vals[0][1]
         elif( mode.lower()  == "fixed" ):
             fw = size[0]
             fh = size[1]
@@ -758,10 +814,109 @@ class ImageSet(list):
 
         """
         if type(key) is types.SliceType: #Or can use 'try:' for speed
+            if self._lazy:
+                return self._spawn(list.__getitem__(self, key))
             return ImageSet(list.__getitem__(self, key))
+        elif self._lazy:
+            if key < 0:
+                key += len(self)
+            retVal = self._decode(list.__getitem__(self,key))
+            self._prefetchFrom(key+1)
+            return retVal
         else:
             return list.__getitem__(self,key)
 
+    def __iter__(self):
+        if not self._lazy:
+            return list.__iter__(self)
+        return (self[i] for i in xrange(len(self)))
+
+    def _items(self):
+        """
+        The raw list contents, paths for images that have not been decoded.
+        """
+        return list(list.__iter__(self))
+
+    def _spawn(self, items):
+        """
+        Make a lazy ImageSet over items that shares this set's settings.
+        """
+        retVal = ImageSet(lazy=True, cache_size=self._cacheSize, prefetch=self._prefetch)
+        retVal._dims = self._dims
+        retVal._size = self._size
+        retVal.extend(items)
+        return retVal
+
+    def _indexPath(self, path):
+        """
+        Record the size of the image at path, reading only the file header
+        when PIL is around. Returns the (width, height) or None if the file
+        is not an image we can load.
+        """
+        try:
+            if PIL_ENABLED:
+                self._dims[path] = pil.open(path).size
+            else:
+                img = Image(path)
+                self._dims[path] = img.size()
+        except:
+            return None
+        return self._dims[path]
+
+    def _decode(self, item):
+        """
+        Return the image for a list item, decoding it through the cache if
+        the item is a path.
+        """
+        if isinstance(item, Image):
+            return item
+
+        while True:
+            with self._cacheLock:
+                if item in self._cache:
+                    img = self._cache.pop(item)
+                    self._cache[item] = img #most recently used goes last
+                    return img
+                pending = self._pending.get(item)
+                if pending is None:
+                    pending = self._pending[item] = threading.Event()
+                    break
+            #somebody else is decoding it, wait and look again
+            pending.wait()
+
+        try:
+            img = Image(item)
+            if self._size is not None:
+                img = img.resize(self._size[0], self._size[1])
+            with self._cacheLock:
+                self._cache[item] = img
+                self._cacheBytes += img.getNumpyCv2().nbytes
+                while self._cacheBytes > self._cacheSize and len(self._cache) > 1:
+                    path, old = self._cache.popitem(last=False)
+                    self._cacheBytes -= old.getNumpyCv2().nbytes
+        finally:
+            with self._cacheLock:
+                del self._pending[item]
+            pending.set()
+        return img
+
+    def _prefetchFrom(self, index):
+        """
+        Queue the next prefetch paths after index for the background decoder.
+        """
+        if self._prefetch <= 0:
+            return
+        if self._prefetchQueue is None:
+            self._prefetchQueue = Queue.Queue()
+            worker = threading.Thread(target=_imageSetPrefetch, args=(weakref.ref(self), self._prefetchQueue))
+            worker.daemon = True
+            worker.start()
+        for item in list.__getitem__(self, slice(index, index+self._prefetch)):
+            with self._cacheLock:
+                if isinstance(item, Image) or item in self._cache or item in self._pending:
+                    continue
+            self._prefetchQueue.put(item)
+
     def __getslice__(self, i, j):
         """
         Deprecated since python 2.0, now using __getitem__
@@ -769,6 +924,84 @@ class ImageSet(list):
         return self.__getitem__(slice(i,j))
 
 
+def _imageSetPrefetch(setref, queue):
+    """
+    Background decoder for lazy ImageSets. It only holds a weak reference to
+    the set so it goes away with the set.
+    """
+    while True:
+        try:
+            item = queue.get(timeout=1.0)
+        except Queue.Empty:
+            item = None
+        iset = setref()
+        if iset is None:
+            return
+        if item is not None:
+            try:
+                iset._decode(item)
+            except:
+                logger.warning("ImageSet: could not prefetch " + str(item))
+        del iset
+
+
+# the results of pure pixel functions, by function and then by levels
+_pixelFunctionTables = weakref.WeakKeyDictionary()
+
+def _pixelFunctionLookup(theFunc, pixels, levels, cache=False):
+    """
+    Apply a pure per pixel function by calling it once per distinct
+    (quantized) color. With cache the results are kept per function, so
+    later images only pay for the colors that have not been seen yet.
+    """
+    q = pixels.reshape(-1,3).astype(np.int32)
+    if( levels != 256 ):
+        q = (q*levels) >> 8
+    codes = (q[:,0]*levels + q[:,1])*levels + q[:,2]
+    colors, inverse = np.unique(codes, return_inverse=True)
+    tables = {}
+    if( cache ):
+        try:
+            tables = _pixelFunctionTables.setdefault(theFunc, {})
+        except TypeError: # builtins can't be weakly referenced, so don't keep them
+            pass
+    keys, values = tables.get(levels, (np.zeros(0,dtype=np.int32), np.zeros((0,3),dtype=np.uint8)))
+    idx = np.searchsorted(keys, colors)
+    known = idx < len(keys)
+    known[known] = keys[idx[known]] == colors[known]
+    if( not np.all(known) ):
+        new = colors[~known]
+        rgb = np.column_stack((new/(levels*levels), (new/levels)%levels, new%levels))
+        if( levels != 256 ): # call the function with the middle of each bin
+            rgb = ((rgb*256)+128)/levels
+        result = np.array(map(theFunc,rgb.tolist()),dtype=uint8).reshape(-1,3)
+        keys = np.concatenate((keys,new))
+        values = np.concatenate((values,result))
+        order = np.argsort(keys)
+        keys = keys[order]
+        values = values[order]
+        tables[levels] = (keys, values)
+        idx = np.searchsorted(keys, colors)
+    return values[idx[inverse]].reshape(pixels.shape)
+
+def _pixelFunctionTiles(theFunc, pixels, workers):
+    """
+    Apply a vectorized pixel function to strips of the pixel array on a
+    pool of threads. numpy lets go of the GIL for most array math so the
+    strips really run side by side.
+    """
+    if( workers <= 1 or pixels.shape[0] < 2*workers ):
+        return np.asarray(theFunc(pixels)).astype(np.uint8)
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    try:
+        tiles = pool.map(theFunc, np.array_split(pixels, workers*4))
+    finally:
+        pool.close()
+        pool.join()
+    return np.concatenate([np.asarray(t).astype(np.uint8) for t in tiles])
+
+
 class Image:
     """
     **SUMMARY**
@@ -815,13 +1048,25 @@ class Image:
     _mPalette = None
     _mPaletteMembers = None
     _mPalettePercentages = None
+    _mPalettes = None #every palette computed for the image, by (bins, hue)
+    _mFlow = None #the dense Farneback flow that ends at this frame
 
     _barcodeReader = "" #property for the ZXing barcode reader
 
 
-    #these are buffer frames for various operations on the image
+    #the canonical pixel buffer, a C-contiguous (rows, cols, channels) numpy
+    #array in OpenCV channel order. Everything below is derived from it.
+    #Images made from a single channel array keep _grayBuffer as the canonical
+    #buffer instead and leave this as None until something needs color.
+    _buffer = None
+
+    #these are views over _buffer, created on first access
     _bitmap = ""  #the bitmap (iplimage)  representation of the image
     _matrix = ""  #the matrix (cvmat) representation
+    _numpy = None #numpy form (width x height x RGB) view
+
+    #these are buffer frames for various operations on the image
+    _grayBuffer = None #the grayscale buffer (rows, cols)
     _grayMatrix = "" #the gray scale (cvmat) representation -KAS
     _graybitmap = ""  #a reusable 8-bit grayscale bitmap
     _equalizedgraybitmap = "" #the above bitmap, normalized
@@ -829,12 +1074,9 @@ class Image:
     _edgeMap = "" #holding reference for edge map
     _cannyparam = (0, 0) #parameters that created _edgeMap
     _pil = "" #holds a PIL object in buffer
-    _numpy = "" #numpy form buffer
-    _grayNumpy = "" # grayscale numpy for keypoint stuff
+    _grayNumpy = None # grayscale numpy for keypoint stuff
     _colorSpace = ColorSpace.UNKNOWN #Colorspace Object
     _pgsurface = ""
-    _cv2Numpy = None #numpy array for OpenCV >= 2.3
-    _cv2GrayNumpy = None #grayscale numpy array for OpenCV >= 2.3
     _gridLayer = [None,[0,0]]#to store grid details | Format -> [gridIndex , gridDimensions]
 
     #For DFT Caching
@@ -848,10 +1090,15 @@ class Image:
     #temp files
     _tempFiles = []
 
-    #when we empty the buffers, populate with this:
-    _initialized_buffers = {
+    #when we replace the canonical buffer, drop the views with this:
+    _initialized_views = {
         "_bitmap": "",
         "_matrix": "",
+        "_numpy": None}
+
+    #when we invalidate the derived buffers, populate with this:
+    _initialized_buffers = {
+        "_grayBuffer": None,
         "_grayMatrix": "",
         "_graybitmap": "",
         "_equalizedgraybitmap": "",
@@ -859,11 +1106,21 @@ class Image:
         "_edgeMap": "",
         "_cannyparam": (0, 0),
         "_pil": "",
-        "_numpy": "",
-        "_grayNumpy":"",
-        "_pgsurface": "",
-        "_cv2GrayNumpy": "",
-        "_cv2Numpy":""}
+        "_grayNumpy": None,
+        "_pgsurface": ""}
+
+    #the derived buffers to keep when the gray buffer is the canonical one
+    _gray_buffers = ("_grayBuffer", "_grayMatrix", "_graybitmap", "_grayNumpy")
+
+    #numpy dtypes to their IplImage depth
+    _ipl_depths = {
+        np.dtype(np.uint8): cv.IPL_DEPTH_8U,
+        np.dtype(np.int8): cv.IPL_DEPTH_8S,
+        np.dtype(np.uint16): cv.IPL_DEPTH_16U,
+        np.dtype(np.int16): cv.IPL_DEPTH_16S,
+        np.dtype(np.int32): cv.IPL_DEPTH_32S,
+        np.dtype(np.float32): cv.IPL_DEPTH_32F,
+        np.dtype(np.float64): cv.IPL_DEPTH_64F}
 
     #The variables _uncroppedX and _uncroppedY are used to buffer the points when we crop the image.
     _uncroppedX = 0
@@ -880,7 +1137,7 @@ class Image:
     #initialize the frame
     #parameters: source designation (filename)
     #todo: handle camera/capture from file cases (detect on file extension)
-    def __init__(self, source = None, camera = None, colorSpace = ColorSpace.UNKNOWN,verbose=True, sample=False, cv2image=False, webp=False):
+    def __init__(self, source = None, camera = None, colorSpace = ColorSpace.UNKNOWN,verbose=True, sample=False, cv2image=False, webp=False, copy=True):
         """
         **SUMMARY**
 
@@ -898,6 +1155,14 @@ class Image:
 
         * *sample* - This is set to true if you want to load some of the included sample images without having to specify the complete path
 
+        * *copy* - If this is False, cv2image is True and the source is a C-contiguous uint8 numpy array, either
+          rows x cols x BGR or rows x cols single channel, the image uses the array as its pixel buffer without
+          copying it. Any other source, including every array without cv2image (those are transposed first), is
+          copied as usual. Single channel arrays stay single channel and a three channel buffer is only built if
+          something needs it. That buffer, and so getNumpy, getBitmap and getPIL, is a snapshot taken when it
+          is built and does not follow later changes to the array; only the single channel views
+          (getGrayNumpyCv2 and friends) keep sharing it.
+
 
         **EXAMPLES**
 
@@ -927,6 +1192,7 @@ class Image:
         self._mPalette = None
         self._mPaletteMembers = None
         self._mPalettePercentages = None
+        self._mPalettes = {}
         #Temp files
         self._tempFiles = []
 
@@ -980,72 +1246,63 @@ class Image:
         if (type(source) == tuple):
             w = int(source[0])
             h = int(source[1])
-            source = cv.CreateImage((w,h), cv.IPL_DEPTH_8U, 3)
-            cv.Zero(source)
-        if (type(source) == cv.cvmat):
-            self._matrix = cv.CreateMat(source.rows, source.cols, cv.CV_8UC3)
-            if((source.step/source.cols)==3): #this is just a guess
-                cv.Copy(source, self._matrix, None)
+            self._setBuffer(np.zeros((h, w, 3), dtype=np.uint8))
+        elif (type(source) == cv.cvmat):
+            mat = np.array(source)
+            if(len(mat.shape) == 3 and mat.shape[2] == 3):
+                self._setBuffer(mat)
                 self._colorSpace = ColorSpace.BGR
-            elif((source.step/source.cols)==1):
-                cv.Merge(source, source, source, None, self._matrix)
-                self._colorSpace = ColorSpace.GRAY 
+            elif(len(mat.shape) == 2 or mat.shape[2] == 1):
+                self._setGrayBuffer(mat.reshape(mat.shape[0], mat.shape[1]))
+                self._colorSpace = ColorSpace.GRAY
             else:
+                self._setBuffer(np.zeros((source.rows, source.cols, 3), dtype=np.uint8))
                 self._colorSpace = ColorSpace.UNKNOWN
-                warnings.warn("Unable to process the provided cvmat") 
+                warnings.warn("Unable to process the provided cvmat")
 
 
         elif (type(source) == np.ndarray):  #handle a numpy array conversion
             if (type(source[0, 0]) == np.ndarray): #we have a 3 channel array
-                #convert to an iplimage bitmap
-                source = source.astype(np.uint8)
-                self._numpy = source
                 if not cv2image:
-                    invertedsource = source[:, :, ::-1].transpose([1, 0, 2])
-                else:
-                    # If the numpy array is from cv2, then it must not be transposed.
-                    invertedsource = source
+                    source = source[:, :, ::-1].transpose([1, 0, 2])
+                #else the numpy array is from cv2, so it must not be transposed.
 
-                #invertedsource = source[:, :, ::-1].transpose([1, 0, 2]) # do not un-comment. breaks cv2 image support
-                self._bitmap = cv.CreateImageHeader((invertedsource.shape[1], invertedsource.shape[0]), cv.IPL_DEPTH_8U, 3)
-                cv.SetData(self._bitmap, invertedsource.tostring(),
-                    invertedsource.dtype.itemsize * 3 * invertedsource.shape[1])
+                if (not copy and self._canWrap(source)):
+                    self._setBuffer(source)
+                else:
+                    #a single pass does the cast, the reorder and the copy
+                    self._setBuffer(np.array(source, dtype=np.uint8, order='C'))
                 self._colorSpace = ColorSpace.BGR #this is an educated guess
             else:
-                #we have a single channel array, convert to an RGB iplimage
-
-                source = source.astype(np.uint8)
+                #we have a single channel array, keep it that way
                 if not cv2image:
                     source = source.transpose([1,0]) #we expect width/height but use col/row
-                self._bitmap = cv.CreateImage((source.shape[1], source.shape[0]), cv.IPL_DEPTH_8U, 3)
-                channel = cv.CreateImageHeader((source.shape[1], source.shape[0]), cv.IPL_DEPTH_8U, 1)
-                #initialize an empty channel bitmap
-                cv.SetData(channel, source.tostring(),
-                    source.dtype.itemsize * source.shape[1])
-                cv.Merge(channel, channel, channel, None, self._bitmap)
+                if (not copy and self._canWrap(source)):
+                    self._setGrayBuffer(source)
+                else:
+                    self._setGrayBuffer(np.array(source, dtype=np.uint8, order='C'))
                 self._colorSpace = ColorSpace.BGR
 
 
         elif (type(source) == cv.iplimage):
+            mat = np.asarray(cv.GetMat(source))
             if (source.nChannels == 1):
-                self._bitmap = cv.CreateImage(cv.GetSize(source), source.depth, 3)
-                cv.Merge(source, source, source, None, self._bitmap)
+                self._setGrayBuffer(np.array(mat.reshape(mat.shape[0], mat.shape[1]), order='C'))
                 self._colorSpace = ColorSpace.GRAY
             else:
-                self._bitmap = cv.CreateImage(cv.GetSize(source), source.depth, 3)
-                cv.Copy(source, self._bitmap, None) 
+                #copy, the caller may keep writing into its bitmap
+                self._setBuffer(np.array(mat, order='C'))
                 self._colorSpace = ColorSpace.BGR
         elif (type(source) == type(str()) or source.__class__.__name__ == 'StringIO'):
             if source == '':
                 raise IOError("No filename provided to Image constructor")
 
-        
+
             elif webp or source.split('.')[-1] == 'webp':
                 try:
                     if source.__class__.__name__ == 'StringIO':
                       source.seek(0) # set the stringIO to the begining
-                    self._pil = pil.open(source)
-                    self._bitmap = cv.CreateImageHeader(self._pil.size, cv.IPL_DEPTH_8U, 3)
+                    self._setPIL(pil.open(source))
                 except:
                     try:
                         from webm import decode as webmDecode
@@ -1059,31 +1316,28 @@ class Image:
                         "RGB", (result.width, result.height), str(result.bitmap),
                         "raw", "RGB", 0, 1
                     )
-                    self._pil = webpImage.convert("RGB")
-                    self._bitmap = cv.CreateImageHeader(self._pil.size, cv.IPL_DEPTH_8U, 3)
+                    self._setPIL(webpImage)
                     self.filename = source
-                cv.SetData(self._bitmap, self._pil.tostring())
-                cv.CvtColor(self._bitmap, self._bitmap, cv.CV_RGB2BGR)
 
             else:
                 self.filename = source
                 try:
-                    self._bitmap = cv.LoadImage(self.filename, iscolor=cv.CV_LOAD_IMAGE_COLOR)
+                    bitmap = cv.LoadImage(self.filename, iscolor=cv.CV_LOAD_IMAGE_COLOR)
+                    #we own the freshly loaded bitmap, so wrap it rather than
+                    #copy it (unless its rows are padded)
+                    self._setBuffer(np.ascontiguousarray(np.asarray(cv.GetMat(bitmap))))
                 except:
-                    self._pil = pil.open(self.filename).convert("RGB")
-                    self._bitmap = cv.CreateImageHeader(self._pil.size, cv.IPL_DEPTH_8U, 3)
-                    cv.SetData(self._bitmap, self._pil.tostring())
-                    cv.CvtColor(self._bitmap, self._bitmap, cv.CV_RGB2BGR)
+                    self._setPIL(pil.open(self.filename))
 
                 #TODO, on IOError fail back to PIL
                 self._colorSpace = ColorSpace.BGR
 
 
         elif (type(source) == pg.Surface):
+            w, h = source.get_size()
+            rgb = np.fromstring(pg.image.tostring(source, "RGB"), dtype=np.uint8).reshape(h, w, 3)
+            self._setBuffer(np.ascontiguousarray(rgb[:, :, ::-1]))
             self._pgsurface = source
-            self._bitmap = cv.CreateImageHeader(self._pgsurface.get_size(), cv.IPL_DEPTH_8U, 3)
-            cv.SetData(self._bitmap, pg.image.tostring(self._pgsurface, "RGB"))
-            cv.CvtColor(self._bitmap, self._bitmap, cv.CV_RGB2BGR)
             self._colorSpace = ColorSpace.BGR
 
 
@@ -1093,16 +1347,8 @@ class Image:
                 or source.__class__.__name__ == "WebPPImageFile"
                 or  source.__class__.__name__ == "Image")):
 
-            if source.mode != 'RGB':
-                source = source.convert('RGB')
-            self._pil = source
-            #from the opencv cookbook
-            #http://opencv.willowgarage.com/documentation/python/cookbook.html
-            self._bitmap = cv.CreateImageHeader(self._pil.size, cv.IPL_DEPTH_8U, 3)
-            cv.SetData(self._bitmap, self._pil.tostring())
+            self._setPIL(source)
             self._colorSpace = ColorSpace.BGR
-            cv.CvtColor(self._bitmap, self._bitmap, cv.CV_RGB2BGR)
-            #self._bitmap = cv.iplimage(self._bitmap)
 
 
         else:
@@ -1113,12 +1359,6 @@ class Image:
             self._colorSpace = colorSpace
 
 
-        bm = self.getBitmap()
-        self.width = bm.width
-        self.height = bm.height
-        self.depth = bm.depth
-
-
     def __del__(self):
         """
         This is called when the instance is about to be destroyed also called a destructor.
@@ -1793,11 +2033,13 @@ class Image:
         :py:meth:`getGrayNumpy`
         :py:meth:`getGrayscaleMatrix`
 
+        **NOTES**
+
+        The bitmap is a view over the image's pixel buffer, it is not a copy.
+
         """
-        if (self._bitmap):
-            return self._bitmap
-        elif (self._matrix):
-            self._bitmap = cv.GetImage(self._matrix)
+        if (not self._bitmap):
+            self._bitmap = cv.GetImage(self.getMatrix())
         return self._bitmap
 
 
@@ -1828,12 +2070,14 @@ class Image:
         :py:meth:`getGrayNumpy`
         :py:meth:`getGrayscaleMatrix`
 
+        **NOTES**
+
+        The matrix is a view over the image's pixel buffer, it is not a copy.
+
         """
-        if (self._matrix):
-            return self._matrix
-        else:
-            self._matrix = cv.GetMat(self.getBitmap()) #convert the bitmap to a matrix
-            return self._matrix
+        if (not self._matrix):
+            self._matrix = cv.fromarray(self._getBuffer()) #shares the buffer's memory
+        return self._matrix
 
 
     def getFPMatrix(self):
@@ -1902,9 +2146,8 @@ class Image:
         if (not PIL_ENABLED):
             return None
         if (not self._pil):
-            rgbbitmap = self.getEmpty()
-            cv.CvtColor(self.getBitmap(), rgbbitmap, cv.CV_BGR2RGB)
-            self._pil = pil.fromstring("RGB", self.size(), rgbbitmap.tostring())
+            #the raw BGR decoder swaps the channels while PIL copies the buffer in
+            self._pil = pil.frombuffer("RGB", self.size(), self._getBuffer().data, "raw", "BGR", 0, 1)
         return self._pil
 
 
@@ -1933,12 +2176,14 @@ class Image:
         :py:meth:`getGrayNumpy`
         :py:meth:`getGrayscaleMatrix`
 
-        """
-        if( self._grayNumpy != "" ):
-            return self._grayNumpy
-        else:
-            self._grayNumpy = uint8(np.array(cv.GetMat(self._getGrayscaleBitmap())).transpose())
+        **NOTES**
+
+        The returned array is a view over the image's grayscale buffer, copy it
+        before modifying it.
 
+        """
+        if( self._grayNumpy is None ):
+            self._grayNumpy = self.getGrayNumpyCv2().transpose()
         return self._grayNumpy
 
     def getNumpy(self):
@@ -1965,13 +2210,14 @@ class Image:
         :py:meth:`getGrayNumpy`
         :py:meth:`getGrayscaleMatrix`
 
-        """
-
-        if self._numpy != "":
-            return self._numpy
+        **NOTES**
 
+        The returned array is a view over the image's pixel buffer, copy it
+        before modifying it.
 
-        self._numpy = np.array(self.getMatrix())[:, :, ::-1].transpose([1, 0, 2])
+        """
+        if self._numpy is None:
+            self._numpy = self._getBuffer()[:, :, ::-1].transpose([1, 0, 2])
         return self._numpy
 
     def getNumpyCv2(self):
@@ -2000,11 +2246,12 @@ class Image:
         :py:meth:`getNumpy`
         :py:meth:`getGrayNumpyCv2`
 
-        """
+        **NOTES**
+
+        This is the image's pixel buffer itself, copy it before modifying it.
 
-        if type(self._cv2Numpy) is not np.ndarray:
-            self._cv2Numpy = np.array(self.getMatrix())
-        return self._cv2Numpy
+        """
+        return self._getBuffer()
 
     def getGrayNumpyCv2(self):
         """
@@ -2032,34 +2279,39 @@ class Image:
         :py:meth:`getNumpy`
         :py:meth:`getGrayNumpyCv2`
 
+        **NOTES**
+
+        This is the image's grayscale buffer itself, copy it before modifying it.
+
         """
-        if type(self._cv2GrayNumpy) is not np.ndarray:
-            self._cv2GrayNumpy = np.array(self.getGrayscaleMatrix())
-        return self._cv2GrayNumpy
+        self._getGrayscaleBitmap()
+        return self._grayBuffer
 
     def _getGrayscaleBitmap(self):
         if (self._graybitmap):
             return self._graybitmap
 
-
-        self._graybitmap = self.getEmpty(1)
+        #the gray bitmap is a view over the grayscale buffer
+        bitmap = self.getBitmap()
+        self._grayBuffer = np.zeros((self.height, self.width), dtype=np.uint8)
+        self._graybitmap = cv.GetImage(cv.fromarray(self._grayBuffer))
         temp = self.getEmpty(3)
         if( self._colorSpace == ColorSpace.BGR or
                 self._colorSpace == ColorSpace.UNKNOWN ):
-            cv.CvtColor(self.getBitmap(), self._graybitmap, cv.CV_BGR2GRAY)
+            cv.CvtColor(bitmap, self._graybitmap, cv.CV_BGR2GRAY)
         elif( self._colorSpace == ColorSpace.RGB):
-            cv.CvtColor(self.getBitmap(), self._graybitmap, cv.CV_RGB2GRAY)
+            cv.CvtColor(bitmap, self._graybitmap, cv.CV_RGB2GRAY)
         elif( self._colorSpace == ColorSpace.HLS ):
-            cv.CvtColor(self.getBitmap(), temp, cv.CV_HLS2RGB)
+            cv.CvtColor(bitmap, temp, cv.CV_HLS2RGB)
             cv.CvtColor(temp, self._graybitmap, cv.CV_RGB2GRAY)
         elif( self._colorSpace == ColorSpace.HSV ):
-            cv.CvtColor(self.getBitmap(), temp, cv.CV_HSV2RGB)
+            cv.CvtColor(bitmap, temp, cv.CV_HSV2RGB)
             cv.CvtColor(temp, self._graybitmap, cv.CV_RGB2GRAY)
         elif( self._colorSpace == ColorSpace.XYZ ):
-            cv.CvtColor(self.getBitmap(), retVal, cv.CV_XYZ2RGB)
+            cv.CvtColor(bitmap, temp, cv.CV_XYZ2RGB)
             cv.CvtColor(temp, self._graybitmap, cv.CV_RGB2GRAY)
         elif( self._colorSpace == ColorSpace.GRAY):
-            cv.Split(self.getBitmap(), self._graybitmap, self._graybitmap, self._graybitmap, None)
+            cv.Split(bitmap, self._graybitmap, self._graybitmap, self._graybitmap, None)
         else:
             logger.warning("Image._getGrayscaleBitmap: There is no supported conversion to gray colorspace")
             return None
@@ -2094,11 +2346,10 @@ class Image:
         :py:meth:`getMatrix`
 
         """
-        if (self._grayMatrix):
-            return self._grayMatrix
-        else:
-            self._grayMatrix = cv.GetMat(self._getGrayscaleBitmap()) #convert the bitmap to a matrix
-            return self._grayMatrix
+        if (not self._grayMatrix):
+            self._getGrayscaleBitmap()
+            self._grayMatrix = cv.fromarray(self._grayBuffer) #shares the gray buffer's memory
+        return self._grayMatrix
 
 
     def _getEqualizedGrayscaleBitmap(self):
@@ -2279,9 +2530,7 @@ class Image:
 
 
             if (type(fh) == InstanceType and fh.__class__.__name__ == "JpegStreamer"):
-                fh.jpgdata = StringIO()
-                saveimg.getPIL().save(fh.jpgdata, "jpeg", **params) #save via PIL to a StringIO handle
-                fh.refreshtime = time.time()
+                fh.writeFrame(saveimg, **params) #encoded once and shared by every client
                 self.filename = ""
                 self.filehandle = fh
 
@@ -2414,9 +2663,7 @@ class Image:
         >>> img2 = img.copy()
 
         """
-        newimg = self.getEmpty()
-        cv.Copy(self.getBitmap(), newimg)
-        return Image(newimg, colorSpace=self._colorSpace)
+        return Image(self.getBitmap(), colorSpace=self._colorSpace)
 
     def upload(self,dest,api_key=None,api_secret=None, verbose = True):
         """
@@ -3328,7 +3575,10 @@ class Image:
         """
         
         if colorSpace == None:
-			return tuple(cv.Avg(self.getBitmap())[0:3]) 
+            if self._buffer is None: #single channel, no need to build the color buffer
+                gray = cv2.mean(self._grayBuffer)[0]
+                return (gray, gray, gray)
+            return tuple(cv.Avg(self.getBitmap())[0:3])
 			
         elif colorSpace == 'BGR':
             return tuple(cv.Avg(self.toBGR().getBitmap())[0:3])
@@ -3611,7 +3861,8 @@ class Image:
         For more information, consult the cv.HaarDetectObjects documentation.
 
         To see what features are available run img.listHaarFeatures() or you can
-        provide your own haarcascade file if you have one available.
+        provide your own haarcascade file if you have one available. Cascades are
+        loaded once per process and reused, see HaarCascade.preload().
 
         Note that the cascade parameter can be either a filename, or a HaarCascade
         loaded with cv.Load(), or a SimpleCV HaarCascade object.
@@ -3682,8 +3933,12 @@ class Image:
         # added all of the arguments from the opencv docs arglist
         try:
             import cv2
-            haarClassify = cv2.CascadeClassifier(cascade.getFHandle())
-            objects = haarClassify.detectMultiScale(self.getGrayNumpyCv2(),scaleFactor=scale_factor,minNeighbors=min_neighbors,minSize=min_size,flags=use_canny)
+            #reuse a classifier from the registry rather than parsing the xml again
+            haarClassify = cascade.acquireClassifier()
+            try:
+                objects = haarClassify.detectMultiScale(self.getGrayNumpyCv2(),scaleFactor=scale_factor,minNeighbors=min_neighbors,minSize=min_size,flags=use_canny)
+            finally:
+                cascade.releaseClassifier(haarClassify)
             cv2flag = True
 
         except ImportError:
@@ -3798,7 +4053,7 @@ class Image:
 
         """
         if self.width and self.height:
-            return cv.GetSize(self.getBitmap())
+            return (self.width, self.height)
         else:
             return (0, 0)
 
@@ -4013,7 +4268,7 @@ class Image:
         #TODO CHECK CURVE SIZE
         temp  = cv.CreateImage(self.size(), 8, 3)
         #Move to HLS space
-        cv.CvtColor(self._bitmap, temp, cv.CV_RGB2HLS)
+        cv.CvtColor(self.getBitmap(), temp, cv.CV_RGB2HLS)
         tempMat = cv.GetMat(temp) #convert the bitmap to a matrix
         #now apply the color curve correction
         tempMat = np.array(self.getMatrix()).copy()
@@ -4656,12 +4911,12 @@ class Image:
     def __setitem__(self, coord, value):
         value = tuple(reversed(value))  #RGB -> BGR
 
+        #the matrix is a view, so only the derived buffers go stale
         if(isinstance(coord[0],slice)):
             cv.Set(self.getMatrix()[tuple(reversed(coord))], value)
-            self._clearBuffers("_matrix")
         else:
             self.getMatrix()[tuple(reversed(coord))] = value
-            self._clearBuffers("_matrix")
+        self._invalidateBuffers()
 
 
 
@@ -4786,10 +5041,70 @@ class Image:
         return Image(newbitmap, colorSpace=self._colorSpace)
 
 
-    def _clearBuffers(self, clearexcept = "_bitmap"):
+    def _setBuffer(self, buf):
+        """
+        Replace the canonical pixel buffer. The bitmap, matrix and numpy views
+        over the old buffer are dropped along with every derived buffer.
+        """
+        self._buffer = buf
+        for k, v in self._initialized_views.items():
+            self.__dict__[k] = v
+        self._invalidateBuffers()
+        self.height = buf.shape[0]
+        self.width = buf.shape[1]
+        self.depth = self._ipl_depths.get(buf.dtype, cv.IPL_DEPTH_8U)
+
+    def _setGrayBuffer(self, buf):
+        """
+        Make a single channel (rows, cols) array the canonical pixel buffer.
+        The three channel buffer is built from it the first time it is needed.
+        """
+        self._buffer = None
+        for k, v in self._initialized_views.items():
+            self.__dict__[k] = v
         for k, v in self._initialized_buffers.items():
-            if k == clearexcept:
-                continue
+            self.__dict__[k] = v
+        self._grayBuffer = buf
+        self._graybitmap = cv.GetImage(cv.fromarray(buf))
+        self.height = buf.shape[0]
+        self.width = buf.shape[1]
+        self.depth = self._ipl_depths.get(buf.dtype, cv.IPL_DEPTH_8U)
+
+    def _getBuffer(self):
+        """
+        The three channel pixel buffer, expanding the gray buffer if the image
+        was made from a single channel array.
+        """
+        if self._buffer is None:
+            self._buffer = cv2.cvtColor(self._grayBuffer, cv2.COLOR_GRAY2BGR)
+        return self._buffer
+
+    def _canWrap(self, arr):
+        """
+        True if the image can use arr as its pixel buffer without a copy.
+        """
+        return (arr.dtype == np.uint8 and arr.flags['C_CONTIGUOUS']
+                and arr.flags['WRITEABLE'] and (arr.ndim == 2 or arr.shape[2] == 3))
+
+    def _setPIL(self, pilimg):
+        """
+        Fill the canonical pixel buffer from a PIL image and keep the PIL
+        image around as the cached PIL representation.
+        """
+        if pilimg.mode != 'RGB':
+            pilimg = pilimg.convert('RGB')
+        self._setBuffer(np.ascontiguousarray(np.asarray(pilimg)[:, :, ::-1]))
+        self._pil = pilimg
+
+    def _invalidateBuffers(self):
+        """
+        Drop everything derived from the pixel buffer (gray, PIL, pygame, edge
+        maps...). Call this after writing into the buffer or one of its views.
+        """
+        grayOnly = self._buffer is None
+        for k, v in self._initialized_buffers.items():
+            if grayOnly and k in self._gray_buffers:
+                continue #the gray buffer is the pixel buffer
             self.__dict__[k] = v
 
 
@@ -4931,7 +5246,7 @@ class Image:
 
     #this function contains two functions -- the basic edge detection algorithm
     #and then a function to break the lines down given a threshold parameter
-    def findLines(self, threshold=80, minlinelength=30, maxlinegap=10, cannyth1=50, cannyth2=100, useStandard=False, nLines=-1, maxpixelgap=1):
+    def findLines(self, threshold=80, minlinelength=30, maxlinegap=10, cannyth1=50, cannyth2=100, useStandard=False, nLines=-1, maxpixelgap=1, returnArrays=False):
         """
         **SUMMARY**
 
@@ -4950,11 +5265,18 @@ class Image:
         * *useStandard* - use standard or probabilistic Hough transform.
         * *nLines* - maximum number of lines for return.
         * *maxpixelgap* - how much distance between pixels is allowed to consider them the same line.
+        * *returnArrays* - return the lines as numpy arrays instead of Line objects.
 
         **RETURNS**
 
         Returns a :py:class:`FeatureSet` of :py:class:`Line` objects. If no lines are found the method returns None.
 
+        If returnArrays is True a tuple of numpy arrays (endpoints, lengths, angles)
+        is returned instead, where endpoints is N x 2 x 2 with ((x1,y1),(x2,y2))
+        for each line and lengths and angles are what Line.length() and
+        Line.angle() would give. This skips building a Line for every line,
+        which is much faster when only the measurements are needed.
+
         **EXAMPLE**
 
         >>> img = Image("lenna")
@@ -4962,6 +5284,9 @@ class Image:
         >>> lines.draw()
         >>> img.show()
 
+        >>> endpoints, lengths, angles = img.findLines(returnArrays=True)
+        >>> print np.histogram(angles, 8, range=(-180,180))
+
         **SEE ALSO**
         :py:class:`FeatureSet`
         :py:class:`Line`
@@ -4970,7 +5295,7 @@ class Image:
         """
         em = self._getEdgeMap(cannyth1, cannyth2)
         
-        linesFS = FeatureSet()
+        segments = []
         if useStandard:
             lines = cv.HoughLines2(em, cv.CreateMemStorage(), cv.CV_HOUGH_STANDARD, 1.0, cv.CV_PI/180.0, threshold, minlinelength, maxlinegap)
             if nLines == -1:
@@ -5047,17 +5372,27 @@ class Image:
                     else:
                         dist += 1
     
-                for l in ls:
-                    linesFS.append(Line(self, l))
-            linesFS = linesFS[:nLines]
-        else:
-            lines = cv.HoughLines2(em, cv.CreateMemStorage(), cv.CV_HOUGH_PROBABILISTIC, 1.0, cv.CV_PI/180.0, threshold, minlinelength, maxlinegap)
-            if nLines == -1:
-                nLines = len(lines)
+                segments.extend(ls)
+            segments = segments[:nLines]
+        else:
+            # the probabilistic transform hands back all the end points as one array
+            lines = cv2.HoughLinesP(np.asarray(cv.GetMat(em)), 1.0, np.pi/180.0, int(threshold),
+                                    minLineLength=minlinelength, maxLineGap=maxlinegap)
+            if lines is None:
+                segments = np.zeros((0, 2, 2), dtype=np.int32)
+            else:
+                segments = lines.reshape(-1, 2, 2)
+            if nLines != -1:
+                segments = segments[:nLines]
 
-            for l in lines[:nLines]:
-                linesFS.append(Line(self, l))
-        
+        if returnArrays:
+            endpoints = np.asarray(segments, dtype=np.int32).reshape(-1, 2, 2)
+            lengths, angles = Line.measure(endpoints)
+            return endpoints, lengths, angles
+
+        linesFS = FeatureSet()
+        for l in segments:
+            linesFS.append(Line(self, ((int(l[0][0]), int(l[0][1])), (int(l[1][0]), int(l[1][1])))))
         return linesFS
 
 
@@ -6015,8 +6350,8 @@ class Image:
           Do not use this method unless you have a particularly compelling reason.
 
         """
-        cv.SetZero(self._bitmap)
-        self._clearBuffers()
+        self._getBuffer().fill(0)
+        self._invalidateBuffers()
 
     def draw(self, features, color=Color.GREEN, width=1, autocolor=False):
         """
@@ -7394,16 +7729,36 @@ class Image:
         return Image(retVal)
 
 
-    def applyPixelFunction(self, theFunc):
+    def applyPixelFunction(self, theFunc, vectorized=False, pure=False, levels=256, workers=None, cache=False):
         """
         **SUMMARY**
 
         apply a function to every pixel and return the result
         The function must be of the form int (r,g,b)=func((r,g,b))
 
+        If the function is marked pure (its result only depends on the pixel
+        color) it is called once per distinct color rather than once per pixel. With cache
+        the results are also remembered for the next image, so applying the
+        same function to every frame of a video gets cheaper as it goes.
+
         **PARAMETERS**
 
         * *theFunc* - a function pointer to a function of the form (r,g.b) = theFunc((r,g,b))
+          or, if vectorized is True, a function that takes a numpy array of RGB pixels
+          (the color on the last axis) and returns an array of the same shape. It gets
+          a copy of the pixels, so it may change its input in place and return it.
+        * *vectorized* - theFunc works on whole arrays of pixels.
+        * *pure* - theFunc always gives the same color for the same input color, so it
+          only needs to be called once per color. Leave this False for functions with
+          side effects or randomness (noise, dithering), they get called for every pixel.
+        * *levels* - the number of levels per channel pure functions are tabulated with.
+          256 is exact, fewer levels quantize the colors first so the function gets
+          called fewer times (at most levels**3 times).
+        * *workers* - the number of threads a vectorized function runs on, each working
+          on a strip of the image. None uses one per CPU for images over a megapixel.
+        * *cache* - keep the colors a pure function gave for later calls with the same
+          function. Only use this if the function's result never changes, e.g. it does
+          not read a threshold that can be changed between frames.
 
         **RETURNS**
 
@@ -7415,14 +7770,23 @@ class Image:
         >>>     return (int(b*.2),int(r*.3),int(g*.5))
         >>>
         >>> img = Image("lenna")
-        >>> img2 = img.applyPixelFunction(derp)
-
-        """
-        #there should be a way to do this faster using numpy vectorize
-        #but I can get vectorize to work with the three channels together... have to split them
-        #TODO: benchmark this against vectorize
-        pixels = np.array(self.getNumpy()).reshape(-1,3).tolist()
-        result = np.array(map(theFunc,pixels),dtype=uint8).reshape(self.width,self.height,3)
+        >>> img2 = img.applyPixelFunction(derp, pure=True)
+        >>> img3 = img.applyPixelFunction(lambda px: px[...,::-1]*0.5, vectorized=True)
+
+        """
+        pixels = self.getNumpy()
+        if( vectorized ):
+            if( workers is None ):
+                workers = 1
+                if( self.width*self.height >= 1<<20 ):
+                    import multiprocessing
+                    workers = multiprocessing.cpu_count()
+            # getNumpy is a view of this image, the function may write into its input
+            result = _pixelFunctionTiles(theFunc,pixels.copy(),workers)
+        elif( pure ):
+            result = _pixelFunctionLookup(theFunc,pixels,levels,cache)
+        else:
+            result = np.array(map(theFunc,pixels.reshape(-1,3).tolist()),dtype=uint8).reshape(self.width,self.height,3)
         return Image(result)
 
 
@@ -8410,6 +8774,7 @@ class Image:
         :py:meth:`_getFLANNMatches`
         :py:meth:`drawKeypointMatches`
         :py:meth:`findKeypoints`
+        :py:class:`KeypointLibrary` - to look for many templates at once.
 
         """
         try:
@@ -8593,7 +8958,7 @@ class Image:
 
         return fs
 
-    def findMotion(self, previous_frame, window=11, method='BM', aggregate=True):
+    def findMotion(self, previous_frame, window=11, method='BM', aggregate=True, returnArrays=False):
         """
         **SUMMARY**
 
@@ -8617,14 +8982,24 @@ class Image:
 
           * 'HS' - `Horn-Schunck method <http://en.wikipedia.org/wiki/Horn%E2%80%93Schunck_method>`_
 
+          * 'FB' - `Farneback method <http://www.diva-portal.org/smash/get/diva2:273847/FULLTEXT01.pdf>`_
+            dense flow. When the previous frame had its own 'FB' motion found,
+            that flow is used as the starting guess, so a video converges
+            in fewer iterations.
+
         * *aggregate* - If aggregate is true, each of our motion features is the average of
           motion around the sample grid defined by window. If aggregate is false
           we just return the the value as sampled at the window grid interval. For
           block matching this flag is ignored.
+        * *returnArrays* - If True don't make Motion features, return the motion
+          field as numpy arrays instead. Use Motion.fromField to make features from
+          (part of) it later.
 
         **RETURNS**
 
-        A featureset of motion objects.
+        A featureset of motion objects. With returnArrays a tuple (positions, vectors, magnitudes)
+        where positions is an N x 2 array of sample points, vectors an N x 2 array of
+        (dx,dy) flow vectors and magnitudes the N vector lengths.
 
         **EXAMPLES**
 
@@ -8634,6 +9009,8 @@ class Image:
         >>> motion = img2.findMotion(img1)
         >>> motion.draw()
         >>> img2.show()
+        >>> pos, vec, mag = img2.findMotion(img1, method='FB', returnArrays=True)
+        >>> print mag.mean()
 
         **SEE ALSO**
 
@@ -8658,9 +9035,6 @@ class Image:
         if( self.width != previous_frame.width or self.height != previous_frame.height):
             logger.warning("ImageClass.getMotion: To find motion the current and previous frames must match")
             return None
-        fs = FeatureSet()
-        max_mag = 0.00
-
         if( method == "LK" or method == "HS" ):
             # create the result images.
             xf = cv.CreateImage((self.width, self.height), cv.IPL_DEPTH_32F, 1)
@@ -8670,33 +9044,21 @@ class Image:
                 cv.CalcOpticalFlowLK(self._getGrayscaleBitmap(),previous_frame._getGrayscaleBitmap(),win,xf,yf)
             else:
                 cv.CalcOpticalFlowHS(previous_frame._getGrayscaleBitmap(),self._getGrayscaleBitmap(),0,xf,yf,1.0,(cv.CV_TERMCRIT_ITER | cv.CV_TERMCRIT_EPS, 10, 0.01))
+            positions, vectors = self._sampleFlow(np.asarray(cv.GetMat(xf)),np.asarray(cv.GetMat(yf)),window,aggregate)
 
-            w = math.floor((float(window))/2.0)
-            cx = ((self.width-window)/window)+1 #our sample rate
-            cy = ((self.height-window)/window)+1
-            vx = 0.00
-            vy = 0.00
-            for x in range(0,int(cx)): # go through our sample grid
-                for y in range(0,int(cy)):
-                    xi = (x*window)+w # calculate the sample point
-                    yi = (y*window)+w
-                    if( aggregate ):
-                        lowx = int(xi-w)
-                        highx = int(xi+w)
-                        lowy = int(yi-w)
-                        highy = int(yi+w)
-                        xderp = xf[lowy:highy,lowx:highx] # get the average x/y components in the output
-                        yderp = yf[lowy:highy,lowx:highx]
-                        vx = np.average(xderp)
-                        vy = np.average(yderp)
-                    else: # other wise just sample
-                        vx = xf[yi,xi]
-                        vy = yf[yi,xi]
-
-                    mag = (vx*vx)+(vy*vy)
-                    if(mag > max_mag): # calculate the max magnitude for normalizing our vectors
-                        max_mag = mag
-                    fs.append(Motion(self,xi,yi,vx,vy,window)) # add the sample to the feature set
+        elif( method == "FB" ):
+            import cv2
+            flags = 0
+            flow = None
+            prev = previous_frame._mFlow
+            if( prev is not None and prev.shape == (self.height,self.width,2) ):
+                flow = prev.copy()
+                flags = cv2.OPTFLOW_USE_INITIAL_FLOW
+            flow = cv2.calcOpticalFlowFarneback(previous_frame.getGrayNumpyCv2(),self.getGrayNumpyCv2(),
+                                                pyr_scale=0.5,levels=3,winsize=window,iterations=3,
+                                                poly_n=5,poly_sigma=1.1,flags=flags,flow=flow)
+            self._mFlow = flow
+            positions, vectors = self._sampleFlow(flow[:,:,0],flow[:,:,1],window,aggregate)
 
         elif( method == "BM"):
             # In the interest of keep the parameter list short
@@ -8723,29 +9085,47 @@ class Image:
                 yf = cv.CreateImage((wv,hv), cv.IPL_DEPTH_32F, 1)
                 cv.CalcOpticalFlowBM(previous_frame._getGrayscaleBitmap(),self._getGrayscaleBitmap(),block,shift,spread,0,xf,yf)
 
-            for x in range(0,int(wv)): # go through the sample grid
-                for y in range(0,int(hv)):
-                    xi = (shift[0]*(x))+block[0] #where on the input image the samples live
-                    yi = (shift[1]*(y))+block[1]
-                    vx = xf[y,x] # the result image values
-                    vy = yf[y,x]
-                    fs.append(Motion(self,xi,yi,vx,vy,window)) # add the feature
-                    mag = (vx*vx)+(vy*vy) # same the magnitude
-                    if(mag > max_mag):
-                        max_mag = mag
-        else:
-            logger.warning("ImageClass.findMotion: I don't know what algorithm you want to use. Valid method choices are Block Matching -> \"BM\" Horn-Schunck -> \"HS\" and Lucas-Kanade->\"LK\" ")
+            # the samples go column by column, like the feature set always has
+            vectors = np.dstack((np.asarray(cv.GetMat(xf)),np.asarray(cv.GetMat(yf)))).transpose(1,0,2).reshape(-1,2)
+            gx, gy = np.mgrid[0:int(wv),0:int(hv)]
+            positions = np.column_stack((((shift[0]*gx)+block[0]).ravel(),((shift[1]*gy)+block[1]).ravel()))
+        else:
+            logger.warning("ImageClass.findMotion: I don't know what algorithm you want to use. Valid method choices are Block Matching -> \"BM\" Horn-Schunck -> \"HS\" Lucas-Kanade->\"LK\" and Farneback -> \"FB\" ")
             return None
 
-        max_mag = math.sqrt(max_mag) # do the normalization
-        for f in fs:
-            f.normalizeTo(max_mag)
+        if( returnArrays ):
+            return positions, vectors, np.hypot(vectors[:,0],vectors[:,1])
+        return Motion.fromField(self,positions,vectors,window)
 
-        return fs
+    def _sampleFlow(self, xf, yf, window, aggregate):
+        """
+        Sample a dense flow field on a grid with a window sized cell.
+        Each sample is the average flow of the cell (or its center value
+        if aggregate is False). Returns the (positions, vectors) arrays,
+        column by column.
+        """
+        w = window/2
+        cx = ((self.width-window)/window)+1 #our sample rate
+        cy = ((self.height-window)/window)+1
+        if( aggregate ):
+            # the average of the 2w x 2w block starting at each cell corner
+            span = 2*w
+            def blocks(f):
+                f = f[:cy*window,:cx*window].reshape(cy,window,cx,window)
+                return f[:,:span,:,:span].mean(axis=3,dtype=np.float64).mean(axis=1)
+            vx = blocks(xf)
+            vy = blocks(yf)
+        else: # other wise just sample
+            vx = xf[w::window,w::window][:cy,:cx]
+            vy = yf[w::window,w::window][:cy,:cx]
+        vectors = np.dstack((vx,vy)).astype(np.float64).transpose(1,0,2).reshape(-1,2)
+        gx, gy = np.mgrid[0:cx,0:cy]
+        positions = np.column_stack((((gx*window)+w).ravel(),((gy*window)+w).ravel()))
+        return positions, vectors
 
 
 
-    def _generatePalette(self,bins,hue, centroids = None):
+    def _generatePalette(self,bins,hue, centroids = None, samples = None):
         """
         **SUMMARY**
 
@@ -8760,6 +9140,7 @@ class Image:
         * *bins* - an integer number of bins into which to divide the colors in the image.
         * *hue* - if hue is true we do only cluster on the image hue values.
         * *centroids* - A list of tuples that are the initial k-means estimates. This is handy if you want consisten results from the palettize.
+        * *samples* - The largest number of pixels to run k-means on, None uses all of them.
 
         **RETURNS**
 
@@ -8797,53 +9178,32 @@ class Image:
         """
         if( self._mPaletteBins != bins or
             self._mDoHuePalette != hue ):
-            total = float(self.width*self.height)
-            percentages = []
-            result = None
-            if( not hue ):
-                pixels = np.array(self.getNumpy()).reshape(-1, 3)   #reshape our matrix to 1xN
-                if( centroids == None ):
-                    result = scv.kmeans(pixels,bins)
-                else:
-                    if(isinstance(centroids,list)):
-                        centroids = np.array(centroids,dtype='uint8')
-                    result = scv.kmeans(pixels,centroids)
-
-                self._mPaletteMembers = scv.vq(pixels,result[0])[0]
-
+            if( self._mPalettes is None ): # unpickled images skip __init__
+                self._mPalettes = {}
+            cached = self._mPalettes.get((bins,hue))
+            if( cached is not None ):
+                self._setPalette(bins,hue,*cached)
             else:
-                hsv = self
-                if( self._colorSpace != ColorSpace.HSV ):
-                    hsv = self.toHSV()
-
-                h = hsv.getEmpty(1)
-                cv.Split(hsv.getBitmap(),None,None,h,None)
-                mat =  cv.GetMat(h)
-                pixels = np.array(mat).reshape(-1,1)
-
-                if( centroids == None ):
-                    result = scv.kmeans(pixels,bins)
-                else:
-                    if(isinstance( centroids,list)):
-                        centroids = np.array( centroids,dtype='uint8')
-                        centroids = centroids.reshape(centroids.shape[0],1)
-                    result = scv.kmeans(pixels,centroids)
+                palette = Palette(bins,hue,centroids,samples)
+                palette.train(self)
+                palette.apply(self)
 
-                self._mPaletteMembers = scv.vq(pixels,result[0])[0]
-
-
-            for i in range(0,bins):
-                count = np.where(self._mPaletteMembers==i)
-                v = float(count[0].shape[0])/total
-                percentages.append(v)
-
-            self._mDoHuePalette = hue
-            self._mPaletteBins = bins
-            self._mPalette = np.array(result[0],dtype='uint8')
-            self._mPalettePercentages = percentages
+    def _setPalette(self,bins,hue,palette,members,percentages):
+        """
+        Make this the image's current palette, and remember it in case the
+        same bins and hue are asked for again.
+        """
+        self._mDoHuePalette = hue
+        self._mPaletteBins = bins
+        self._mPalette = palette
+        self._mPaletteMembers = members
+        self._mPalettePercentages = percentages
+        if( self._mPalettes is None ):
+            self._mPalettes = {}
+        self._mPalettes[(bins,hue)] = (palette,members,percentages)
 
 
-    def getPalette(self,bins=10,hue=False,centroids=None):
+    def getPalette(self,bins=10,hue=False,centroids=None,samples=None):
         """
         **SUMMARY**
 
@@ -8855,6 +9215,8 @@ class Image:
         * *bins* - an integer number of bins into which to divide the colors in the image.
         * *hue*  - if hue is true we do only cluster on the image hue values.
         * *centroids* - A list of tuples that are the initial k-means estimates. This is handy if you want consisten results from the palettize.
+        * *samples* - The largest number of pixels to run k-means on. Big images are evenly
+          subsampled to about this many pixels, which is much faster. None uses every pixel.
 
         **RETURNS**
 
@@ -8885,7 +9247,7 @@ class Image:
         :py:meth:`findBlobsFromPalette`
 
         """
-        self._generatePalette(bins,hue,centroids)
+        self._generatePalette(bins,hue,centroids,samples)
         return self._mPalette
 
 
@@ -8899,8 +9261,9 @@ class Image:
 
         **PARAMETERS**
 
-        * *palette* - The pre-computed palette from another image.
+        * *palette* - The pre-computed palette from another image, or a :py:class:`Palette`.
         * *hue* - Boolean Hue - if hue is True we use a hue palette, otherwise we use a BGR palette.
+          A Palette object brings its own hue setting.
 
         **RETURNS**
 
@@ -8925,40 +9288,18 @@ class Image:
 
         """
         retVal = None
+        if( isinstance(palette,Palette) ):
+            hue = palette.mHue
+            palette = palette.getColors()
+        shared = Palette(len(palette),hue,palette)
+        members = shared.getMembers(self)
         if(hue):
-            hsv = self
-            if( self._colorSpace != ColorSpace.HSV ):
-                hsv = self.toHSV()
-
-            h = hsv.getEmpty(1)
-            cv.Split(hsv.getBitmap(),None,None,h,None)
-            mat =  cv.GetMat(h)
-            pixels = np.array(mat).reshape(-1,1)
-            result = scv.vq(pixels,palette)
-            derp = palette[result[0]]
+            derp = palette[members]
             retVal = Image(derp[::-1].reshape(self.height,self.width)[::-1])
             retVal = retVal.rotate(-90,fixed=False)
-            retVal._mDoHuePalette = True
-            retVal._mPaletteBins = len(palette)
-            retVal._mPalette = palette
-            retVal._mPaletteMembers = result[0]
-
-        else:
-            result = scv.vq(self.getNumpy().reshape(-1,3),palette)
-            retVal = Image(palette[result[0]].reshape(self.width,self.height,3))
-            retVal._mDoHuePalette = False
-            retVal._mPaletteBins = len(palette)
-            retVal._mPalette = palette
-            pixels = np.array(self.getNumpy()).reshape(-1, 3)
-            retVal._mPaletteMembers = scv.vq(pixels,palette)[0]
-
-        percentages = []
-        total = self.width*self.height
-        for i in range(0,len(palette)):
-            count = np.where(self._mPaletteMembers==i)
-            v = float(count[0].shape[0])/total
-            percentages.append(v)
-        self._mPalettePercentages = percentages
+        else:
+            retVal = Image(palette[members].reshape(self.width,self.height,3))
+        retVal._setPalette(len(palette),hue,palette,members,shared.getPercentages(members))
         return retVal
 
     def drawPaletteColors(self,size=(-1,-1),horizontal=True,bins=10,hue=False):
@@ -9083,7 +9424,7 @@ class Image:
 
         return retVal
 
-    def palettize(self,bins=10,hue=False,centroids=None):
+    def palettize(self,bins=10,hue=False,centroids=None,samples=None):
         """
         **SUMMARY**
 
@@ -9096,7 +9437,8 @@ class Image:
 
         * *bins* - an integer number of bins into which to divide the colors in the image.
         * *hue* - if hue is true we do only cluster on the image hue values.
-
+        * *centroids* - A list of tuples that are the initial k-means estimates.
+        * *samples* - The largest number of pixels to run k-means on, None uses all of them.
 
         **RETURNS**
 
@@ -9128,7 +9470,7 @@ class Image:
 
         """
         retVal = None
-        self._generatePalette(bins,hue,centroids)
+        self._generatePalette(bins,hue,centroids,samples)
         if( hue ):
             derp = self._mPalette[self._mPaletteMembers]
             retVal = Image(derp[::-1].reshape(self.height,self.width)[::-1])
@@ -11566,15 +11908,11 @@ class Image:
         if not self.isGray():
             self = self.toGray()
         #self = self._getGrayscaleBitmap()
-        width = round(math.sqrt(math.pow(pt2[0]-pt1[0],2) + math.pow(pt2[1]-pt1[1],2)))
-        retVal = np.zeros(width)
-        
-        for x in range(0, retVal.size):
-            xind = pt1[0] + int(round((pt2[0]-pt1[0])*x/retVal.size))
-            yind = pt1[1] + int(round((pt2[1]-pt1[1])*x/retVal.size))
-            current_pixel = self.getPixel(xind,yind)
-            retVal[x] = current_pixel[0]
-        return retVal
+        width = int(round(math.sqrt(math.pow(pt2[0]-pt1[0],2) + math.pow(pt2[1]-pt1[1],2))))
+        x = np.arange(width)
+        xind = pt1[0] + ((pt2[0]-pt1[0])*x)//max(width,1)
+        yind = pt1[1] + ((pt2[1]-pt1[1])*x)//max(width,1)
+        return self.getGrayNumpy()[xind,yind].astype(float)
 
     def fitLines(self,guesses,window=10,threshold=128):
         """
@@ -12153,11 +12491,9 @@ class Image:
         return dict( size = self.size(), colorspace = self._colorSpace, image = self.applyLayers().getBitmap().tostring() )
 
     def __setstate__(self, mydict):
-        self._bitmap = cv.CreateImageHeader(mydict['size'], cv.IPL_DEPTH_8U, 3)
-        cv.SetData(self._bitmap, mydict['image'])
+        w, h = mydict['size']
+        self._setBuffer(np.fromstring(mydict['image'], dtype=np.uint8).reshape(h, w, 3))
         self._colorSpace = mydict['colorspace']
-        self.width = mydict['size'][0]
-        self.height = mydict['size'][1]
 
     def area(self):
         '''
@@ -12478,7 +12814,8 @@ class Image:
               x is None and y is None):
 
             pts = self.bresenham_line(pt1,pt2)
-            retVal = LineScan([img[p[0],p[1]] for p in pts])
+            idx = np.array(pts,dtype=int).reshape(-1,2)
+            retVal = LineScan(img[idx[:,0],idx[:,1]])
             retVal.pointLoc = pts
             retVal.image = self
             retVal.pt1 = pt1
@@ -12491,6 +12828,75 @@ class Image:
         retVal.channel = channel
         return retVal
 
+    def getLineProfiles(self, segments, samples=None, bilinear=False, channel=-1):
+        """
+        **SUMMARY**
+
+        Sample the image along many line segments at once. This is the batch
+        version of getLineScan for things like caliper measurements that look
+        at hundreds of lines per image; all of the lines are read with a
+        single numpy gather.
+
+        **PARAMETERS**
+
+        * *segments* - A K x 2 x 2 array (or list) of line segments, ((x1,y1),(x2,y2))
+          per line. The endpoints from findLines(returnArrays=True) can be used directly.
+        * *samples* - The number of evenly spaced samples taken along each line, from
+          pt1 to pt2 inclusive. None uses one sample per pixel of the longest line.
+        * *bilinear* - If True sample between pixels with bilinear interpolation, otherwise
+          use the nearest pixel.
+        * *channel* - -1 for the grayscale image, 0, 1 or 2 for one RGB channel, or
+          None for all three.
+
+        **RETURNS**
+
+        A K x samples numpy array of the profiles (K x samples x 3 when channel is None).
+        Samples that fall outside of the image take the value of the nearest edge pixel.
+
+        **EXAMPLE**
+
+        >>> img = Image('lenna')
+        >>> calipers = [((x,100),(x,200)) for x in range(100,400,10)]
+        >>> profiles = img.getLineProfiles(calipers, samples=64, bilinear=True)
+        >>> edges = np.argmax(np.abs(np.diff(profiles,axis=1)),axis=1)
+
+        **SEE ALSO**
+
+        :py:meth:`getLineScan`
+        :py:meth:`getPixelsOnLine`
+
+        """
+        if channel == -1:
+            img = self.getGrayNumpy()
+        elif channel is None:
+            img = self.getNumpy()
+        else:
+            img = self.getNumpy()[:,:,channel]
+        segments = np.asarray(segments,dtype=np.float64).reshape(-1,2,2)
+        start = segments[:,0,:]
+        delta = segments[:,1,:]-start
+        if( samples is None ):
+            samples = 1
+            if( len(segments) ):
+                samples = int(np.ceil(np.abs(delta).max()))+1
+        t = np.linspace(0.0,1.0,samples)
+        x = np.clip(start[:,0,np.newaxis]+delta[:,0,np.newaxis]*t,0,self.width-1)
+        y = np.clip(start[:,1,np.newaxis]+delta[:,1,np.newaxis]*t,0,self.height-1)
+        if( not bilinear ):
+            return img[np.rint(x).astype(int),np.rint(y).astype(int)]
+        x0 = np.floor(x).astype(int)
+        y0 = np.floor(y).astype(int)
+        x1 = np.minimum(x0+1,self.width-1)
+        y1 = np.minimum(y0+1,self.height-1)
+        fx = x-x0
+        fy = y-y0
+        if( img.ndim == 3 ):
+            fx = fx[:,:,np.newaxis]
+            fy = fy[:,:,np.newaxis]
+        top = img[x0,y0]*(1-fx) + img[x1,y0]*fx
+        bottom = img[x0,y1]*(1-fx) + img[x1,y1]*fx
+        return top*(1-fy) + bottom*fy
+
     def setLineScan(self, linescan,x=None,y=None,pt1=None,pt2=None,channel = -1):
         """
         **SUMMARY**
@@ -12710,8 +13116,11 @@ class Image:
         if( (isinstance(pt1,tuple) or isinstance(pt1,list)) and
             (isinstance(pt2,tuple) or isinstance(pt2,list)) and
             len(pt1) == 2 and len(pt2) == 2 ):
-            pts = self.bresenham_line(pt1,pt2)
-            retVal = [self.getPixel(p[0],p[1]) for p in pts]
+            pts = np.array(self.bresenham_line(pt1,pt2),dtype=int).reshape(-1,2)
+            px = self.getNumpyCv2()[pts[:,1],pts[:,0]].astype(float)
+            if( self._colorSpace == ColorSpace.BGR ):
+                px = px[:,::-1]
+            retVal = [tuple(p) for p in px.tolist()]
         else:
             warnings.warn("ImageClass.getPixelsOnLine - The line you provided is not valid")
 
@@ -12736,8 +13145,6 @@ class Image:
             else:
                 return []
 
-        steep = 0
-        coords = []
         dx = abs(x2 - x)
         if (x2 - x) > 0:
             sx = 1
@@ -12748,22 +13155,19 @@ class Image:
             sy = 1
         else:
             sy = -1
-        if dy > dx:
-            steep = 1
+        steep = dy > dx
+        if steep:
             x,y = y,x
             dx,dy = dy,dx
             sx,sy = sy,sx
-        d = (2 * dy) - dx
-        for i in range(0,dx):
-            if steep:
-                coords.append((y,x))
-            else:
-                coords.append((x,y))
-            while d >= 0:
-                y = y + sy
-                d = d - (2 * dx)
-            x = x + sx
-            d = d + (2 * dy)
+        # the minor axis steps wherever the error term of the classic
+        # loop would have crossed zero
+        i = np.arange(dx)
+        major = x + sx*i
+        minor = y + sy*((2*dy*i + dx)//max(2*dx,1))
+        if steep:
+            major,minor = minor,major
+        coords = zip(major.tolist(),minor.tolist())
         coords.append((x2,y2))
         return coords
 
@@ -14762,8 +15166,9 @@ class Image:
         return filteredimage
 
 from SimpleCV.Features import FeatureSet, Feature, Barcode, Corner, HaarFeature, Line, Chessboard, TemplateMatch, BlobMaker, Circle, KeyPoint, Motion, KeypointMatch, FaceRecognizer
-from SimpleCV.Tracking import camshiftTracker, lkTracker, surfTracker, mfTracker, TrackSet
+from SimpleCV.Tracking import camshiftTracker, lkTracker, surfTracker, mfTracker, TrackSet, TrackManager, TrackRecord
 from SimpleCV.Stream import JpegStreamer
 from SimpleCV.Font import *
 from SimpleCV.DrawingLayer import *
 from SimpleCV.DFT import DFT
+from SimpleCV.Palette import Palette
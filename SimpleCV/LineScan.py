@@ -6,7 +6,7 @@ import numpy as np
 import copy, operator
 
 
-class LineScan(list):
+class LineScan(object):
     """
     **SUMMARY**
 
@@ -18,6 +18,10 @@ class LineScan(list):
     roll your own by declaring a LineScan object and passing the constructor
     a 1xN list of values.
 
+    The values are kept in a numpy array (integer signals as int64, everything
+    else as float64) which np.asarray hands back without a copy. Slices are
+    views of the same values, and the arithmetic works on whole arrays.
+
     **EXAMPLE**
 
     >>>> import matplotlib.pyplot as plt
@@ -28,13 +32,12 @@ class LineScan(list):
     >>>> plt.plot(ss)
     >>>> plt.show()
     """
-    pointLoc = None
     image = None
+    __hash__ = None
 
     def __init__(self, args, **kwargs):
-        if isinstance(args, np.ndarray):
-            args = args.tolist()
-        list.__init__(self,args)
+        self._data = self._toArray(args)
+        self._pointLoc = None
         self.image = None
         self.pt1 = None
         self.pt2 = None
@@ -42,12 +45,12 @@ class LineScan(list):
         self.col = None
         self.channel = -1
         for key in kwargs:
-            if key == 'pointLocs':
+            if key == 'pointLocs' or key == 'pointLoc':
                 if kwargs[key] is not None:
                     self.pointLoc = kwargs[key]
             if key == 'image':
                 if kwargs[key] is not None:
-                    self.img = kwargs[key]
+                    self.image = kwargs[key]
             if key == 'pt1':
                 if kwargs[key] is not None:
                     self.pt1 = kwargs[key]
@@ -63,9 +66,70 @@ class LineScan(list):
             if key == "channel":
                 if kwargs[key] is not None:
                     self.channel = kwargs[key]
-                    
-        if(self.pointLoc is None):
-            self.pointLoc = zip(range(0,len(self)),range(0,len(self)))
+
+    def _toArray(self, values):
+        """
+        Copy values into the array a LineScan keeps. Integers are widened so
+        the arithmetic does not overflow the way uint8 pixels would.
+        """
+        values = np.asarray(values)
+        if( values.dtype.kind in 'biu' ):
+            return values.astype(np.int64)
+        if( values.dtype.kind == 'f' ):
+            return values.astype(np.float64)
+        return values.copy()
+
+    def _new(self, values):
+        """
+        A LineScan of values with the same metadata as this one.
+        """
+        retVal = LineScan(values)
+        retVal._update(self)
+        return retVal
+
+    def _getPointLoc(self):
+        # the default pixel locations are only made when someone asks for them
+        if( self._pointLoc is None ):
+            return zip(range(0,len(self)),range(0,len(self)))
+        return self._pointLoc
+
+    def _setPointLoc(self, pts):
+        self._pointLoc = pts
+
+    pointLoc = property(_getPointLoc, _setPointLoc)
+
+    def __array__(self, dtype=None):
+        if( dtype is None ):
+            return self._data
+        return self._data.astype(dtype)
+
+    def tolist(self):
+        return self._data.tolist()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data.tolist())
+
+    def __reversed__(self):
+        return iter(self._data[::-1].tolist())
+
+    def __contains__(self, value):
+        return bool(np.any(self._data == value))
+
+    def __repr__(self):
+        return repr(self._data.tolist())
+
+    def __eq__(self, other):
+        try:
+            other = np.asarray(other)
+        except Exception:
+            return False
+        return other.shape == self._data.shape and bool(np.all(self._data == other))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def __getitem__(self,key):
         """
@@ -73,65 +137,89 @@ class LineScan(list):
 
         Returns a LineScan when sliced. Previously used to
         return list. Now it is possible to use LineScanm member
-        functions on sub-lists
+        functions on sub-lists. The slice is a view of this linescan's
+        values, and keeps its image, channel and pixel locations.
 
         """
         if type(key) is types.SliceType: #Or can use 'try:' for speed
-            return LineScan(list.__getitem__(self, key))
+            retVal = LineScan([])
+            retVal._data = self._data[key]
+            retVal.image = self.image
+            retVal.row = self.row
+            retVal.col = self.col
+            retVal.channel = self.channel
+            if( self._pointLoc is not None ):
+                retVal._pointLoc = self._pointLoc[key]
+            return retVal
         else:
-            return list.__getitem__(self,key)
+            return self._data.item(key)
 
-    def __getslice__(self, i, j):
-        """
-        Deprecated since python 2.0, now using __getitem__
-        """
-        return self.__getitem__(slice(i,j))
+    def __setitem__(self, key, value):
+        self._data[key] = value
 
-    def __sub__(self,other):
-        
-        if len(self) == len(other):
-            retVal = LineScan(map(operator.sub,self,other))
-        else:
-            print 'Size mismatch'
-            return None
-        retVal._update(self)
-        return retVal
+    def __delitem__(self, key):
+        self._data = np.delete(self._data, np.arange(len(self._data))[key])
 
-    def __add__(self,other):
-        
-        if len(self) == len(other):
-            retVal = LineScan(map(operator.add,self,other))
-        else:
-            print 'Size mismatch'
-            return None
-        retVal._update(self)
-        return retVal
+    # the list methods. These make a new array, so they are slow next to
+    # building the values first and making one LineScan out of them.
+    def append(self, value):
+        self.extend([value])
 
-    def __mul__(self,other):
+    def extend(self, values):
+        self._data = self._toArray(np.concatenate((self._data, self._toArray(values))))
 
-        if len(self) == len(other):
-            retVal = LineScan(map(operator.mul,self,other))
-        else:
-            print 'Size mismatch'
-            return None
+    def insert(self, idx, value):
+        self._data = self._toArray(np.insert(self._data, idx, value))
 
-        retVal._update(self)
-        return retVal
+    def pop(self, idx=-1):
+        value = self[idx]
+        del self[idx]
+        return value
 
-    def __div__(self,other):
+    def remove(self, value):
+        del self[self.index(value)]
 
-        if len(self) == len(other):
-            try:
-                retVal = LineScan(map(operator.div,self,other))
-            except ZeroDivisionError:
-                print 'Second LineScan contains zeros'
-                return None
-        else:
+    def index(self, value):
+        idx = np.flatnonzero(self._data == value)
+        if( len(idx) == 0 ):
+            raise ValueError(str(value) + " is not in linescan")
+        return int(idx[0])
+
+    def count(self, value):
+        return int(np.count_nonzero(self._data == value))
+
+    def reverse(self):
+        self._data = self._data[::-1].copy()
+
+    def sort(self):
+        self._data.sort()
+
+    def __iadd__(self, other):
+        # += has always extended the linescan like a list does
+        self.extend(other)
+        return self
+
+    def _arithmetic(self, other, op):
+        other = np.asarray(other)
+        if( other.ndim > 0 and len(other) != len(self) ):
             print 'Size mismatch'
             return None
+        return self._new(op(self._data, other))
 
-        retVal._update(self)
-        return retVal
+    def __sub__(self,other):
+        return self._arithmetic(other, np.subtract)
+
+    def __add__(self,other):
+        return self._arithmetic(other, np.add)
+
+    def __mul__(self,other):
+        return self._arithmetic(other, np.multiply)
+
+    def __div__(self,other):
+        if( np.any(np.asarray(other) == 0) ):
+            print 'Second LineScan contains zeros'
+            return None
+        return self._arithmetic(other, np.divide)
 
     def _update(self, linescan):
         """
@@ -146,7 +234,7 @@ class LineScan(list):
         self.row = linescan.row
         self.col = linescan.col
         self.channel = linescan.channel
-        self.pointLoc = linescan.pointLoc
+        self._pointLoc = linescan._pointLoc
 
 
     def smooth(self,degree=3):
@@ -176,24 +264,13 @@ class LineScan(list):
         Cribbed from http://www.swharden.com/blog/2008-11-17-linear-data-smoothing-in-python/
         """
         window=degree*2-1
-        weight=np.array([1.0]*window)
-        weightGauss=[]
-        for i in range(window):
-            i=i-degree+1
-            frac=i/float(window)
-            gauss=1/(np.exp((4*(frac))**2))
-            weightGauss.append(gauss)
-        weight=np.array(weightGauss)*weight
-        smoothed=[0.0]*(len(self)-window)
-        for i in range(len(smoothed)):
-            smoothed[i]=sum(np.array(self[i:i+window])*weight)/sum(weight)
+        frac=(np.arange(window)-degree+1)/float(window)
+        weight=1/(np.exp((4*(frac))**2))
+        n = max(len(self)-window,0)
+        smoothed=np.correlate(self._data,weight,'valid')[:n]/weight.sum()
         # recenter the signal so it sits nicely on top of the old
-        front = self[0:(degree-1)]
-        front += smoothed
-        front += self[-1*degree:]
-        retVal = LineScan(front,image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
-        return retVal
+        front = np.concatenate((self._data[0:(degree-1)],smoothed,self._data[-1*degree:]))
+        return self._new(front)
 
     def normalize(self):
         """
@@ -215,11 +292,9 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        temp = np.array(self, dtype='float32')
+        temp = np.array(self._data, dtype='float32')
         temp = temp / np.max(temp)
-        retVal = LineScan(list(temp[:]),image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
-        return retVal
+        return self._new(temp)
 
     def scale(self,value_range=(0,1)):
         """
@@ -251,15 +326,13 @@ class LineScan(list):
         **SEE ALSO**
 
         """
-        temp = np.array(self, dtype='float32')
+        temp = np.array(self._data, dtype='float32')
         vmax = np.max(temp)
         vmin = np.min(temp)
         a = np.min(value_range)
         b = np.max(value_range)
         temp = (((b-a)/(vmax-vmin))*(temp-vmin))+a
-        retVal = LineScan(list(temp[:]),image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
-        return retVal
+        return self._new(temp)
 
     def minima(self):
         """
@@ -287,14 +360,9 @@ class LineScan(list):
         # all of these functions should return
         # value, index, pixel coordinate
         # [(index,value,(pix_x,pix_y))...]
-        minvalue = np.min(self)
-        idxs = np.where(np.array(self)==minvalue)[0]
-        minvalue = np.ones((1,len(idxs)))*minvalue # make zipable
-        minvalue = minvalue[0]
-        pts = np.array(self.pointLoc)
-        pts = pts[idxs]
-        pts = [(p[0],p[1]) for p in pts] # un numpy this
-        return zip(idxs,minvalue,pts)
+        minvalue = np.min(self._data)
+        idxs = np.where(self._data==minvalue)[0]
+        return self._indexedPoints(idxs,np.ones(len(idxs))*minvalue)
 
     def maxima(self):
         """
@@ -323,14 +391,20 @@ class LineScan(list):
         # all of these functions should return
         # value, index, pixel coordinate
         # [(index,value,(pix_x,pix_y))...]
-        maxvalue = np.max(self)
-        idxs = np.where(np.array(self)==maxvalue)[0]
-        maxvalue = np.ones((1,len(idxs)))*maxvalue # make zipable
-        maxvalue = maxvalue[0]
-        pts = np.array(self.pointLoc)
-        pts = pts[idxs]
-        pts = [(p[0],p[1]) for p in pts] # un numpy
-        return zip(idxs,maxvalue,pts)
+        maxvalue = np.max(self._data)
+        idxs = np.where(self._data==maxvalue)[0]
+        return self._indexedPoints(idxs,np.ones(len(idxs))*maxvalue)
+
+    def _indexedPoints(self, idxs, values):
+        """
+        The (index,value,(pix_x,pix_y)) tuples of the samples at idxs.
+        """
+        if( self._pointLoc is None ): # the default locations are just the index
+            pts = zip(idxs.tolist(),idxs.tolist())
+        else:
+            pts = np.array(self._pointLoc)[idxs]
+            pts = [(p[0],p[1]) for p in pts] # un numpy
+        return zip(idxs,values,pts)
 
     def derivative(self):
         """
@@ -354,13 +428,10 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        temp = np.array(self,dtype='float32')
-        d = [0]
-        d += list(temp[1:]-temp[0:-1])
-        retVal = LineScan(d,image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        #retVal.image = self.image
-        #retVal.pointLoc = self.pointLoc
-        return retVal
+        temp = np.array(self._data,dtype='float32')
+        d = np.zeros(len(temp))
+        d[1:] = temp[1:]-temp[0:-1]
+        return self._new(d)
 
     def localMaxima(self):
         """
@@ -387,14 +458,10 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        temp = np.array(self)
+        temp = self._data
         idx = np.r_[True, temp[1:] > temp[:-1]] & np.r_[temp[:-1] > temp[1:], True]
         idx = np.where(idx==True)[0]
-        values = temp[idx]
-        pts = np.array(self.pointLoc)
-        pts = pts[idx]
-        pts = [(p[0],p[1]) for p in pts] # un numpy
-        return zip(idx,values,pts)
+        return self._indexedPoints(idx,temp[idx])
 
 
     def localMinima(self):
@@ -422,14 +489,10 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        temp = np.array(self)
+        temp = self._data
         idx = np.r_[True, temp[1:] < temp[:-1]] & np.r_[temp[:-1] < temp[1:], True]
         idx = np.where(idx==True)[0]
-        values = temp[idx]
-        pts = np.array(self.pointLoc)
-        pts = pts[idx]
-        pts = [(p[0],p[1]) for p in pts] # un numpy
-        return zip(idx,values,pts)
+        return self._indexedPoints(idx,temp[idx])
 
     def resample(self,n=100):
         """
@@ -458,15 +521,14 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        signal = sps.resample(self,n)
+        signal = sps.resample(self._data,n)
         pts = np.array(self.pointLoc)
         # we assume the pixel points are linear
         # so we can totally do this better manually
         x = linspace(pts[0,0],pts[-1,0],n)
         y = linspace(pts[0,1],pts[-1,1],n)
-        pts = zip(x,y)
-        retVal = LineScan(list(signal),image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
+        retVal = self._new(signal)
+        retVal.pointLoc = zip(x,y)
         return retVal
 
 
@@ -510,13 +572,11 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        yvals = np.array(self,dtype='float32')
-        xvals = range(0,len(yvals),1)
+        yvals = np.array(self._data,dtype='float32')
+        xvals = np.arange(0,len(yvals),1)
         popt,pcov = spo.curve_fit(f,xvals,yvals,p0=p0)
         yvals = f(xvals,*popt)
-        retVal = LineScan(list(yvals),image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
-        return retVal
+        return self._new(yvals)
 
 
     def getModelParameters(self,f,p0=None):
@@ -549,8 +609,8 @@ class LineScan(list):
         >>>> print p
 
         """
-        yvals = np.array(self,dtype='float32')
-        xvals = range(0,len(yvals),1)
+        yvals = np.array(self._data,dtype='float32')
+        xvals = np.arange(0,len(yvals),1)
         popt,pcov = spo.curve_fit(f,xvals,yvals,p0=p0)
         return popt
 
@@ -585,9 +645,8 @@ class LineScan(list):
         **SEE ALSO**
 
         """
-        out = np.convolve(self,np.array(kernel,dtype='float32'),'same')
-        retVal = LineScan(out,image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2,channel=self.channel)
-        return retVal
+        out = np.convolve(self._data,np.array(kernel,dtype='float32'),'same')
+        return self._new(out)
 
     def fft(self):
         """
@@ -612,7 +671,7 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        signal = np.array(self,dtype='float32')
+        signal = np.array(self._data,dtype='float32')
         fft = np.fft.fft(signal)
         freq = np.fft.fftfreq(len(signal))
         return (fft,freq)
@@ -650,7 +709,7 @@ class LineScan(list):
         signal = np.fft.ifft(fft)
         retVal = LineScan(signal.real)
         retVal.image = self.image
-        retVal.pointLoc = self.pointLoc
+        retVal._pointLoc = self._pointLoc
         return retVal
 
     def createEmptyLUT(self,defaultVal=-1):
@@ -781,20 +840,12 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        out = []
         high = 255
         low = 0
         if( invert ):
             high = 0
             low = 255
-        for pt in self:
-            if( pt < threshold ):
-                out.append(low)
-            else:
-                out.append(high)
-        retVal = LineScan(out,image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
-        return retVal
+        return self._new(np.where(self._data < threshold, low, high))
 
     def invert(self,max=255):
         """
@@ -821,12 +872,7 @@ class LineScan(list):
 
         """
 
-        out = []
-        for pt in self:
-            out.append(255-pt)
-        retVal = LineScan(out,image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
-        return retVal
+        return self._new(255-self._data)
 
     def mean(self):
         """
@@ -847,7 +893,7 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        return float(sum(self))/len(self)
+        return float(np.sum(self._data))/len(self)
 
     def variance(self):
         """
@@ -866,11 +912,7 @@ class LineScan(list):
         >>>> var
 
         """
-        mean = float(sum(self))/len(self)
-        summation = 0
-        for num in self:
-            summation += (num - mean)**2
-        return summation/len(self)
+        return float(np.var(self._data))
 
     def std(self):
         """
@@ -894,11 +936,7 @@ class LineScan(list):
         >>>> plt.show()
 
         """
-        mean = float(sum(self))/len(self)
-        summation = 0
-        for num in self:
-            summation += (num - mean)**2
-        return np.sqrt(summation/len(self))
+        return np.sqrt(self.variance())
 
     def median(self,sz=5):
         """
@@ -929,16 +967,15 @@ class LineScan(list):
         if( sz%2==0 ):
             sz = sz+1
         skip = int(np.floor(sz/2))
-        out = self[0:skip]
         vsz = len(self)
-        for idx in range(skip,vsz-skip):
-            val = np.median(self[(idx-skip):(idx+skip)])
-            out.append(val)
-        for pt in self[-1*skip:]:
-            out.append(pt)
-        retVal = LineScan(out,image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
-        return retVal
+        if( skip == 0 ):
+            return self._new(self._data.copy())
+        # each sample is the median of the 2*skip samples starting skip before it
+        windows = np.arange(skip,max(vsz-skip,skip))[:,np.newaxis] + np.arange(-skip,skip)
+        out = np.concatenate((self._data[0:skip],
+                              np.median(self._data[windows],axis=1),
+                              self._data[vsz-skip:]))
+        return self._new(out)
 
     def findFirstIdxEqualTo(self,value=255):
         """
@@ -962,7 +999,7 @@ class LineScan(list):
         >>>> idx = ls.findFIRSTIDXEqualTo()
 
         """
-        vals = np.where(np.array(self)==value)[0]
+        vals = np.where(self._data==value)[0]
         retVal = None
         if( len(vals) > 0 ):
             retVal = vals[0]
@@ -991,7 +1028,7 @@ class LineScan(list):
 
         """
 
-        vals = np.where(np.array(self)==value)[0]
+        vals = np.where(self._data==value)[0]
         retVal = None
         if( len(vals) > 0 ):
             retVal = vals[-1]
@@ -1019,7 +1056,7 @@ class LineScan(list):
         >>>> idx = ls.findFIRSTIDXEqualTo()
 
         """
-        vals = np.where(np.array(self)>=value)[0]
+        vals = np.where(self._data>=value)[0]
         retVal = None
         if( len(vals) > 0 ):
             retVal = vals[0]
@@ -1048,12 +1085,7 @@ class LineScan(list):
         >>>> plt.plot(ls2)
 
         """
-        out = []
-        for pt in self:
-            out.append(lut[pt])
-        retVal = LineScan(out,image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2)
-        retVal._update(self)
-        return retVal
+        return self._new(np.asarray(lut)[self._data])
 
     def medianFilter(self, kernel_size=5):
         """
@@ -1085,10 +1117,8 @@ class LineScan(list):
             kernel_size-=1
             print "Kernel Size should be odd. New kernel size =" , (kernel_size)
         
-        medfilt_array = medfilt(np.asarray(self[:]), kernel_size)
-        retVal = LineScan(medfilt_array.astype("uint8").tolist(), image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2, x=self.col, y=self.row)
-        retVal._update(self)
-        return retVal
+        medfilt_array = medfilt(self._data, kernel_size)
+        return self._new(medfilt_array.astype("uint8"))
 
     def detrend(self):
         """
@@ -1114,10 +1144,8 @@ class LineScan(list):
         except ImportError:
             warnings.warn("Scipy vesion >= 0.11 requierd.")
             return None
-        detrend_arr = sdetrend(np.asarray(self[:]))
-        retVal = LineScan(detrend_arr.astype("uint8").tolist(), image=self.image,pointLoc=self.pointLoc,pt1=self.pt1,pt2=self.pt2, x=self.col, y=self.row)
-        retVal._update(self)
-        return retVal
+        detrend_arr = sdetrend(self._data)
+        return self._new(detrend_arr.astype("uint8"))
 
     def runningAverage(self, diameter=3, algo="uniform"):
         """
@@ -1158,9 +1186,7 @@ class LineScan(list):
             r=float(diameter)/2
             for i in range(-int(r),int(r)+1):
                 kernel.append(np.exp(-i**2/(2*(r/3)**2))/(np.sqrt(2*np.pi)*(r/3)))
-        retVal = LineScan(map(int,self.convolve(kernel)))
-        retVal._update(self)
-        return retVal
+        return self._new(self.convolve(kernel)._data.astype(int))
 
     def findPeaks(self, window = 30, delta = 3):
         """
@@ -1195,6 +1221,7 @@ class LineScan(list):
         maximum = -np.Inf
         width = int(window/2.0)
         peaks = []
+        windowMax = self._windowed(width, -np.Inf).max(axis=1).tolist()
 
         for index,val in enumerate(self):
             #peak found
@@ -1202,11 +1229,21 @@ class LineScan(list):
                 maximum = val
                 maxpos = index
             #checking whether peak satisfies window and delta conditions
-            if max( self[max(0, index-width):index+width])+delta< maximum:
+            if windowMax[index]+delta< maximum:
                 peaks.append((maxpos, maximum))
                 maximum = -np.Inf
         return peaks
 
+    def _windowed(self, width, fill):
+        """
+        An N x 2*width array whose row i holds the samples from i-width
+        up to (but not including) i+width, with fill past either end.
+        """
+        width = max(width,1)
+        padded = np.concatenate(([fill]*width,self._data,[fill]*width))
+        return np.lib.stride_tricks.as_strided(padded,shape=(len(self),2*width),
+                                               strides=(padded.strides[0],padded.strides[0]))
+
     def findValleys(self,window = 30, delta = 3 ):
         """
         **SUMMARY**
@@ -1239,6 +1276,7 @@ class LineScan(list):
         minimum = np.Inf
         width = int(window/2.0)
         peaks = []
+        windowMin = self._windowed(width, np.Inf).min(axis=1).tolist()
 
         for index,val in enumerate(self):
             #peak found
@@ -1246,7 +1284,7 @@ class LineScan(list):
                 minimum = val
                 minpos = index
             #checking whether peak satisfies window and delta conditions
-            if min( self[max(0, index-width):index+width])-delta > minimum:
+            if windowMin[index]-delta > minimum:
                 peaks.append((minpos, minimum))
                 minimum = np.Inf
         return peaks
@@ -1289,7 +1327,7 @@ class LineScan(list):
             warnings.warn('LineScan.fitSpline - degree needs to be >= 1')
             return None
         retVal = None
-        y = np.array(self)
+        y = np.array(self._data)
         x = np.arange(0,len(y),1)
         dx = 1
         newx = np.arange(0,len(y)-1,pow(0.1,degree))
@@ -0,0 +1,276 @@
+from SimpleCV.base import *
+from SimpleCV.ImageClass import Image, ImageSet
+from SimpleCV.Color import Color
+import hashlib
+import multiprocessing
+"""
+The FeatureBatch runs a list of feature extractors over a whole collection of
+images at once. The extraction is spread across a pool of worker processes and
+the results are packed into one contiguous float32 matrix, one row per image.
+The matrix can be checkpointed to a directory so that training a second
+classifier (or the same one with a different K) on the same images does not
+pay for feature extraction again.
+"""
+
+# the extractors used inside a worker process, set once by the pool initializer
+_workerExtractors = None
+
+def _batchInit(extractors):
+    global _workerExtractors
+    _workerExtractors = extractors
+
+def _batchExtract(source):
+    return _extractVector(_workerExtractors, source)
+
+def _loadSource(source):
+    """
+    Turn a source into an Image. A source is an Image, an image path, or a
+    (path, (width, height)) tuple for a path that has to be resized.
+    """
+    if isinstance(source, basestring):
+        return Image(source)
+    if isinstance(source, tuple):
+        (path, size) = source
+        return Image(path).resize(size[0], size[1])
+    return source
+
+def _extractVector(extractors, source):
+    """
+    Run every extractor on one image (or image source). Returns the feature
+    vector as a list, or None if any of the extractors failed.
+    """
+    img = _loadSource(source)
+    featureVector = []
+    for extractor in extractors:
+        feats = extractor.extract(img)
+        if( feats is None ):
+            return None
+        featureVector.extend(feats)
+    return featureVector
+
+class FeatureBatch(object):
+    """
+    **SUMMARY**
+
+    Extract the features of many images in one go. This is what the
+    classifiers use to train and test, but it can also be used on its own to
+    build a feature matrix for some other learner.
+
+    **PARAMETERS**
+
+    * *extractors* - A list of FeatureExtractorBase objects.
+    * *processes* - The number of worker processes to use. None uses one per
+      CPU, 1 runs everything in this process.
+    * *checkpoint* - A directory to cache extracted matrices in. None turns
+      checkpointing off.
+
+    **EXAMPLE**
+
+    >>> extractors = [HueHistogramFeatureExtractor(), EdgeHistogramFeatureExtractor()]
+    >>> batch = FeatureBatch(extractors, processes=8, checkpoint='./features')
+    >>> features, keep = batch.extract(ImageSet('./data/cats'))
+    >>> features.shape
+    (1000, 26)
+
+    """
+    mExtractors = None
+    mProcesses = 1
+    mCheckpoint = None
+    mChunkSize = 8
+
+    def __init__(self, extractors, processes=1, checkpoint=None):
+        self.mExtractors = list(extractors)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.mProcesses = max(1, int(processes))
+        self.mCheckpoint = checkpoint
+
+    def getFieldNames(self):
+        """
+        The column names of the feature matrix.
+        """
+        colNames = []
+        for extractor in self.mExtractors:
+            colNames.extend(extractor.getFieldNames())
+        return colNames
+
+    def extract(self, images, verbose=False, callback=None):
+        """
+        **SUMMARY**
+
+        Run the extractors over every image.
+
+        **PARAMETERS**
+
+        * *images* - A list of image paths, a list of Images, or an ImageSet.
+        * *verbose* - Print each file name as it is processed.
+        * *callback* - A function called as callback(img, featureVector) for
+          every image that extracted cleanly, e.g. to draw it on a display.
+          Giving a callback keeps all of the work in this process, since the
+          workers can not hand the decoded images back.
+
+        **RETURNS**
+
+        A tuple (features, keep). features is a C contiguous float32 array of
+        shape (n, len(getFieldNames())) holding the images whose features
+        all extracted, in their original order. keep is a boolean array with
+        one entry per input image telling which of them made it into features.
+
+        """
+        sources = self._sources(images)
+        nfields = len(self.getFieldNames())
+
+        fname = None
+        if callback is None:
+            fname = self._checkpointFile(sources)
+        if fname is not None and os.path.exists(fname):
+            try:
+                data = np.load(fname)
+                return data['features'], data['keep']
+            except Exception as e:
+                logger.warning("Could not read feature checkpoint " + fname + ": " + str(e))
+
+        features = np.zeros((len(sources), nfields), dtype=np.float32)
+        keep = np.zeros(len(sources), dtype=bool)
+        for i, featureVector in enumerate(self._vectors(images, sources, verbose, callback)):
+            if( featureVector is None ):
+                continue
+            if( len(featureVector) != nfields ):
+                logger.warning("Feature vector for image " + str(i) + " has the wrong length - skipping")
+                continue
+            features[i] = featureVector
+            keep[i] = True
+        features = np.ascontiguousarray(features[keep])
+
+        if fname is not None:
+            tmp = fname + '.tmp.npz'
+            np.savez(tmp, features=features, keep=keep)
+            os.rename(tmp, fname)
+        return features, keep
+
+    def _vectors(self, images, sources, verbose, callback):
+        """
+        Yield a feature vector (or None) for every image, in order. In this
+        process the images are used as they are, only the pool gets sources.
+        """
+        if callback is not None or self.mProcesses == 1 or len(sources) < 2:
+            for source in images:
+                img = _loadSource(source)
+                if verbose:
+                    print "Opening file: " + self._name(img)
+                featureVector = _extractVector(self.mExtractors, img)
+                if featureVector is not None and callback is not None:
+                    callback(img, featureVector)
+                yield featureVector
+            return
+
+        pool = multiprocessing.Pool(min(self.mProcesses, len(sources)), _batchInit, (self.mExtractors,))
+        try:
+            for i, featureVector in enumerate(pool.imap(_batchExtract, sources, self.mChunkSize)):
+                if verbose:
+                    print "Extracted file: " + self._name(sources[i])
+                yield featureVector
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _sources(self, images):
+        """
+        Turn the input into a list of things the workers can load cheaply.
+        Only paths that have not been decoded yet stay paths (with the size to
+        resize to for a standardized lazy ImageSet); an Image may have been
+        changed since it was read, so it is always sent as it is.
+        """
+        if not (isinstance(images, ImageSet) and images._lazy):
+            return list(images)
+        sources = []
+        for item in images._items():
+            if isinstance(item, basestring):
+                with images._cacheLock:
+                    cached = images._cache.get(item)
+                if cached is not None:
+                    item = cached
+                elif images._size is not None:
+                    item = (item, images._size)
+            sources.append(item)
+        return sources
+
+    def _name(self, source):
+        if isinstance(source, basestring):
+            return source
+        if isinstance(source, tuple):
+            return source[0]
+        return str(source.filename)
+
+    def _checkpointFile(self, sources):
+        """
+        The checkpoint file for this set of extractors and images, or None if
+        checkpointing is off or the images are not all files on disk.
+        """
+        if self.mCheckpoint is None:
+            return None
+        key = hashlib.sha1()
+        for extractor in self.mExtractors:
+            key.update(extractor.__class__.__name__)
+            key.update(repr(extractor.getFieldNames()))
+            try:
+                key.update(pickle.dumps(extractor, 2))
+            except Exception:
+                pass
+        for source in sources:
+            size = None
+            if isinstance(source, tuple):
+                (source, size) = source
+            if not isinstance(source, basestring):
+                return None
+            stat = os.stat(source)
+            key.update(repr((os.path.abspath(source), stat.st_size, stat.st_mtime, size)))
+        if not os.path.isdir(self.mCheckpoint):
+            os.makedirs(self.mCheckpoint)
+        return os.path.join(self.mCheckpoint, key.hexdigest() + '.npz')
+
+class FeatureBatchClassifier:
+    """
+    The part of training and testing the orange classifiers (KNN, naive
+    Bayes, SVM and tree) share: extracting a FeatureBatch and turning the
+    rows into examples. The classifier provides mDataSetRaw, mOrangeDomain,
+    mClassifier and _WriteText.
+    """
+
+    def _trainBatch(self,images,className,disp,verbose,batch):
+        callback = None
+        if(disp is not None):
+            text = 'Training: ' + className
+            callback = lambda img, featureVector: self._WriteText(disp,img,text,Color.WHITE)
+        features, keep = batch.extract(images,verbose=verbose,callback=callback)
+        for featureVector in features.tolist():
+            featureVector.extend([className])
+            self.mDataSetRaw.append(featureVector)
+        return len(features)
+
+    def _testBatch(self,images,className,dataset,disp,verbose,batch):
+        results = []
+        def classify(img, featureVector):
+            featureVector = list(featureVector) + [className]
+            dataset.append(featureVector)
+            test = orange.ExampleTable(self.mOrangeDomain,[featureVector])
+            c = self.mClassifier(test[0])
+            testClass = test[0].getclass()
+            results.append(testClass==c)
+            if(img is None):
+                return
+            if(testClass==c):
+                text =  "Classified as " + str(c)
+                self._WriteText(disp,img,text, Color.GREEN)
+            else:
+                text =  "Mislassified as " + str(c)
+                self._WriteText(disp,img,text, Color.RED)
+
+        if(disp is not None):
+            batch.extract(images,verbose=verbose,callback=classify)
+        else:
+            features, keep = batch.extract(images,verbose=verbose)
+            for featureVector in features.tolist():
+                classify(None,featureVector)
+        return([dataset,len(results),sum(results)])
@@ -2,6 +2,7 @@ from SimpleCV.base import *
 from SimpleCV.ImageClass import Image, ImageSet
 from SimpleCV.DrawingLayer import *
 from SimpleCV.Features import FeatureExtractorBase
+from SimpleCV.MachineLearning.FeatureBatch import FeatureBatch, FeatureBatchClassifier
 """
 This class is encapsulates almost everything needed to train, test, and deploy a
 multiclass support vector machine for an image classifier. Training data should
@@ -17,7 +18,7 @@ is as follows.
 7. Save the classifier.
 8. Deploy using the classify method.
 """
-class NaiveBayesClassifier:
+class NaiveBayesClassifier(FeatureBatchClassifier):
     """
     This class encapsulates a Naive Bayes Classifier.
     See:
@@ -104,70 +105,20 @@ class NaiveBayesClassifier:
         self.mFeatureExtractors = extractors
         return None
 
-    def _trainPath(self,path,className,subset,disp,verbose):
-        count = 0
+    def _trainPath(self,path,className,subset,disp,verbose,batch):
         files = []
         for ext in IMAGE_FORMATS:
             files.extend(glob.glob( os.path.join(path, ext)))
         if(subset > 0):
-            nfiles = min(subset,len(files))
-        else:
-            nfiles = len(files)
-        badFeat = False
-        for i in range(nfiles):
-            infile = files[i]
-            if verbose:
-                print "Opening file: " + infile
-            img = Image(infile)
-            featureVector = []
-            for extractor in self.mFeatureExtractors:
-                feats = extractor.extract(img)
-                if( feats is not None ):
-                    featureVector.extend(feats)
-                else:
-                    badFeat = True
-
-            if(badFeat):
-                badFeat = False
-                continue
-
-            featureVector.extend([className])
-            self.mDataSetRaw.append(featureVector)
-            text = 'Training: ' + className
-            self._WriteText(disp,img,text,Color.WHITE)
-            count = count + 1
-            del img
-        return count
-
-    def _trainImageSet(self,imageset,className,subset,disp,verbose):
-        count = 0
-        badFeat = False
+            files = files[0:subset]
+        return self._trainBatch(files,className,disp,verbose,batch)
+
+    def _trainImageSet(self,imageset,className,subset,disp,verbose,batch):
         if (subset>0):
-            imageset = imageset[0:subset]   
-        for img in imageset:
-            if verbose:
-                print "Opening file: " + img.filename
-            featureVector = []
-            for extractor in self.mFeatureExtractors:
-                feats = extractor.extract(img)
-                if( feats is not None ):
-                    featureVector.extend(feats)
-                else:
-                    badFeat = True
-                    
-            if(badFeat):
-                badFeat = False
-                continue
-            
-            featureVector.extend([className])
-            self.mDataSetRaw.append(featureVector)
-            text = 'Training: ' + className
-            self._WriteText(disp,img,text,Color.WHITE)
-            count = count + 1
-            del img
-        return count
-
-    def train(self,images,classNames,disp=None,subset=-1,savedata=None,verbose=True):
+            imageset = imageset[0:subset]
+        return self._trainBatch(imageset,className,disp,verbose,batch)
+
+    def train(self,images,classNames,disp=None,subset=-1,savedata=None,verbose=True,processes=1,checkpoint=None):
         """
         Train the classifier.
         images paramater can take in a list of paths or a list of imagesets
@@ -186,16 +137,25 @@ class NaiveBayesClassifier:
         name we save the data to a tab delimited file.
 
         verbose - print confusion matrix and file names
+
+        processes - the number of worker processes used to extract features,
+        None uses one per CPU.
+
+        checkpoint - if checkpoint is a directory the extracted features are
+        cached there, and later runs over the same images and extractors
+        skip extraction.
+
         returns [%Correct %Incorrect Confusion_Matrix]
         """
         count = 0
         self.mClassNames = classNames
+        batch = FeatureBatch(self.mFeatureExtractors,processes,checkpoint)
         # fore each class, get all of the data in the path and train
         for i in range(len(classNames)):
             if ( isinstance(images[i], str) ):
-                count = count + self._trainPath(images[i],classNames[i],subset,disp,verbose)
+                count = count + self._trainPath(images[i],classNames[i],subset,disp,verbose,batch)
             else:
-                count = count + self._trainImageSet(images[i],classNames[i],subset,disp,verbose)
+                count = count + self._trainImageSet(images[i],classNames[i],subset,disp,verbose,batch)
 
         colNames = []
         for extractor in self.mFeatureExtractors:
@@ -246,7 +206,7 @@ class NaiveBayesClassifier:
 
 
 
-    def test(self,images,classNames,disp=None,subset=-1,savedata=None,verbose=True):
+    def test(self,images,classNames,disp=None,subset=-1,savedata=None,verbose=True,processes=1,checkpoint=None):
         """
         Test the classifier.
         images paramater can take in a list of paths or a list of imagesets
@@ -265,11 +225,20 @@ class NaiveBayesClassifier:
         name we save the data to a tab delimited file.
 
         verbose - print confusion matrix and file names
+
+        processes - the number of worker processes used to extract features,
+        None uses one per CPU.
+
+        checkpoint - if checkpoint is a directory the extracted features are
+        cached there, and later runs over the same images and extractors
+        skip extraction.
+
         returns [%Correct %Incorrect Confusion_Matrix]
         """
         count = 0
         correct = 0
         self.mClassNames = classNames
+        batch = FeatureBatch(self.mFeatureExtractors,processes,checkpoint)
         colNames = []
         for extractor in self.mFeatureExtractors:
             colNames.extend(extractor.getFieldNames())
@@ -278,11 +247,11 @@ class NaiveBayesClassifier:
         dataset = []
         for i in range(len(classNames)):
             if ( isinstance(images[i],str) ):
-                [dataset,cnt,crct] =self._testPath(images[i],classNames[i],dataset,subset,disp,verbose)
+                [dataset,cnt,crct] =self._testPath(images[i],classNames[i],dataset,subset,disp,verbose,batch)
                 count = count + cnt
                 correct = correct + crct
             else:
-                [dataset,cnt,crct] =self._testImageSet(images[i],classNames[i],dataset,subset,disp,verbose)
+                [dataset,cnt,crct] =self._testImageSet(images[i],classNames[i],dataset,subset,disp,verbose,batch)
                 count = count + cnt
                 correct = correct + crct
 
@@ -310,86 +279,18 @@ class NaiveBayesClassifier:
 
         return [good, bad, confusion]
 
-    def _testPath(self,path,className,dataset,subset,disp,verbose):
-        count = 0
-        correct = 0
-        badFeat = False
+    def _testPath(self,path,className,dataset,subset,disp,verbose,batch):
         files = []
         for ext in IMAGE_FORMATS:
             files.extend(glob.glob( os.path.join(path, ext)))
         if(subset > 0):
-            nfiles = min(subset,len(files))
-        else:
-            nfiles = len(files)
-        for i in range(nfiles):
-            infile = files[i]
-            if verbose:
-                print "Opening file: " + infile
-            img = Image(infile)
-            featureVector = []
-            for extractor in self.mFeatureExtractors:
-                feats = extractor.extract(img)
-                if( feats is not None ):
-                    featureVector.extend(feats)
-                else:
-                    badFeat = True
-            if( badFeat ):
-                del img
-                badFeat = False
-                continue
-            featureVector.extend([className])
-            dataset.append(featureVector)
-            test = orange.ExampleTable(self.mOrangeDomain,[featureVector])
-            c = self.mClassifier(test[0])
-            testClass = test[0].getclass()
-            if(testClass==c):
-                text =  "Classified as " + str(c)
-                self._WriteText(disp,img,text, Color.GREEN)
-                correct = correct + 1
-            else:
-                text =  "Mislassified as " + str(c)
-                self._WriteText(disp,img,text, Color.RED)
-            count = count + 1
-            del img
+            files = files[0:subset]
+        return self._testBatch(files,className,dataset,disp,verbose,batch)
 
-        return([dataset,count,correct])
-
-    def _testImageSet(self,imageset,className,dataset,subset,disp,verbose):
-        count = 0
-        correct = 0
-        badFeat = False
+    def _testImageSet(self,imageset,className,dataset,subset,disp,verbose,batch):
         if(subset > 0):
             imageset = imageset[0:subset]
-        for img in imageset:
-            if verbose:
-                print "Opening file: " + img.filename
-            featureVector = []
-            for extractor in self.mFeatureExtractors:
-                feats = extractor.extract(img)
-                if( feats is not None ):
-                    featureVector.extend(feats)
-                else:
-                    badFeat = True
-            if( badFeat ):
-                del img
-                badFeat = False
-                continue 
-            featureVector.extend([className])
-            dataset.append(featureVector)
-            test = orange.ExampleTable(self.mOrangeDomain,[featureVector])
-            c = self.mClassifier(test[0])
-            testClass = test[0].getclass()
-            if(testClass==c):
-                text =  "Classified as " + str(c)
-                self._WriteText(disp,img,text, Color.GREEN)
-                correct = correct + 1
-            else:   
-                text =  "Mislassified as " + str(c)
-                self._WriteText(disp,img,text, Color.RED)
-            count = count + 1
-            del img
-            
-        return([dataset,count,correct])
+        return self._testBatch(imageset,className,dataset,disp,verbose,batch)
 
     def _WriteText(self, disp, img, txt,color):
         if(disp is not None):
@@ -4,7 +4,9 @@ from SimpleCV.Color import Color
 from SimpleCV.ImageClass import Image
 from SimpleCV.Features.Detection import ShapeContextDescriptor
 import math
+import hashlib
 import scipy.stats as sps
+from scipy.spatial import cKDTree
 
 
 """
@@ -12,7 +14,7 @@ Classify an object based on shape context
 """
 class ShapeContextClassifier():
 
-    def  __init__(self,images,labels):
+    def  __init__(self,images,labels,indexfile=None):
         """
         Create a shape context classifier.
 
@@ -20,33 +22,112 @@ class ShapeContextClassifier():
           to be detected are white.
 
         * *labels* - the names of each class of objects.
-        """
-        # The below import has been done in init since it throws "Need scikits learn installed" for $import SimpleCV
-        try:
-            from sklearn import neighbors
-        except:
-            print "Need scikits learn installed"
 
+        * *indexfile* - a file to keep the precomputed model descriptors in.
+          If it exists and was built for the same labels and model images the
+          descriptors are read from it, otherwise they are computed and written to it.
+        """
         self.imgMap = {}
         self.ptMap = {}
         self.descMap = {}
-        self.knnMap = {}
+        self.treeMap = {}
         self.blobCount = {}
         self.labels = labels
         self.images = images
         import warnings
         warnings.simplefilter("ignore")
         for i in range(0,len(images)):
-            print "precomputing " + images[i].filename
             self.imgMap[labels[i]] = images[i]
 
+        if( indexfile is not None and os.path.exists(indexfile) ):
+            try:
+                self.loadIndex(indexfile)
+                return
+            except Exception as e:
+                logger.warning("Could not read shape context index " + indexfile + ": " + str(e))
+
+        for i in range(0,len(images)):
+            print "precomputing " + images[i].filename
             pts,desc,count  = self._image2FeatureVector(images[i])
             self.blobCount[labels[i]] = count
             self.ptMap[labels[i]] = pts
             self.descMap[labels[i]] = desc
-            knn = neighbors.KNeighborsClassifier()
-            knn.fit(desc,range(0,len(pts)))
-            self.knnMap[labels[i]] = knn
+
+        if( indexfile is not None ):
+            self.saveIndex(indexfile)
+
+    def saveIndex(self,fname):
+        """
+        Save the precomputed model points and descriptors to file.
+        """
+        index = {'labels':list(self.labels),
+                 'sources':self._sourceKeys(),
+                 'ptMap':self.ptMap,
+                 'descMap':self.descMap,
+                 'blobCount':self.blobCount}
+        output = open(fname, 'wb')
+        pickle.dump(index,output,2)
+        output.close()
+
+    def loadIndex(self,fname):
+        """
+        Read the model points and descriptors written by saveIndex. The index
+        must have been built for the same labels and model images as this
+        classifier.
+        """
+        index = pickle.load(open(fname, 'rb'))
+        if( index['labels'] != list(self.labels) ):
+            raise ValueError("the index was built for different labels")
+        if( index.get('sources') != self._sourceKeys() ):
+            raise ValueError("the index was built for different model images")
+        self.ptMap = index['ptMap']
+        self.descMap = index['descMap']
+        self.blobCount = index['blobCount']
+        self.treeMap = {}
+
+    def _sourceKeys(self):
+        """
+        Something that changes when a model image changes: the path, size and
+        modification time of images loaded from disk, a hash of the pixels of
+        the others.
+        """
+        keys = []
+        for img in self.images:
+            if( img.filename and os.path.isfile(img.filename) ):
+                stat = os.stat(img.filename)
+                keys.append((os.path.abspath(img.filename), stat.st_size, stat.st_mtime))
+            else:
+                keys.append((img.size(), hashlib.sha1(img.getNumpyCv2().tostring()).hexdigest()))
+        return keys
+
+    def load(cls, fname):
+        """
+        Load the classifier from file
+        """
+        return pickle.load(file(fname, 'rb'))
+    load = classmethod(load)
+
+    def save(self, fname):
+        """
+        Save the classifier to file
+        """
+        output = open(fname, 'wb')
+        pickle.dump(self,output,2)
+        output.close()
+
+    def __getstate__(self):
+        mydict = self.__dict__.copy()
+        # the trees are rebuilt from the descriptors when they are needed
+        mydict['treeMap'] = {}
+        return mydict
+
+    def _getTree(self,model_name):
+        """
+        The KD-tree over a model's descriptors, built on first use.
+        """
+        if( model_name not in self.treeMap ):
+            self.treeMap[model_name] = cKDTree(np.asarray(self.descMap[model_name],dtype=np.float64))
+        return self.treeMap[model_name]
 
     def _image2FeatureVector(self,img):
         """
@@ -61,12 +142,12 @@ class ShapeContextClassifier():
             count = len(blobs)
             for b in blobs:
                 fulllist += b._filterSCPoints()
-                raw_descriptors = blobs[0]._generateSC(fulllist)
+            raw_descriptors = blobs[0]._generateSC(fulllist)
         return fulllist,raw_descriptors,count
 
 
     def _getMatch(self,model_scd,test_scd):
-        correspondence,distance = self._doMatching(model_scd,test_scd)
+        correspondence,distances = self._doMatching(model_scd,test_scd)
         return self._matchQuality(distances)
 
     def _doMatching(self,model_name,test_scd):
@@ -75,20 +156,12 @@ class ShapeContextClassifier():
         # some magic metric that keeps features
         # with a lot of points from dominating
         #metric = 1.0 + np.log10( np.max([myPts,otPts])/np.min([myPts,otPts])) # <-- this could be moved to after the sum
-        otherIdx = []
-        distance = []
-        import warnings
-        warnings.simplefilter("ignore")
-        results = []
-        for sample in test_scd:
-            best = self.knnMap[model_name].predict(sample)
-            idx = best[0] # this is where we can play with k
-            scd = self.descMap[model_name][idx]
-            temp = np.sqrt(np.sum(((sample-scd)**2)))
-            #temp = 0.5*np.sum((sample-scd)**2)/np.sum((sample+scd))
-            if( math.isnan(temp) ):
-                temp = sys.maxint
-            distance.append(temp)
+        test_scd = np.asarray(test_scd,dtype=np.float64)
+        if( len(test_scd) == 0 or len(self.descMap[model_name]) == 0 ):
+            return [np.zeros(len(test_scd),dtype=int),np.zeros(len(test_scd))+sys.maxint]
+        # one query for every descriptor against the model
+        distance,otherIdx = self._getTree(model_name).query(test_scd)
+        distance[~np.isfinite(distance)] = sys.maxint
         return [otherIdx,distance]
 
     def _matchQuality(self,distances):
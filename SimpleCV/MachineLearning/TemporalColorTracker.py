@@ -3,6 +3,7 @@ import numpy as np
 import scipy.signal as sps
 import warnings
 import time as time
+from collections import deque
 class TemporalColorTracker:
     """
     **SUMMARY**
@@ -15,7 +16,13 @@ class TemporalColorTracker:
     
     """
     def __init__(self):
-        self._rtData = LineScan([]) # the deployed data
+        self._ring = None # the deployed data, a ring buffer one window long
+        self._ringPos = 0
+        self._frame = 0
+        self._before = None # monotonic queues for the running max/min
+        self._after = None  # on each side of the window center
+        self._afterMin = None
+        self._pkDelta = 3
         self._steadyState = None # mu/signal for the ss behavior
         self._extractor = None
         self._roi = None
@@ -102,11 +109,13 @@ class TemporalColorTracker:
         self.corrStdMult = corrStdMult
         self._extractor = extractor #function that returns a RGB values
         self._roi = roi
+        self._pkDelta = pkDelta
         self._extract(src,maxFrames,verbose)
         self._findSteadyState(windowSzPrct=ssWndw)
         self._findPeaks(pkWndw,pkDelta)
         self._extractSignalInfo(forceChannel)
         self._buildSignalProfile()
+        self._resetBuffer()
         if verbose:
             for key in self.data.keys():
                 print 30*'-'
@@ -121,47 +130,61 @@ class TemporalColorTracker:
             print "BEST WINDOW: {0}".format(self._window)
             print "BEST CUTOFF: {0}".format(self._cutoff)
                 
-    def _getDataFromImg(self,img):
+    def _getColor(self,img):
         """
-        Get the data from the image 
+        Get the (R,G,B) value of the image
         """
-        mc = None
         if( self._extractor ):
-            mc = self._extractor(img)
-        else:
-            temp = self._roi.reassign(img)    
-            mc = temp.meanColor()
-        self.data['r'].append(mc[0])
-        self.data['g'].append(mc[1])
-        self.data['b'].append(mc[2])
-        # NEED TO CHECK THAT THIS REALLY RGB
-        self.data['i'].append(Color.getLightness(mc))
-        self.data['h'].append(Color.getHueFromRGB(mc))
-        #return [mc[0],mc[1],mc[2],gray,Color.rgbToHue(mc)]
+            return self._extractor(img)
+        temp = self._roi.reassign(img)
+        return temp.meanColor()
 
     def _extract(self,src,maxFrames,verbose):
         # get the full dataset and append it to the data vector dictionary.
-        self.data = {'r':[],'g':[],'b':[],'i':[],'h':[]}
-        if( isinstance(src,ImageSet) ):
-            src = VirtualCamera(src,st='imageset') # this could cause a bug
-        elif( isinstance(src,(VirtualCamera,Camera))):
-            count = 0
-            for i in range(0,maxFrames):
-                img = src.getImage()
+        colors = np.zeros((maxFrames,3))
+        count = 0
+        if( isinstance(src,(ImageSet,list)) ):
+            for img in src[0:maxFrames]:
+                colors[count] = self._getColor(img)[0:3]
                 count = count + 1
                 if( verbose ):
                     print "Got Frame {0}".format(count)
+        elif( isinstance(src,(VirtualCamera,Camera))):
+            for i in range(0,maxFrames):
+                img = src.getImage()
                 if( isinstance(src,Camera) ):
                     time.sleep(0.05) # let the camera sleep
                 if( img is None ):
                     break
-                else:
-                    self._getDataFromImg(img)
-                
+                colors[count] = self._getColor(img)[0:3]
+                count = count + 1
+                if( verbose ):
+                    print "Got Frame {0}".format(count)
         else:
             raise Exception('Not a valid training source')
-            return None
-    
+        self._setData(colors[0:count])
+
+    def _setData(self,colors):
+        """
+        Split an N x 3 array of RGB values into the data channels.
+        """
+        r = colors[:,0]
+        g = colors[:,1]
+        b = colors[:,2]
+        maxc = np.max(colors,axis=1)
+        minc = np.min(colors,axis=1)
+        # NEED TO CHECK THAT THIS REALLY RGB
+        # Color.getLightness for every frame
+        light = np.floor((maxc+minc)/2.0)
+        # Color.getHueFromRGB for every frame, the colorsys hue
+        spread = np.where(maxc == minc,1.0,maxc-minc)
+        rc = (maxc-r)/spread
+        gc = (maxc-g)/spread
+        bc = (maxc-b)/spread
+        hue = np.where(r == maxc,bc-gc,np.where(g == maxc,2.0+rc-bc,4.0+gc-rc))
+        hue = np.where(maxc == minc,0.0,(hue/6.0)%1.0)*180
+        self.data = {'r':r,'g':g,'b':b,'i':light,'h':hue}
+
     def _findSteadyState(self,windowSzPrct=0.05):
         # slide a window across each of the signals
         # find where the std dev of the window is minimal
@@ -172,14 +195,17 @@ class TemporalColorTracker:
         self._steadyState = {}
         for key in self.data.keys():
             wndwSz = int(np.floor(windowSzPrct*len(self.data[key])))
-            signal = self.data[key]
-            # slide the window and get the std
-            data = [np.std(signal[i:i+wndwSz]) for i in range(0,len(signal)-wndwSz)]
+            signal = np.asarray(self.data[key],dtype=np.float64)
+            # the std of every window from running sums
+            csum = np.concatenate(([0.0],np.cumsum(signal)))
+            csq = np.concatenate(([0.0],np.cumsum(signal*signal)))
+            nwndw = len(signal)-wndwSz
+            mean = (csum[wndwSz:wndwSz+nwndw]-csum[0:nwndw])/wndwSz
+            sq = (csq[wndwSz:wndwSz+nwndw]-csq[0:nwndw])/wndwSz
+            data = np.sqrt(np.clip(sq-(mean*mean),0,None))
             # find the first spot where sd is minimal
-            index = np.where(data==np.min(data))[0][0]
-            # find the mean for the window
-            mean = np.mean(signal[index:index+wndwSz])
-            self._steadyState[key]=(mean,data[index])
+            index = np.argmin(data)
+            self._steadyState[key]=(mean[index],data[index])
 
 
     def _findPeaks(self,pkWndw,pkDelta):
@@ -262,7 +288,8 @@ class TemporalColorTracker:
             # constrain it to be an od window
             if int(p2pMean) % 2 == 1:
                 p2pMean = p2pMean+1 
-            self._window = p2pMean
+            # the peak test needs samples on both sides of the center
+            self._window = max(p2pMean,4)
         else:
             raise Exception("Can't find enough peaks")
         if( self.doCorr and self._window is not None ):
@@ -306,11 +333,7 @@ class TemporalColorTracker:
         """
         Extract the data from the live signal
         """
-        if( self._extractor ):
-            mc = self._extractor(img)
-        else:
-            temp = self._roi.reassign(img)    
-            mc = temp.meanColor()
+        mc = self._getColor(img)
         if( self._bestKey == 'r' ):
             return mc[0]
         elif( self._bestKey == 'g' ):
@@ -321,41 +344,91 @@ class TemporalColorTracker:
             return Color.getLightness(mc)
         elif( self._bestKey == 'h' ):
             return Color.getHueFromRGB(mc)
-        
+
+    def _resetBuffer(self):
+        """
+        Empty the live signal buffer.
+        """
+        self._ring = np.zeros(self._window)
+        self._ringPos = 0
+        self._frame = 0
+        self._before = deque()
+        self._after = deque()
+        self._afterMin = deque()
+
+    def _pushQueue(self,queue,idx,val,oldest):
+        """
+        Add a value to a monotonic (decreasing) queue and drop anything older
+        than oldest, so queue[0] is always the largest recent value.
+        """
+        while( len(queue) > 0 and queue[-1][1] <= val ):
+            queue.pop()
+        queue.append((idx,val))
+        while( len(queue) > 0 and queue[0][0] < oldest ):
+            queue.popleft()
+
+    def getSignal(self):
+        """
+        Return the live signal window, oldest sample first.
+        """
+        if( self._ring is None ):
+            return LineScan([])
+        if( self._frame < self._window ):
+            return LineScan(self._ring[0:self._frame])
+        return LineScan(np.concatenate((self._ring[self._ringPos:],self._ring[0:self._ringPos])))
+
     def _updateBuffer(self,v):
         """
         Keep a buffer of the running data and process it to determine if there is
-        a peak. 
+        a peak. The sample in the center of the window is a peak when it is
+        past the cutoff, larger than everything before it in the window, at
+        least as large as everything after it, and the signal has dropped by
+        more than pkDelta since. Valleys are the same test on the negated
+        signal. The running max/min on each side of the center are kept in
+        monotonic queues so each frame costs the same whatever the window.
         """
-        self._rtData.append(v)
-        wndwCenter = int(np.floor(self._window/2.0))
-        # pop the end of the buffer
-        if( len(self._rtData) > self._window):
-            self._rtData = self._rtData[1:]
-            if( self._isPeak ):
-                lm = self._rtData.findPeaks()
-                for l in lm:
-                    if( l[0] == wndwCenter and l[1] > self._cutoff ):
-                        if( self.doCorr ):
-                            corrVal = np.correlate(self._rtData.normalize(),self._template)
-                            thresh = self.corrThresh[0]-self.corrStdMult*self.corrThresh[1]
-                            if( corrVal[0] > thresh ):
-                                self.count += 1
-                        else:
-                            self.count += 1
+        if( self._ring is None ):
+            self._resetBuffer()
+        sign = 1.0
+        if( not self._isPeak ):
+            sign = -1.0
+        wndw = self._window
+        wndwCenter = int(np.floor(wndw/2.0))
+        # sample t lives at t % wndw in the ring
+        t = self._frame
+        self._ring[self._ringPos] = v
+        self._ringPos = (self._ringPos+1) % wndw
+        self._frame = t+1
+
+        # the samples after the center, the newest wndw-wndwCenter-1 of them
+        oldest = t-(wndw-wndwCenter-1)+1
+        self._pushQueue(self._after,t,sign*v,oldest)
+        self._pushQueue(self._afterMin,t,-sign*v,oldest)
+        center = t-(wndw-wndwCenter-1)
+        if( center < 1 ):
+            return self.count
+        # the old center moves into the samples before the center
+        prev = self._ring[(center-1) % wndw]
+        self._pushQueue(self._before,center-1,sign*prev,center-wndwCenter)
+        if( t < wndw-1 ):
+            return self.count
+
+        c = sign*self._ring[center % wndw]
+        if( c > sign*self._cutoff and
+            c > self._before[0][1] and
+            c >= self._after[0][1] and
+            c+self._afterMin[0][1] > self._pkDelta ):
+            if( self.doCorr ):
+                # only candidate peaks pay for the correlation
+                window = np.concatenate((self._ring[self._ringPos:],self._ring[0:self._ringPos]))
+                corrVal = np.dot(window,self._template)/np.max(window)
+                thresh = self.corrThresh[0]-self.corrStdMult*self.corrThresh[1]
+                if( corrVal > thresh ):
+                    self.count += 1
             else:
-                lm = self._rtData.findValleys()
-                for l in lm:
-                    if( l[0] == wndwCenter and l[1] < self._cutoff ):
-                        if( self.doCorr ):
-                            corrVal = np.correlate(self._rtData.normalize(),self._template)
-                            thresh = self.corrThresh[0]-self.corrStdMult*self.corrThresh[1]
-                            if( corrVal[0] > thresh ):
-                                self.count += 1
-                        else:
-                            self.count += 1
+                self.count += 1
         return self.count
-        
+
     def recognize(self,img):
         """
 
@@ -22,7 +22,7 @@ disp = Display((800,600))
 while disp.isNotDone():
     img = cam.getImage()
     result = tct.recognize(img)
-    plt.plot(tct._rtData,'r-')
+    plt.plot(tct.getSignal(),'r-')
     plt.grid()
     plt.savefig('temp.png')
     plt.clf()
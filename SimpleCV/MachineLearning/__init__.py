@@ -1,5 +1,6 @@
 from SimpleCV.MachineLearning.SVMClassifier import *
 from SimpleCV.MachineLearning.TreeClassifier import *
+from SimpleCV.MachineLearning.FeatureBatch import *
 from SimpleCV.MachineLearning.KNNClassifier import *
 from SimpleCV.MachineLearning.NaiveBayesClassifier import *
 from SimpleCV.MachineLearning.ShapeContextClassifier import *
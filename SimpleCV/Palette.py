@@ -0,0 +1,162 @@
+# SimpleCV Palette Library
+#load required libraries
+from SimpleCV.base import *
+
+
+class Palette:
+    """
+    **SUMMARY**
+
+    A palette is the set of the main colors of an image, found by clustering
+    the colors of its pixels with k-means. The Palette object keeps the
+    clusters around so that they can be applied to any number of images
+    (for example the frames of a video) without clustering again, and so that
+    retraining on a new frame can start from the previous centroids instead
+    of from scratch.
+
+    **PARAMETERS**
+
+    * *bins* - the number of colors in the palette.
+    * *hue* - if hue is True cluster on the single hue channel, like the hue
+      option of Image.getPalette.
+    * *centroids* - A list of tuples that are the initial k-means estimates.
+    * *samples* - the largest number of pixels k-means looks at. Larger images
+      are subsampled evenly down to about this many pixels. None uses every
+      pixel.
+
+    **EXAMPLE**
+
+    >>> cam = Camera()
+    >>> palette = Palette(bins=8, samples=10000)
+    >>> palette.train(cam.getImage())
+    >>> while True:
+    >>>     img = palette.apply(cam.getImage())
+    >>>     img.binarizeFromPalette(palette.getColors()[0:2]).show()
+
+    """
+    mBins = 10
+    mHue = False
+    mSamples = None
+    mCentroids = None # the float k-means centroids
+
+    def __init__(self, bins=10, hue=False, centroids=None, samples=None):
+        self.mBins = bins
+        self.mHue = hue
+        self.mSamples = samples
+        self.mCentroids = None
+        if centroids is not None:
+            centroids = np.array(centroids, dtype='float64')
+            if hue:
+                centroids = centroids.reshape(-1, 1)
+            self.mCentroids = centroids
+
+    def _getPixels(self, img):
+        """
+        The pixels of the image as an N x 3 RGB or N x 1 hue array, in the
+        order the image keeps its palette members in.
+        """
+        if self.mHue:
+            hsv = img
+            if not img.isHSV():
+                hsv = img.toHSV()
+            return hsv.getNumpyCv2()[:, :, 2].reshape(-1, 1)
+        return img.getNumpy().reshape(-1, 3)
+
+    def train(self, img):
+        """
+        **SUMMARY**
+
+        Find the palette of an image. If the palette has already been trained
+        (or was given centroids) k-means starts from the current centroids,
+        which is much faster than starting over when the colors have not
+        changed much, e.g. from one video frame to the next.
+
+        **PARAMETERS**
+
+        * *img* - The image to find the palette of.
+
+        **RETURNS**
+
+        The palette colors, see getColors.
+
+        """
+        pixels = self._getPixels(img)
+        if self.mSamples is not None and len(pixels) > self.mSamples:
+            pixels = pixels[::len(pixels) // self.mSamples]
+        pixels = pixels.astype('float64')
+        if self.mCentroids is None:
+            result = scv.kmeans(pixels, self.mBins)
+        else:
+            result = scv.kmeans(pixels, self.mCentroids)
+        self.mCentroids = result[0]
+        return self.getColors()
+
+    def getColors(self):
+        """
+        **SUMMARY**
+
+        The palette colors as a uint8 array, the same as Image.getPalette
+        returns. None if the palette has not been trained.
+
+        """
+        if self.mCentroids is None:
+            return None
+        return np.array(self.mCentroids, dtype='uint8')
+
+    def getMembers(self, img):
+        """
+        **SUMMARY**
+
+        Find the palette color nearest to each pixel of an image.
+
+        **RETURNS**
+
+        A flat numpy array with the palette index of every pixel.
+
+        """
+        pixels = self._getPixels(img)
+        if self.mHue:
+            # only 256 possible values, so look each of them up once
+            values = np.arange(256, dtype='float64').reshape(-1, 1)
+            lut = scv.vq(values, self.mCentroids)[0]
+            return lut[pixels.ravel()]
+        return scv.vq(pixels, self.mCentroids)[0]
+
+    def getPercentages(self, members):
+        """
+        **SUMMARY**
+
+        The fraction of the pixels that belong to each palette color.
+
+        **PARAMETERS**
+
+        * *members* - the palette members of an image, from getMembers.
+
+        """
+        counts = np.bincount(members, minlength=len(self.mCentroids))
+        return (counts / float(max(len(members), 1))).tolist()
+
+    def apply(self, img):
+        """
+        **SUMMARY**
+
+        Apply the palette to an image without clustering it. After this
+        the image's palette methods (palettize, binarizeFromPalette,
+        findBlobsFromPalette, drawPaletteColors) use this palette, as long as
+        they are called with this palette's bins and hue settings.
+
+        **PARAMETERS**
+
+        * *img* - The image to apply the palette to.
+
+        **RETURNS**
+
+        The image.
+
+        """
+        if self.mCentroids is None:
+            logger.warning("Palette.apply: the palette has not been trained")
+            return img
+        members = self.getMembers(img)
+        img._setPalette(self.mBins, self.mHue, self.getColors(), members, self.getPercentages(members))
+        return img
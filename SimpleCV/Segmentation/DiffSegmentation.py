@@ -1,4 +1,5 @@
 from SimpleCV.base import *
+import cv2
 from SimpleCV.Features import Feature, FeatureSet, BlobMaker
 from SimpleCV.ImageClass import Image
 from SimpleCV.Segmentation.SegmentationBase import SegmentationBase
@@ -24,22 +25,23 @@ class DiffSegmentation(SegmentationBase):
 
     """
     mError = False
-    mLastImg = None
-    mCurrImg = None
-    mDiffImg = None
+    mLast = None
     mColorImg = None
     mGrayOnlyMode = True
     mThreshold = 10
     mBlobMaker = None
+    mFrameCount = 0
+    mMaskReady = False
 
     def __init__(self, grayOnly=False, threshold = (10,10,10) ):
         self.mGrayOnlyMode = grayOnly
         self.mThreshold = threshold
         self.mError = False
-        self.mCurrImg = None
-        self.mLastImg = None
-        self.mDiffImg = None
+        self.mLast = None
+        self.mBuffers = None
         self.mColorImg = None
+        self.mFrameCount = 0
+        self.mMaskReady = False
         self.mBlobMaker = BlobMaker()
 
     def addImage(self, img):
@@ -48,29 +50,27 @@ class DiffSegmentation(SegmentationBase):
         """
         if( img is None ):
             return
-        if( self.mLastImg == None ):
-            if( self.mGrayOnlyMode ):
-                self.mLastImg = img.toGray()
-                self.mDiffImg = Image(self.mLastImg.getEmpty(1))
-                self.mCurrImg = None
-            else:
-                self.mLastImg = img
-                self.mDiffImg = Image(self.mLastImg.getEmpty(3))
-                self.mCurrImg = None
-        else:
-            if( self.mCurrImg is not None ): #catch the first step
-                self.mLastImg = self.mCurrImg
 
-            if( self.mGrayOnlyMode ):
-                self.mColorImg = img
-                self.mCurrImg = img.toGray()
+        if( self.mGrayOnlyMode ):
+            #two gray buffers take turns holding the current and the last frame
+            frame = self._getBuffer('gray%d' % (self.mFrameCount % 2), (img.height, img.width))
+            if( img.isBGR() ):
+                cv2.cvtColor(img.getNumpyCv2(), cv2.COLOR_BGR2GRAY, frame)
             else:
-                self.mColorImg = img
-                self.mCurrImg = img
-
+                frame[...] = img.getGrayNumpyCv2()
+        else:
+            frame = img.getNumpyCv2()
 
-            cv.AbsDiff(self.mCurrImg.getBitmap(),self.mLastImg.getBitmap(),self.mDiffImg.getBitmap())
+        diff = self._getBuffer('diff', frame.shape)
+        if( self.mLast is None or self.mLast.shape != frame.shape ):
+            diff.fill(0)
+        else:
+            self.mColorImg = img
+            cv2.absdiff(frame, self.mLast, diff)
 
+        self.mLast = frame
+        self.mFrameCount = self.mFrameCount + 1
+        self.mMaskReady = False
         return
 
 
@@ -78,7 +78,7 @@ class DiffSegmentation(SegmentationBase):
         """
         Returns true if the camera has a segmented image ready.
         """
-        if( self.mDiffImg is None ):
+        if( self.mLast is None ):
             return False
         else:
             return True
@@ -103,42 +103,61 @@ class DiffSegmentation(SegmentationBase):
         """
         Perform a reset of the segmentation systems underlying data.
         """
-        self.mCurrImg = None
-        self.mLastImg = None
-        self.mDiffImg = None
+        self.mLast = None
+        self.mBuffers = None
+        self.mMaskReady = False
 
     def getRawImage(self):
         """
         Return the segmented image with white representing the foreground
         and black the background.
         """
-        return self.mDiffImg
+        if( not self.isReady() ):
+            return None
+        return Image(self.mBuffers['diff'], cv2image=True)
 
     def getSegmentedImage(self, whiteFG=True):
         """
         Return the segmented image with white representing the foreground
         and black the background.
         """
-        retVal = None
+        if( not self.isReady() ):
+            return None
+        mask = self._updateMask()
         if( whiteFG ):
-            retVal = self.mDiffImg.binarize(thresh=self.mThreshold)
-        else:
-            retVal = self.mDiffImg.binarize(thresh=self.mThreshold).invert()
-        return retVal
+            return Image(mask, cv2image=True)
+        return Image(cv2.bitwise_not(mask), cv2image=True, copy=False)
 
     def getSegmentedBlobs(self):
         """
         return the segmented blobs from the fg/bg image
         """
         retVal = []
-        if( self.mColorImg is not None and self.mDiffImg is not None ):
-            retVal = self.mBlobMaker.extractFromBinary(self.mDiffImg.binarize(thresh=self.mThreshold),self.mColorImg)
+        if( self.mColorImg is not None and self.isReady() ):
+            #the blob maker doesn't hold on to the mask, so lend it ours
+            mask = Image(self._updateMask(), cv2image=True, copy=False)
+            retVal = self.mBlobMaker.extractFromBinary(mask,self.mColorImg)
         return retVal
 
+    def _updateMask(self):
+        """
+        Threshold the difference, once per frame.
+        """
+        diff = self.mBuffers['diff']
+        mask = self._getBuffer('mask', diff.shape[0:2])
+        if( not self.mMaskReady ):
+            self._binarizeDiff(diff, self.mThreshold, mask)
+            self.mMaskReady = True
+        return mask
+
     def __getstate__(self):
         mydict = self.__dict__.copy()
         self.mBlobMaker = None
+        self.mLast = None
+        self.mBuffers = None
         del mydict['mBlobMaker']
+        del mydict['mLast']
+        del mydict['mBuffers']
         return mydict
 
     def __setstate__(self, mydict):
@@ -64,7 +64,7 @@ class MOGSegmentation(SegmentationBase):
             return
 
         self.mColorImg = img
-        self.mDiffImg = Image(self.mBSMOG.apply(img.getNumpyCv2(), None, self.learningRate), cv2image=True) 
+        self.mDiffImg = Image(self.mBSMOG.apply(img.getNumpyCv2(), None, self.learningRate), cv2image=True, copy=False)
         self.mReady = True
         return
 
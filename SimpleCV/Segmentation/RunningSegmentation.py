@@ -1,4 +1,5 @@
 from SimpleCV.base import *
+import cv2
 from SimpleCV.Features import Feature, FeatureSet, BlobMaker
 from SimpleCV.ImageClass import Image
 from SimpleCV.Segmentation.SegmentationBase import SegmentationBase
@@ -14,12 +15,12 @@ class RunningSegmentation(SegmentationBase):
     mError = False
     mAlpha = 0.1
     mThresh = 10
-    mModelImg = None
-    mDiffImg = None
-    mCurrImg = None
+    mModel = None
+    mColorImg = None
     mBlobMaker = None
     mGrayOnly = True
     mReady = False
+    mMaskReady = False
 
     def __init__(self, alpha=0.7, thresh=(20,20,20)):
         """
@@ -28,13 +29,17 @@ class RunningSegmentation(SegmentationBase):
         accumulator = ((1-alpha)input_image)+((alpha)accumulator)
 
         threshold - the foreground background difference threshold.
+
+        The model, the difference and the mask live in work buffers that are
+        allocated once and reused for every frame.
         """
         self.mError = False
         self.mReady = False
+        self.mMaskReady = False
         self.mAlpha = alpha
         self.mThresh = thresh
-        self.mModelImg = None
-        self.mDiffImg = None
+        self.mModel = None
+        self.mBuffers = None
         self.mColorImg = None
         self.mBlobMaker = BlobMaker()
 
@@ -46,15 +51,21 @@ class RunningSegmentation(SegmentationBase):
             return
 
         self.mColorImg = img
-        if( self.mModelImg == None ):
-            self.mModelImg = Image(cv.CreateImage((img.width,img.height), cv.IPL_DEPTH_32F, 3))
-            self.mDiffImg = Image(cv.CreateImage((img.width,img.height), cv.IPL_DEPTH_32F, 3))
+        frame = img.getNumpyCv2()
+        if( self.mModel is None or self.mModel.shape != frame.shape ):
+            #start the model off from the first frame
+            self.mModel = self._getBuffer('model', frame.shape, np.float32)
+            self.mModel[...] = frame
+            self.mReady = False
         else:
+            current = self._getBuffer('frame', frame.shape, np.float32)
+            current[...] = frame #the only conversion to float for this frame
             # do the difference
-            cv.AbsDiff(self.mModelImg.getBitmap(),img.getFPMatrix(),self.mDiffImg.getBitmap())
+            cv2.absdiff(self.mModel, current, self._getBuffer('diff', frame.shape, np.float32))
             #update the model
-            cv.RunningAvg(img.getFPMatrix(),self.mModelImg.getBitmap(),self.mAlpha)
+            cv2.accumulateWeighted(current, self.mModel, self.mAlpha)
             self.mReady = True
+        self.mMaskReady = False
         return
 
 
@@ -84,59 +95,66 @@ class RunningSegmentation(SegmentationBase):
         """
         Perform a reset of the segmentation systems underlying data.
         """
-        self.mModelImg = None
-        self.mDiffImg = None
+        self.mModel = None
+        self.mBuffers = None
+        self.mReady = False
+        self.mMaskReady = False
 
     def getRawImage(self):
         """
         Return the segmented image with white representing the foreground
         and black the background.
         """
-        return self._floatToInt(self.mDiffImg)
+        if( not self.mReady ):
+            return None
+        self._updateMask()
+        return Image(self.mBuffers['diff8'], cv2image=True)
 
     def getSegmentedImage(self, whiteFG=True):
         """
         Return the segmented image with white representing the foreground
         and black the background.
         """
-        retVal = None
-        img = self._floatToInt(self.mDiffImg)
+        if( not self.mReady ):
+            return None
+        mask = self._updateMask()
         if( whiteFG ):
-            retVal = img.binarize(thresh=self.mThresh)
-        else:
-            retVal = img.binarize(thresh=self.mThresh).invert()
-        return retVal
+            return Image(mask, cv2image=True)
+        return Image(cv2.bitwise_not(mask), cv2image=True, copy=False)
 
     def getSegmentedBlobs(self):
         """
         return the segmented blobs from the fg/bg image
         """
         retVal = []
-        if( self.mColorImg is not None and self.mDiffImg is not None ):
-
-            eightBit = self._floatToInt(self.mDiffImg)
-            retVal = self.mBlobMaker.extractFromBinary(eightBit.binarize(thresh=self.mThresh),self.mColorImg)
+        if( self.mColorImg is not None and self.mReady ):
+            #the blob maker doesn't hold on to the mask, so lend it ours
+            mask = Image(self._updateMask(), cv2image=True, copy=False)
+            retVal = self.mBlobMaker.extractFromBinary(mask,self.mColorImg)
 
         return retVal
 
-
-    def _floatToInt(self,input):
+    def _updateMask(self):
         """
-        convert a 32bit floating point cv array to an int array
+        Convert the difference to 8 bits and threshold it, once per frame.
         """
-        temp = cv.CreateImage((input.width,input.height), cv.IPL_DEPTH_8U, 3)
-        cv.Convert(input.getBitmap(),temp)
-
-        return Image(temp)
+        diff8 = self._getBuffer('diff8', self.mModel.shape)
+        mask = self._getBuffer('mask', self.mModel.shape[0:2])
+        if( not self.mMaskReady ):
+            cv2.convertScaleAbs(self.mBuffers['diff'], diff8)
+            self._binarizeDiff(diff8, self.mThresh, mask)
+            self.mMaskReady = True
+        return mask
 
     def __getstate__(self):
         mydict = self.__dict__.copy()
         self.mBlobMaker = None
-        self.mModelImg = None
-        self.mDiffImg = None
+        self.mModel = None
+        self.mBuffers = None
+        self.mReady = False
         del mydict['mBlobMaker']
-        del mydict['mModelImg']
-        del mydict['mDiffImg']
+        del mydict['mModel']
+        del mydict['mBuffers']
         return mydict
 
     def __setstate__(self, mydict):
@@ -1,4 +1,5 @@
 from SimpleCV.base import *
+import cv2
 from SimpleCV.Features import Feature, FeatureSet
 from SimpleCV.Color import Color
 from SimpleCV.ImageClass import Image
@@ -15,6 +16,8 @@ class SegmentationBase(object):
 
     __metaclass__ = abc.ABCMeta
 
+    mBuffers = None #reusable work arrays, see _getBuffer
+
     def load(cls, fname):
         """
         load segmentation settings to file.
@@ -86,3 +89,54 @@ class SegmentationBase(object):
         """
         return the segmented blobs from the fg/bg image
         """
+
+    def addImageAndGetBlobs(self, img):
+        """
+        Add a single image to the segmentation algorithm and return the
+        segmented blobs for it, or an empty list if the segmentation isn't
+        ready yet. This is the same as calling addImage, isReady and
+        getSegmentedBlobs, but lets the segmentation do all of the work in
+        one pass over its buffers.
+        """
+        self.addImage(img)
+        if( not self.isReady() ):
+            return []
+        return self.getSegmentedBlobs()
+
+    def _getBuffer(self, name, shape, dtype=np.uint8):
+        """
+        Return the work buffer called name, allocating it the first time and
+        again only when the frame size changes. Work buffers are never pickled.
+        """
+        if( self.mBuffers is None ):
+            self.mBuffers = {}
+        buf = self.mBuffers.get(name)
+        if( buf is None or buf.shape != shape or buf.dtype != dtype ):
+            buf = np.empty(shape, dtype=dtype)
+            self.mBuffers[name] = buf
+        return buf
+
+    def _binarizeDiff(self, diff, thresh, mask):
+        """
+        Threshold a uint8 difference array (rows x cols or rows x cols x BGR)
+        into mask the way Image.binarize does: pixels at or below the threshold
+        come out white. A tuple threshold is (r,g,b) and a pixel is white if any
+        of its channels is at or below its threshold, a single value thresholds
+        the gray version of the difference.
+        """
+        if( is_tuple(thresh) and len(diff.shape) == 3 ):
+            below = self._getBuffer('below', diff.shape, bool)
+            anyBelow = self._getBuffer('anyBelow', diff.shape[0:2], bool)
+            np.less_equal(diff, np.array(thresh[::-1]), out=below)
+            np.any(below, axis=2, out=anyBelow)
+            np.multiply(anyBelow, 255, out=mask, casting='unsafe')
+            return mask
+
+        if( is_tuple(thresh) ):
+            thresh = max(thresh)
+        elif( len(diff.shape) == 3 ):
+            gray = self._getBuffer('gray', diff.shape[0:2])
+            cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY, gray)
+            diff = gray
+        cv2.threshold(diff, thresh, 255, cv2.THRESH_BINARY_INV, mask)
+        return mask
@@ -1,4 +1,6 @@
 from SimpleCV.base import *
+import cv2
+import Queue
 
 
 _jpegstreamers = {}
@@ -7,6 +9,11 @@ class JpegStreamHandler(SimpleHTTPRequestHandler):
     The JpegStreamHandler handles requests to the threaded HTTP server.
     Once initialized, any request to this port will receive a multipart/replace
     jpeg.
+
+    Frames are encoded once by the JpegStreamer and every client just writes
+    out the newest one. A client that falls behind skips frames, and if the
+    streamer has a quality ladder it is moved down to a smaller rung until it
+    keeps up again. /stream/1, /stream/2, ... start a client lower on the ladder.
     """
 
 
@@ -35,7 +42,13 @@ class JpegStreamHandler(SimpleHTTPRequestHandler):
             return
 
 
-        elif (self.path == "/stream"):
+        elif (self.path == "/stream" or self.path.startswith("/stream/")):
+            (host, port) = self.server.socket.getsockname()[:2]
+            streamer = _jpegstreamers[port]
+            toprung = 0
+            if self.path.startswith("/stream/") and self.path[8:].isdigit():
+                toprung = min(int(self.path[8:]), len(streamer.ladder) - 1)
+
             self.send_response(200)
             self.send_header("Connection", "close")
             self.send_header("Max-Age", "0")
@@ -44,29 +57,37 @@ class JpegStreamHandler(SimpleHTTPRequestHandler):
             self.send_header("Pragma", "no-cache")
             self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=--BOUNDARYSTRING")
             self.end_headers()
-            (host, port) = self.server.socket.getsockname()[:2]
 
 
-            count = 0
-            timeout = 0.75
-            lasttimeserved = 0
+            rung = toprung
+            sequence = 0
+            steady = 0
             while (1):
-                if (_jpegstreamers[port].refreshtime > lasttimeserved or time.time() - timeout > lasttimeserved):
-                    try:
-                        self.wfile.write("--BOUNDARYSTRING\r\n")
-                        self.send_header("Content-type", "image/jpeg")
-                        self.send_header("Content-Length", str(len(_jpegstreamers[port].jpgdata.getvalue())))
-                        self.end_headers()
-                        self.wfile.write(_jpegstreamers[port].jpgdata.getvalue() + "\r\n")
-                        lasttimeserved = time.time()
-                    except socket.error, e:
-                        return
-                    except IOError, e:
-                        return
-                    count = count + 1
-
-
-                time.sleep(_jpegstreamers[port].sleeptime)
+                (frame, sequence) = streamer.getFrame(sequence, rung)
+                if frame is None:
+                    continue
+                sent = time.time()
+                try:
+                    self.wfile.write(frame)
+                except socket.error, e:
+                    return
+                except IOError, e:
+                    return
+
+                #frames published while we were writing this one were skipped
+                backlog = streamer.sequence - sequence
+                if (backlog > streamer.maxbacklog and rung < len(streamer.ladder) - 1):
+                    rung = rung + 1
+                    steady = 0
+                elif (backlog == 0 and rung > toprung):
+                    steady = steady + 1
+                    if (steady > streamer.recoverframes):
+                        rung = rung - 1
+                        steady = 0
+
+                wait = streamer.sleeptime - (time.time() - sent)
+                if (wait > 0):
+                    time.sleep(wait)
 
 
 
@@ -97,9 +118,18 @@ class JpegStreamer():
     webbrowser.open(js.url)
 
 
-    Note 3 optional parameters on the constructor:
+    Note the optional parameters on the constructor:
     - port (default 8080) which sets the TCP port you need to connect to
-    - sleep time (default 0.1) how often to update.  Above 1 second seems to cause dropped connections in Google chrome
+    - sleep time (default 0.1) the shortest time between two frames sent to a client.  Above 1 second seems to cause dropped connections in Google chrome
+    - quality (default 75) the JPEG quality, img.save(js, quality=90) overrides it for one frame
+    - ladder (default None) a list of (quality, scale) rungs, e.g. [(75, 1.0), (50, 0.5), (30, 0.25)].
+      Clients that fall more than maxbacklog frames behind move down a rung,
+      and move back up after keeping up for recoverframes frames.
+    - maxbacklog (default 2) how many frames a client may skip at once before it is moved down the ladder
+
+
+    Each frame is encoded once per rung that has viewers, no matter how many
+    clients are connected, and clients are woken up when a new frame arrives.
 
 
     Once initialized, the buffer and sleeptime can be modified and will function properly -- port will not.
@@ -111,9 +141,15 @@ class JpegStreamer():
     framebuffer = ""
     counter = 0
     refreshtime = 0
+    jpgdata = ""
+    sequence = 0
+    ladder = None
+    maxbacklog = 2
+    recoverframes = 30
+    timeout = 0.75 #resend the current frame this often, browsers drop idle streams
 
 
-    def __init__(self, hostandport = 8080, st=0.1 ):
+    def __init__(self, hostandport = 8080, st=0.1, quality=75, ladder=None, maxbacklog=2):
         global _jpegstreamers
         if (type(hostandport) == int):
             self.port = hostandport
@@ -126,6 +162,14 @@ class JpegStreamer():
 
 
         self.sleeptime = st
+        if ladder:
+            self.ladder = list(ladder)
+        else:
+            self.ladder = [(quality, 1.0)]
+        self.maxbacklog = maxbacklog
+        self.condition = threading.Condition()
+        self._bitmap = None
+        self._frames = {}
         self.server = JpegTCPServer((self.host, self.port), JpegStreamHandler)
         self.server_thread = threading.Thread(target = self.server.serve_forever)
         _jpegstreamers[self.port] = self
@@ -148,7 +192,77 @@ class JpegStreamer():
         return self.url() + "stream"
 
 
-
+    def writeFrame(self, img, **params):
+        """
+        Publish a new frame to every client. This is called by img.save(js).
+        The frame is encoded here, once, for the top rung of the ladder; the
+        smaller rungs are only encoded if a client asks for them.
+        """
+        bitmap = img.getNumpyCv2()
+        quality = params.get("quality", self.ladder[0][0])
+        frame = self._encode(bitmap, quality, self.ladder[0][1])
+        if len(self.ladder) > 1:
+            bitmap = bitmap.copy() #the image may change before the other rungs are encoded
+        with self.condition:
+            self._bitmap = bitmap
+            self._frames = {0: frame}
+            self.jpgdata = StringIO(frame[frame.index("\r\n\r\n") + 4:-2])
+            self.sequence = self.sequence + 1
+            self.refreshtime = time.time()
+            self.condition.notifyAll()
+
+
+    def getFrame(self, sequence=0, rung=0):
+        """
+        Wait for a frame newer than sequence, or at most timeout seconds, and
+        return (frame, sequence) where frame is the newest frame, ready to be
+        written to a multipart stream, or None if nothing was published yet.
+        """
+        with self.condition:
+            if (self.sequence <= sequence):
+                self.condition.wait(self.timeout)
+            if (self._bitmap is None):
+                return (None, 0)
+            frame = self._frames.get(rung)
+            bitmap = self._bitmap
+            current = self.sequence
+        if frame is None:
+            #encode without the lock so writeFrame and the other clients don't wait on it
+            (quality, scale) = self.ladder[rung]
+            frame = self._encode(bitmap, quality, scale)
+            with self.condition:
+                if (self.sequence == current):
+                    frame = self._frames.setdefault(rung, frame)
+        return (frame, current)
+
+
+    def _encode(self, bitmap, quality, scale):
+        """
+        JPEG encode a BGR array and wrap it in its multipart headers.
+        """
+        if (scale != 1.0):
+            size = (max(1, int(bitmap.shape[1] * scale)), max(1, int(bitmap.shape[0] * scale)))
+            bitmap = cv2.resize(bitmap, size, interpolation=cv2.INTER_AREA)
+        (ok, jpeg) = cv2.imencode(".jpg", bitmap, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        jpeg = jpeg.tostring()
+        return ("--BOUNDARYSTRING\r\nContent-type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg)) + jpeg + "\r\n"
+
+
+
+
+#the codec each container gets unless a fourcc is given
+_videocodecs = {
+    "avi": "XVID",
+    "mp4": "mp4v",
+    "m4v": "mp4v",
+    "mov": "mp4v",
+    "mkv": "XVID",
+    "mpg": "PIM1",
+    "mpeg": "PIM1",
+    "wmv": "WMV2",
+    "flv": "FLV1",
+    "mjpg": "MJPG",
+}
 
 class VideoStream():
     """
@@ -161,6 +275,13 @@ class VideoStream():
         vs = VideoStream("hello.avi")
 
 
+    The codec is picked from the file extension (XVID for .avi and .mkv, MPEG-4
+    for .mp4 and .mov, MPEG-1 for .mpg, ...), or you can give the fourcc yourself::
+
+
+        vs = VideoStream("raw.avi", fourcc="IYUV")
+
+
     You can also specify a framerate, and if you want to "fill" in missed frames.
     So if you want to record a realtime video you may want to do this::
 
@@ -182,6 +303,32 @@ class VideoStream():
 
 
         my_camera.getImage().save(vs)
+
+
+    By default frames are encoded right away, on the thread that saves them.
+    With a queuesize the frames are put on a queue of that many frames and
+    encoded by a background thread, so recording doesn't slow down the
+    capture loop. If the encoder falls behind and the queue is full, new frames
+    are dropped (and counted) rather than making the caller wait. Each frame is
+    written once, and its timestamp is written to a timecode file next to the
+    video (name.ext.timecodes.txt, mkvmerge's "timecode format v2") instead of
+    duplicating frames to keep the video in real time::
+
+
+        vs = VideoStream("run.mp4", queuesize=60)
+        while recording:
+            img = cam.getImage()
+            vs.writeFrame(img, timestamp=time.time())
+        print vs.getStats()
+        vs.close() #wait for the queued frames to be written
+
+
+    The recording can be split into segments of segmentlength seconds and/or
+    segmentsize bytes, named name_0000.ext, name_0001.ext, ... For a rolling
+    archive set keepsegments and only that many of the newest segments are kept::
+
+
+        vs = VideoStream("archive.avi", queuesize=60, segmentlength=600, keepsegments=6)
     """
 
 
@@ -193,38 +340,95 @@ class VideoStream():
     videotime = 0.0
     starttime = 0.0
     framecount = 0
-
-
-    def __init__(self, filename, fps = 25, framefill = True):
-        (revextension, revname) = filename[::-1].split(".")
-        extension = revextension[::-1]
+    queuesize = 0
+    segmentlength = None
+    segmentsize = None
+    keepsegments = None
+    segments = []
+    written = 0
+    dropped = 0
+    failed = 0
+    maxdepth = 0
+    closed = False
+
+
+    def __init__(self, filename, fps = 25, framefill = True, queuesize = 0, fourcc = None,
+                 segmentlength = None, segmentsize = None, keepsegments = None):
+        (name, extension) = os.path.splitext(filename)
+        extension = extension[1:].lower()
         self.filename = filename
         self.fps = fps
         self.framefill = framefill
-        #if extension == "mpg":
-        self.fourcc = cv.CV_FOURCC('I', 'Y', 'U', 'V')
-            #self.fourcc = 0
-        #else:
-        #  logger.warning(extension + " is not supported for video writing on this platform, sorry");
-        #  return False
-
-
-    def initializeWriter(self, size):
-        self.writer = cv.CreateVideoWriter(self.filename, self.fourcc, self.fps, size, 1)
+        if fourcc is None:
+            if extension in _videocodecs:
+                fourcc = _videocodecs[extension]
+            else:
+                logger.warning("VideoStream: no codec known for ." + extension + " files, writing uncompressed IYUV")
+                fourcc = "IYUV"
+        self.fourcc = cv.CV_FOURCC(*fourcc)
+        self.queuesize = queuesize
+        self.segmentlength = segmentlength
+        self.segmentsize = segmentsize
+        self.keepsegments = keepsegments
+        self.segments = []
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.maxdepth = 0
+        self.closed = False
+        self._size = None
+        self._segmentstart = None
+        self._segmentcount = 0
+        self._timecodes = None
+        self._queue = None
+        self._thread = None
+        if queuesize:
+            self._queue = Queue.Queue(queuesize)
+            self._thread = threading.Thread(target = self._encode)
+            self._thread.daemon = True
+            self._thread.start()
+
+
+    def initializeWriter(self, size, timestamp = None):
+        if timestamp is None:
+            timestamp = time.time()
+        self._size = size
+        self._openSegment(timestamp)
         self.videotime = 0.0
         self.starttime = time.time()
 
 
-    def writeFrame(self, img):
+    def writeFrame(self, img, timestamp = None):
         """
         This writes a frame to the display object
         this is automatically called by image.save() but you can
         use this function to save just the bitmap as well so
         image markup is not implicit,typically you use image.save() but
         this allows for more finer control
+
+        timestamp is the time the frame was captured, time.time() if None.
+        With a queuesize the frame is copied onto the queue and this returns
+        right away; False is returned if the queue was full and the frame
+        was dropped. Writing to a closed stream does nothing and returns False.
         """
+        if self.closed:
+            logger.warning("VideoStream: " + self.filename + " is closed, the frame was not written")
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+
+        if self._queue is not None:
+            #the image can change after this returns, so queue a copy
+            try:
+                self._queue.put_nowait((img.getNumpyCv2().copy(), timestamp))
+            except Queue.Full:
+                self.dropped += 1
+                return False
+            self.maxdepth = max(self.maxdepth, self._queue.qsize())
+            return True
+
         if not self.writer:
-            self.initializeWriter(img.size())
+            self.initializeWriter(img.size(), timestamp)
             self.lastframe = img
 
 
@@ -249,20 +453,120 @@ class VideoStream():
                 lastframes = framesbehind / 2
                 for i in range(0, lastframes):
                     self.framecount += 1
-                    cv.WriteFrame(self.writer, self.lastframe.getBitmap())
+                    self._write(self.lastframe.getNumpyCv2(), timestamp)
 
 
                 theseframes = framesbehind - lastframes
                 for i in range(0, theseframes):
                     self.framecount += 1
-                    cv.WriteFrame(self.writer, img.getBitmap())
+                    self._write(img.getNumpyCv2(), timestamp)
                 #split missing frames evenly between the prior and current frame
             else: #we are on track
                 self.framecount += 1
-                cv.WriteFrame(self.writer, img.getBitmap())
+                self._write(img.getNumpyCv2(), timestamp)
         else:
-            cv.WriteFrame(self.writer, img.getBitmap())
+            self._write(img.getNumpyCv2(), timestamp)
             self.framecount += 1
 
 
         self.lastframe = img
+        return True
+
+
+    def getStats(self):
+        """
+        Returns a dictionary with the number of frames waiting on the queue
+        (queued) and the most there have been (maxqueued), the number of frames
+        written, dropped because the queue was full, and that failed to encode,
+        and the list of segment files written so far.
+        """
+        queued = 0
+        if self._queue is not None:
+            queued = self._queue.qsize()
+        return {"queued": queued,
+                "maxqueued": self.maxdepth,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "segments": list(self.segments)}
+
+
+    def close(self):
+        """
+        Finish the video. With a queuesize this waits until every queued frame
+        has been written. Nothing can be written to the stream afterwards.
+        """
+        self.closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._closeSegment()
+
+
+    def _encode(self):
+        """
+        The encoder thread, it writes out the queued frames until close.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            (bitmap, timestamp) = item
+            if not self.writer:
+                self._size = (bitmap.shape[1], bitmap.shape[0])
+                self._openSegment(timestamp)
+            try:
+                self._write(bitmap, timestamp)
+            except Exception, e:
+                self.failed += 1 #only counted on this thread
+                logger.warning("VideoStream: could not write a frame, " + str(e))
+
+
+    def _write(self, bitmap, timestamp):
+        """
+        Write one BGR frame, starting a new segment first if the current one
+        is long or big enough.
+        """
+        if ((self.segmentlength is not None and timestamp - self._segmentstart >= self.segmentlength) or
+            (self.segmentsize is not None and os.path.exists(self.segments[-1]) and
+             os.path.getsize(self.segments[-1]) >= self.segmentsize)):
+            self._closeSegment()
+            self._openSegment(timestamp)
+        if (bitmap.shape[1], bitmap.shape[0]) != self._size:
+            bitmap = cv2.resize(bitmap, self._size)
+        self.writer.write(bitmap)
+        self.written += 1
+        if self._timecodes is not None:
+            self._timecodes.write("%.3f\n" % ((timestamp - self._segmentstart) * 1000.0))
+
+
+    def _openSegment(self, timestamp):
+        filename = self.filename
+        if self.segmentlength is not None or self.segmentsize is not None:
+            (name, extension) = os.path.splitext(self.filename)
+            filename = "%s_%04d%s" % (name, self._segmentcount, extension)
+        self._segmentcount += 1
+        self.writer = cv2.VideoWriter(filename, self.fourcc, self.fps, self._size, True)
+        if not self.writer.isOpened():
+            logger.warning("VideoStream: could not open " + filename + " for writing")
+        self.segments.append(filename)
+        self._segmentstart = timestamp
+        if self._queue is not None:
+            self._timecodes = open(filename + ".timecodes.txt", "w")
+            self._timecodes.write("# timecode format v2\n")
+        if self.keepsegments is not None:
+            while len(self.segments) > max(self.keepsegments, 1):
+                old = self.segments.pop(0)
+                for fname in (old, old + ".timecodes.txt"):
+                    if os.path.exists(fname):
+                        os.remove(fname)
+
+
+    def _closeSegment(self):
+        if self.writer:
+            self.writer.release()
+            self.writer = ""
+        if self._timecodes is not None:
+            self._timecodes.close()
+            self._timecodes = None
@@ -0,0 +1,292 @@
+from SimpleCV.base import np, time, spsd, logger
+from SimpleCV.Color import Color
+from collections import deque, namedtuple
+try:
+    import cv2
+except ImportError:
+    pass
+
+# One entry of a target's history. image is only set when the manager keeps frames.
+TrackRecord = namedtuple('TrackRecord', 'bb center velocity timestamp image')
+
+class TrackManager(object):
+    """
+    **SUMMARY**
+
+    TrackManager follows any number of targets through a video with
+    forward-backward Lucas Kanade optical flow (like the median flow tracker).
+
+    The work that does not depend on the target is done once per frame: one
+    gray conversion, one image pyramid that is kept for the next frame, one
+    optical flow call for the points of every target and one corner search
+    to refresh the points.
+
+    Each target's history is a fixed size deque of TrackRecords, which hold
+    the bounding box, center, velocity and timestamp but no reference to the
+    frame unless keepFrames is set. Unlike a TrackSet, the memory used stays
+    the same no matter how long the video runs.
+
+    **PARAMETERS**
+
+    * *history* - The number of records kept per target.
+    * *keepFrames* - Keep a reference to each frame in the records.
+    * *maxPoints* - The most points followed per target.
+    * *minPoints* - A target with fewer good points than this is not moved.
+    * *winSize* - The optical flow search window size.
+    * *maxLevel* - The number of pyramid levels above the full size image.
+    * *fbThreshold* - Points whose forward-backward error is larger than this
+      many pixels are dropped.
+
+    **EXAMPLE**
+
+    >>> cam = Camera()
+    >>> img = cam.getImage()
+    >>> tm = TrackManager(history=100)
+    >>> car = tm.addTarget(img, (100, 100, 50, 40))
+    >>> bike = tm.addTarget(img, (300, 120, 30, 60))
+    >>> while True:
+    >>>     img = cam.getImage()
+    >>>     tm.update(img)
+    >>>     tm.drawBB(img)
+    >>>     img.show()
+    >>> print tm.getHistory(car)[-1].velocity
+
+    """
+    mHistory = 300
+    mKeepFrames = False
+    mMaxPoints = 50
+    mMinPoints = 4
+    mWinSize = (10,10)
+    mMaxLevel = 3
+    mFBThreshold = 1.0
+
+    def __init__(self, history=300, keepFrames=False, maxPoints=50, minPoints=4,
+                 winSize=(10,10), maxLevel=3, fbThreshold=1.0):
+        self.mHistory = history
+        self.mKeepFrames = keepFrames
+        self.mMaxPoints = maxPoints
+        self.mMinPoints = minPoints
+        self.mWinSize = tuple(winSize)
+        self.mMaxLevel = maxLevel
+        self.mFBThreshold = fbThreshold
+        self._nextID = 0
+        self._boxes = {}    # target id -> (x,y,w,h) as floats
+        self._points = {}   # target id -> N x 2 float32 points on the last frame
+        self._records = {}  # target id -> deque of TrackRecords
+        self._prevPyramid = None
+        self._prevLevels = 0
+        self._prevSize = None
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def getTargets(self):
+        """
+        The ids of the targets being tracked.
+        """
+        return sorted(self._boxes.keys())
+
+    def getHistory(self, tid):
+        """
+        **SUMMARY**
+
+        The TrackRecords of a target, oldest first. At most history of them
+        are kept.
+
+        """
+        return self._records[tid]
+
+    def getBB(self, tid):
+        """
+        The latest bounding box of a target as an (x,y,w,h) tuple.
+        """
+        return self._records[tid][-1].bb
+
+    def addTarget(self, img, bb, timestamp=None):
+        """
+        **SUMMARY**
+
+        Start tracking a target. img must be the frame the bounding box was
+        found on, which is either the first frame or the last frame given to
+        update.
+
+        **PARAMETERS**
+
+        * *img* - The Image the target is on.
+        * *bb* - The target bounding box (x,y,w,h).
+        * *timestamp* - The time of the frame, time.time() if None.
+
+        **RETURNS**
+
+        The id of the new target.
+
+        """
+        gray = img.getGrayNumpyCv2()
+        if( self._prevPyramid is None or self._prevSize != gray.shape ):
+            self._setFrame(gray)
+        tid = self._nextID
+        self._nextID += 1
+        self._boxes[tid] = self._clip(map(float,bb), gray.shape)
+        self._records[tid] = deque(maxlen=self.mHistory)
+        self._seed(gray, [tid])
+        self._record(tid, img, (0.0,0.0), timestamp)
+        return tid
+
+    def removeTarget(self, tid):
+        """
+        Stop tracking a target and forget its history.
+        """
+        for d in (self._boxes, self._points, self._records):
+            d.pop(tid, None)
+
+    def update(self, img, timestamp=None):
+        """
+        **SUMMARY**
+
+        Follow every target onto the next frame.
+
+        **PARAMETERS**
+
+        * *img* - The next Image of the video.
+        * *timestamp* - The time of the frame, time.time() if None.
+
+        **RETURNS**
+
+        A dictionary of target id to the target's new TrackRecord.
+
+        """
+        if( timestamp is None ):
+            timestamp = time.time()
+        gray = img.getGrayNumpyCv2()
+        if( self._prevPyramid is None or self._prevSize != gray.shape ):
+            if( self._prevPyramid is not None ):
+                logger.warning("TrackManager.update: the frame size changed, restarting the point tracks")
+            self._setFrame(gray)
+            self._seed(gray, self.getTargets())
+            return dict((tid, self._record(tid, img, (0.0,0.0), timestamp)) for tid in self.getTargets())
+
+        prevPyramid, prevLevels = self._prevPyramid, self._prevLevels
+        self._setFrame(gray)
+        levels = min(prevLevels, self._prevLevels)
+
+        # follow the points of every target with one pair of optical flow calls
+        tids = [tid for tid in self.getTargets() if len(self._points[tid])]
+        moved = {}
+        if( tids ):
+            p0 = np.concatenate([self._points[tid] for tid in tids]).reshape(-1,1,2)
+            owners = np.concatenate([np.repeat(i, len(self._points[tid])) for i, tid in enumerate(tids)])
+            criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+            p1, st1, err = cv2.calcOpticalFlowPyrLK(prevPyramid, self._prevPyramid, p0, None,
+                                                    winSize=self.mWinSize, maxLevel=levels, criteria=criteria)
+            p0r, st0, err = cv2.calcOpticalFlowPyrLK(self._prevPyramid, prevPyramid, p1, None,
+                                                     winSize=self.mWinSize, maxLevel=levels, criteria=criteria)
+            fb = np.abs(p0-p0r).reshape(-1,2).max(axis=1)
+            good = (st1.ravel() == 1) & (st0.ravel() == 1) & (fb < self.mFBThreshold)
+            p0 = p0.reshape(-1,2)
+            p1 = p1.reshape(-1,2)
+            for i, tid in enumerate(tids):
+                mine = good & (owners == i)
+                if( mine.sum() >= self.mMinPoints ):
+                    moved[tid] = self._move(tid, p0[mine], p1[mine], gray.shape)
+
+        # one corner search refreshes the points of every target
+        self._seed(gray, self.getTargets())
+        retVal = {}
+        for tid in self.getTargets():
+            retVal[tid] = self._record(tid, img, moved.get(tid, (0.0,0.0)), timestamp)
+        return retVal
+
+    def drawBB(self, img, color=Color.GREEN, thickness=2):
+        """
+        Draw the latest bounding box of every target on an image.
+        """
+        for tid in self.getTargets():
+            x, y, w, h = self.getBB(tid)
+            img.drawRectangle(x, y, w, h, color=color, width=thickness)
+
+    def drawPath(self, img, color=Color.GREEN, thickness=2):
+        """
+        Draw the path of the center of every target, as far back as its
+        history goes.
+        """
+        for tid in self.getTargets():
+            centers = [r.center for r in self._records[tid]]
+            for a, b in zip(centers[:-1], centers[1:]):
+                img.drawLine(a, b, color=color, thickness=thickness)
+
+    def _setFrame(self, gray):
+        """
+        Make gray the previous frame, building its pyramid once.
+        """
+        self._prevSize = gray.shape
+        if( hasattr(cv2, "buildOpticalFlowPyramid") ):
+            self._prevLevels, self._prevPyramid = cv2.buildOpticalFlowPyramid(gray, self.mWinSize, self.mMaxLevel)
+        else: # older OpenCV builds the pyramid inside calcOpticalFlowPyrLK
+            self._prevLevels, self._prevPyramid = self.mMaxLevel, gray
+
+    def _move(self, tid, p0, p1, shape):
+        """
+        Move and scale a target's box by the median flow of its good points.
+        Returns the (dx,dy) the center moved.
+        """
+        x, y, w, h = self._boxes[tid]
+        d = np.median(p1-p0, axis=0)
+        scale = 1.0
+        if( len(p0) > 1 ):
+            before = spsd.pdist(p0)
+            after = spsd.pdist(p1)
+            ok = before > 0
+            if( ok.any() ):
+                scale = float(np.median(after[ok]/before[ok]))
+        nw = w*scale
+        nh = h*scale
+        nx = x + d[0] - (nw-w)/2.0
+        ny = y + d[1] - (nh-h)/2.0
+        self._boxes[tid] = self._clip((nx,ny,nw,nh), shape)
+        return (float(d[0]), float(d[1]))
+
+    def _clip(self, bb, shape):
+        x, y, w, h = bb
+        w = min(max(w,1.0), shape[1])
+        h = min(max(h,1.0), shape[0])
+        x = min(max(x,0.0), shape[1]-w)
+        y = min(max(y,0.0), shape[0]-h)
+        return (x, y, w, h)
+
+    def _seed(self, gray, tids):
+        """
+        Pick the points to follow inside each target box, with one corner
+        search over all of the boxes. Boxes without enough corners get a
+        regular grid of points instead.
+        """
+        if( not tids ):
+            return
+        mask = np.zeros(gray.shape, dtype=np.uint8)
+        for tid in tids:
+            x, y, w, h = [int(v) for v in self._boxes[tid]]
+            mask[y:y+h, x:x+w] = 255
+        corners = cv2.goodFeaturesToTrack(gray, 0, 0.01, 3, mask=mask, blockSize=3)
+        if( corners is None ):
+            corners = np.zeros((0,2), dtype=np.float32)
+        corners = corners.reshape(-1,2)
+        for tid in tids:
+            x, y, w, h = self._boxes[tid]
+            inside = ((corners[:,0] >= x) & (corners[:,0] < x+w) &
+                      (corners[:,1] >= y) & (corners[:,1] < y+h))
+            pts = corners[inside][:self.mMaxPoints]
+            if( len(pts) < self.mMinPoints ):
+                n = max(int(np.sqrt(self.mMaxPoints)), 2)
+                gx, gy = np.meshgrid(np.linspace(x, x+w-1, n), np.linspace(y, y+h-1, n))
+                pts = np.column_stack((gx.ravel(), gy.ravel()))
+            self._points[tid] = np.ascontiguousarray(pts, dtype=np.float32)
+
+    def _record(self, tid, img, velocity, timestamp):
+        if( timestamp is None ):
+            timestamp = time.time()
+        x, y, w, h = self._boxes[tid]
+        frame = None
+        if( self.mKeepFrames ):
+            frame = img
+        record = TrackRecord((x, y, w, h), (x+w/2.0, y+h/2.0), velocity, timestamp, frame)
+        self._records[tid].append(record)
+        return record
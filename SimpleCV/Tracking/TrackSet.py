@@ -90,9 +90,7 @@ class TrackSet(FeatureSet):
                 ... ts.trimList(10)
             ... img = img1
         """
-        ts = self
-        for i in range(num):
-            ts.pop(0)
+        del self[:num]
 
     def areaRatio(self):
         """
@@ -3,4 +3,5 @@ from SimpleCV.Tracking.CAMShiftTracker import camshiftTracker
 from SimpleCV.Tracking.LKTracker import lkTracker
 from SimpleCV.Tracking.SURFTracker import surfTracker
 from SimpleCV.Tracking.MFTracker import mfTracker
-from SimpleCV.Tracking.TrackSet import TrackSet
\ No newline at end of file
+from SimpleCV.Tracking.TrackSet import TrackSet
+from SimpleCV.Tracking.TrackManager import TrackManager, TrackRecord
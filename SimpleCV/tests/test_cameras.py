@@ -41,3 +41,20 @@ def test_camera_multiple_instances():
     if not cam3 or not img3:
         assert False
     pass
+
+def test_camera_frame_sequence():
+    cam = Camera(0)
+    img1 = cam.getImage()
+    seq1 = cam.sequence
+    img2 = cam.getImage(next=True)
+    seq2 = cam.sequence
+    img3 = cam.getImage(latest=False)
+
+    if not img1 or not img2 or not img3:
+        assert False
+    # frames are never handed out twice
+    if not (seq1 < seq2 < cam.sequence):
+        assert False
+    if cam.droppedFrames < 0:
+        assert False
+    pass
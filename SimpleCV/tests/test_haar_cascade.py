@@ -28,3 +28,17 @@ def test_minneighbors(img_in=testneighbor_in, img_out=testneighbor_out):
         img.save(img_out)
     # if len(faces) > 1
     assert len(faces) <= 1, "Haar Cascade is potentially ignoring the 'HIGH' min_neighbors of 20"
+
+def test_cascade_registry():
+    cascades = HaarCascade.preload([FACECASCADE], count=2)
+    assert len(cascades) == 1
+    path = cascades[0].getFHandle()
+    idle = list(HaarCascade._classifiers[path])
+    assert len(idle) == 2
+
+    img = Image(testimage)
+    faces = img.findHaarFeatures(FACECASCADE)
+    assert faces
+    # the detection borrowed a preloaded classifier and gave it back
+    assert len(HaarCascade._classifiers[path]) == 2
+    assert set(map(id, HaarCascade._classifiers[path])) == set(map(id, idle))
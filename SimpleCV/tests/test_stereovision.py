@@ -186,3 +186,24 @@ def test_getImagesUndistort():
         assert True
     else :
         assert False
+
+def test_stereo_pipeline():
+    img1 = Image(correct_pairs[0][0]).resize(352,288)
+    img2 = Image(correct_pairs[0][1]).resize(352,288)
+    cam = StereoCamera()
+    calib = cam.loadCalibration("Stereo","./StereoVision/")
+    pipeline = cam.getPipeline(calib, method="SGBM")
+    left, right = pipeline.getRectified(img1, img2)
+    rectLeft, rectRight = cam.getImagesUndistort(img1, img2, calib, cam.stereoRectify(calib))
+    diff = np.abs(left.astype(np.float32) - rectLeft.getGrayNumpyCv2())
+    if (np.mean(diff) > 2.0):
+        assert False
+    disparity = pipeline.getDisparity(img1, img2)
+    if (disparity.dtype != np.float32 or disparity.shape != (288, 352)):
+        assert False
+    points = pipeline.getPointCloud(img1, img2)
+    if (points.dtype != np.float32 or points.shape != (288, 352, 3)):
+        assert False
+    # the output buffers are reused from frame to frame
+    if pipeline.getDisparity(img1, img2) is not disparity:
+        assert False
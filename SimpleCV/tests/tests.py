@@ -143,6 +143,45 @@ def test_image_bitmap():
     name_stem = "test_image_bitmap"
     perform_diff(result,name_stem)
 
+def test_image_buffer_views():
+    img = Image(testimage)
+    # every representation shares the one pixel buffer
+    img[1,1] = (10, 20, 30)
+    if (tuple(img.getNumpy()[1,1]) != (10, 20, 30)):
+        assert False
+    if (tuple(img.getNumpyCv2()[1,1]) != (30, 20, 10)):
+        assert False
+    if (img.getBitmap()[1,1] != (30.0, 20.0, 10.0)):
+        assert False
+    # writes through a view invalidate the derived gray buffer
+    gray = img.getGrayNumpy()
+    img[2,2] = (0, 0, 0)
+    if (img.getGrayNumpy()[2,2] != 0 or gray is img.getGrayNumpy()):
+        assert False
+
+def test_image_wrap_array():
+    bgr = np.zeros((20, 30, 3), dtype=np.uint8)
+    img = Image(bgr, cv2image=True, copy=False)
+    if (img.getNumpyCv2() is not bgr or img.size() != (30, 20)):
+        assert False
+    bgr[5, 6] = (1, 2, 3)
+    if (img[6, 5] != (3.0, 2.0, 1.0)):
+        assert False
+    # the default still copies
+    if (Image(bgr, cv2image=True).getNumpyCv2() is bgr):
+        assert False
+    # gray arrays are kept single channel until color is needed
+    gray = np.arange(600, dtype=np.uint8).reshape(20, 30)
+    img = Image(gray, cv2image=True, copy=False)
+    if (img.getGrayNumpyCv2() is not gray or img._buffer is not None):
+        assert False
+    if (tuple(img.getNumpyCv2()[3, 4]) != (gray[3, 4],) * 3):
+        assert False
+    # arrays that need reordering are copied even with copy=False
+    img = Image(np.zeros((30, 20, 3), dtype=np.uint8), copy=False)
+    if (img.size() != (30, 20) or not img.getNumpyCv2().flags['C_CONTIGUOUS']):
+        assert False
+
 # # Image Class Test
 
 def test_image_scale():
@@ -415,6 +454,21 @@ def test_detection_lines_standard():
     if(lines == 0 or lines == None):
         assert False
 
+def test_detection_lines_arrays():
+    img = Image(testimage2)
+    for standard in [False, True]:
+        lines = img.findLines(useStandard=standard)
+        endpoints, lengths, angles = img.findLines(useStandard=standard, returnArrays=True)
+        if (endpoints.shape != (len(lines), 2, 2)):
+            assert False
+        if not np.allclose(lengths, [l.length() for l in lines]):
+            assert False
+        if not np.allclose(angles, [l.angle() for l in lines]):
+            assert False
+        # the FeatureSet aggregates measure all of the lines at once
+        if not (np.allclose(lines.length(), lengths) and np.allclose(lines.angle(), angles)):
+            assert False
+
 def test_detection_feature_measures():
     img = Image(testimage2)
 
@@ -938,6 +992,83 @@ def test_camera_undistort():
     if (not img2): #right now just wait for this to return
         assert False
 
+def test_camera_jpegstream():
+    import BaseHTTPServer
+    jpeg = open(testimage2, 'rb').read()
+    class StreamHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=--myboundary')
+            self.end_headers()
+            for i in range(20):
+                part = '--myboundary\r\nContent-Type: image/jpeg\r\n'
+                if i % 2: # some cameras leave out the length
+                    part += 'Content-Length: %d\r\n' % len(jpeg)
+                self.wfile.write(part + '\r\n' + jpeg + '\r\n')
+                time.sleep(0.01)
+            self.wfile.write('--myboundary\r\n')
+        def log_message(self, *args):
+            pass
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StreamHandler)
+    thread = threading.Thread(target=server.handle_request)
+    thread.daemon = True
+    thread.start()
+
+    cam = JpegStreamCamera("127.0.0.1:%d/stream" % server.server_port)
+    img = cam.getImage()
+    if (img is None or img.size() != Image(testimage2).size()):
+        assert False
+    first = cam.sequence
+    img = cam.getImage()
+    if (img is None or cam.sequence <= first):
+        assert False
+    thread.join()
+    # every frame the server sent got a sequence number
+    while cam.getImage() is not None:
+        pass
+    if (cam.camthread.sequence != 20 or cam.camthread.droppedFrames >= 20):
+        assert False
+
+def test_jpegstreamer_broadcast():
+    js = JpegStreamer(("127.0.0.1", 8099), st=0, ladder=[(80, 1.0), (40, 0.5)])
+    img = Image(testimage2)
+    img.save(js)
+    full = JpegStreamCamera("127.0.0.1:8099/stream")
+    half = JpegStreamCamera("127.0.0.1:8099/stream/1")
+    if (full.getImage().size() != img.size()):
+        assert False
+    if (half.getImage().size() != (img.width / 2, img.height / 2)):
+        assert False
+    # both rungs are encoded once for this frame
+    if (sorted(js._frames.keys()) != [0, 1] or js.sequence != 1):
+        assert False
+    img.invert().save(js)
+    if (full.getImage() is None or full.sequence < 2):
+        assert False
+
+def test_videostream_queued():
+    outdir = tempfile.mkdtemp()
+    vs = VideoStream(os.path.join(outdir, "queued.avi"), fps=10, fourcc="MJPG",
+                     queuesize=100, segmentlength=1.0, keepsegments=2)
+    img = Image(testimage2)
+    for i in range(30):
+        vs.writeFrame(img, timestamp=i * 0.1)
+    vs.close()
+    stats = vs.getStats()
+    if (stats["written"] + stats["dropped"] + stats["failed"] != 30 or stats["queued"] != 0):
+        assert False
+    # a closed stream is left alone
+    if (vs.writeFrame(img, timestamp=3.0) or vs.getStats()["written"] != stats["written"]):
+        assert False
+    # three one second segments, the oldest was removed
+    if (len(stats["segments"]) != 2 or not stats["segments"][-1].endswith("queued_0002.avi")):
+        assert False
+    for fname in stats["segments"]:
+        if (not os.path.exists(fname) or not os.path.exists(fname + ".timecodes.txt")):
+            assert False
+    if (os.path.exists(os.path.join(outdir, "queued_0000.avi"))):
+        assert False
+
 def test_image_crop():
     img = Image(logo)
     x = 5
@@ -1307,6 +1438,24 @@ def test_blob_data():
         if(sum(b.mHu) > 0):
             pass
 
+def test_blob_many_contours():
+    # a dense grid of ten thousand small squares
+    arr = np.zeros((400, 400), dtype=np.uint8)
+    for i in range(0, 400, 4):
+        arr[i:i+2, :] = 255
+    arr[:, 2::4] = 0
+    arr[:, 3::4] = 0
+    img = Image(arr)
+    blobs = BlobMaker().extractFromBinary(img, img, minsize=1)
+    if( len(blobs) != 100*100 ):
+        assert False
+    # per blob data is only computed when it is asked for
+    b = blobs[0]
+    if( 'mHu' in b.__dict__ or 'mConvexHull' in b.__dict__ ):
+        assert False
+    if( len(b.mConvexHull) < 3 or len(b.mHu) != 7 ):
+        assert False
+
 def test_blob_render():
     img = Image("../sampleimages/blockhead.png")
     blobber = BlobMaker()
@@ -1469,6 +1618,29 @@ def test_segmentation_running():
     else:
         pass
 
+def test_segmentation_buffers():
+    i1 = Image("logo")
+    i2 = Image("logo_inverted")
+    for segmentor in [RunningSegmentation(), DiffSegmentation(grayOnly=True)]:
+        if (segmentor.addImageAndGetBlobs(i1) != []):
+            assert False
+        blobs = segmentor.addImageAndGetBlobs(i2)
+        if (blobs is None or not segmentor.isReady()):
+            assert False
+        buffers = dict(segmentor.mBuffers)
+        segmentor.addImageAndGetBlobs(i1)
+        # the work buffers are reused from frame to frame
+        for name, buf in buffers.items():
+            if (segmentor.mBuffers[name] is not buf):
+                assert False
+        mask = segmentor.getSegmentedImage()
+        if (mask.size() != i1.size()):
+            assert False
+        # same threshold semantics as binarizing the raw difference
+        expected = segmentor.getRawImage().binarize(thresh=(20,20,20) if isinstance(segmentor, RunningSegmentation) else (10,10,10))
+        if (np.any(mask.getGrayNumpy() != expected.getGrayNumpy())):
+            assert False
+
 def test_segmentation_color():
     segmentor = ColorSegmentation()
     i1 = Image("logo")
@@ -1541,6 +1713,37 @@ def test_applyPixelFunc():
     perform_diff(results,name_stem)
     pass
 
+def test_applyPixelFunc_modes():
+    img = Image(testimage2)
+    def myFunc((r,g,b)):
+        return( (b/2,g,r) )
+
+    expected = img.applyPixelFunction(myFunc).getNumpy()
+    assert np.all(img.applyPixelFunction(myFunc,pure=True).getNumpy() == expected)
+    # the second time round every color comes out of the table
+    assert np.all(img.applyPixelFunction(myFunc,pure=True,cache=True).getNumpy() == expected)
+    assert np.all(img.applyPixelFunction(myFunc,pure=True,cache=True).getNumpy() == expected)
+    # without cache a function reading changing state is called again
+    scale = [1]
+    def scaled((r,g,b)):
+        return (r/scale[0],g/scale[0],b/scale[0])
+    first = img.applyPixelFunction(scaled,pure=True).getNumpy()
+    scale[0] = 2
+    assert np.all(img.applyPixelFunction(scaled,pure=True).getNumpy() == first/2)
+    quantized = img.applyPixelFunction(myFunc,pure=True,levels=32).getNumpy()
+    assert np.abs(quantized.astype(int)-expected).max() <= 8
+
+    def myArrayFunc(px):
+        return np.dstack((px[:,:,2]/2,px[:,:,1],px[:,:,0]))
+    assert np.all(img.applyPixelFunction(myArrayFunc,vectorized=True,workers=4).getNumpy() == expected)
+    # working in place leaves the source image alone
+    before = img.getNumpy().copy()
+    def inPlace(px):
+        px[...,0] = 0
+        return px
+    assert img.applyPixelFunction(inPlace,vectorized=True,workers=4).getNumpy()[...,0].max() == 0
+    assert np.all(img.getNumpy() == before)
+
 def test_applySideBySide():
     img = Image(logo)
     img3 = Image(testimage2)
@@ -1685,6 +1888,197 @@ def test_imageset():
     else:
         assert False
 
+def test_imageset_lazy():
+    imgs = ImageSet("../sampleimages/", lazy=True, cache_size=1, prefetch=2)
+    eager = ImageSet("../sampleimages/")
+    if (len(imgs) != len(eager) or len(imgs) == 0):
+        assert False
+    # sizes come from the file headers without decoding anything
+    if (len(imgs._cache) != 0):
+        assert False
+    if not np.all(imgs.dimensions() == eager.dimensions()):
+        assert False
+    first = imgs[0]
+    if (first.size() != eager[0].size()):
+        assert False
+    # the cache holds at least the most recently used image
+    if (len(imgs._cache) < 1 or imgs._cacheBytes <= 0):
+        assert False
+    small = imgs[0:3].standardize(32, 32)
+    if (len(small) != 3 or small[2].size() != (32, 32)):
+        assert False
+    avg = small.average()
+    if (avg.size() != (32, 32)):
+        assert False
+
+def test_feature_batch():
+    files = [testimage, testimage2, barcode, whiteimage]
+    extractors = [HueHistogramFeatureExtractor(mNBins=8)]
+    checkpoint = tempfile.mkdtemp()
+    serial, keep = FeatureBatch(extractors).extract(files)
+    if (serial.dtype != np.float32 or not serial.flags['C_CONTIGUOUS']):
+        assert False
+    if (serial.shape != (np.sum(keep), 8)):
+        assert False
+    parallel, keep2 = FeatureBatch(extractors, processes=2, checkpoint=checkpoint).extract(files)
+    if not (np.all(keep == keep2) and np.allclose(serial, parallel)):
+        assert False
+    # the second run is read back from the checkpoint
+    if (len(os.listdir(checkpoint)) != 1):
+        assert False
+    cached, keep3 = FeatureBatch(extractors, checkpoint=checkpoint).extract(files)
+    if not np.allclose(cached, parallel):
+        assert False
+
+def test_feature_batch_standardized():
+    files = [testimage, testimage2, barcode]
+    haar = HaarLikeFeatureExtractor(fname="../Features/haar.txt")
+    checkpoint = tempfile.mkdtemp()
+    lazy = ImageSet(files, lazy=True)
+    small = lazy.standardize(32, 32)
+    expected, keep = FeatureBatch([haar]).extract([Image(f).resize(32, 32) for f in files])
+    serial, keep1 = FeatureBatch([haar]).extract(small)
+    # a fresh set, the first one holds decoded images now and those are sent as they are
+    parallel, keep2 = FeatureBatch([haar], processes=2, checkpoint=checkpoint).extract(lazy.standardize(32, 32))
+    if not (np.allclose(serial, expected) and np.allclose(parallel, expected)):
+        assert False
+    # the full size images get a checkpoint of their own
+    full, keep3 = FeatureBatch([haar], checkpoint=checkpoint).extract(lazy)
+    if (len(os.listdir(checkpoint)) != 2 or np.allclose(full, parallel)):
+        assert False
+    if ORANGE_ENABLED:
+        knn = KNNClassifier([haar])
+        other = ImageSet([whiteimage, blackimage], lazy=True).standardize(32, 32)
+        knn.train([small, other], ['a', 'b'], verbose=False, processes=2)
+        trained = np.array([row[:-1] for row in knn.mDataSetRaw[0:len(files)]])
+        if not np.allclose(trained, expected):
+            assert False
+
+def test_feature_batch_edited_images():
+    imgs = [Image(testimage), Image(testimage2)]
+    haar = HaarLikeFeatureExtractor(fname="../Features/haar.txt")
+    before, keep = FeatureBatch([haar]).extract(imgs)
+    # edits made in memory are seen, the files are not read again
+    imgs[0] = imgs[0].invert()
+    imgs[0].filename = testimage
+    for processes in (1, 2):
+        after, keep = FeatureBatch([haar], processes=processes).extract(imgs)
+        if (np.allclose(after[0], before[0]) or not np.allclose(after[1], before[1])):
+            assert False
+
+def test_haar_like_batch():
+    haar = HaarLikeFeatureExtractor(fname="../Features/haar.txt")
+    nfeats = len(haar.mFeatureSet)
+    imgs = [Image(testimage), Image(testimage2).scale(0.5), Image(testimage).invert()]
+    batch = haar.extractBatch(imgs)
+    if (batch.shape != (3, haar.getNumFields()) or haar.getNumFields() != 2 * nfeats):
+        assert False
+    for i in range(len(imgs)):
+        regular = imgs[i].integralImage()
+        expected = [f.apply(regular) for f in haar.mFeatureSet]
+        if not np.allclose(batch[i, 0:nfeats], expected, rtol=1e-4):
+            assert False
+        # the angled features come from the tilted integral image
+        slant = imgs[i].integralImage(tilted=True)
+        expected = [f.apply(slant) for f in haar.mFeatureSet]
+        if not np.allclose(batch[i, nfeats:], expected, rtol=1e-4):
+            assert False
+    if not np.allclose(haar.extract(imgs[1]), batch[1]):
+        assert False
+
+def test_temporal_color_tracker():
+    # a gray patch that flashes bright every 30 frames
+    levels = 50 + 150 * np.exp(-((np.arange(300) % 30) - 15)**2 / 8.0)
+    frames = [Image(np.zeros((20,20), dtype=np.uint8) + int(l)) for l in levels]
+    tct = TemporalColorTracker()
+    tct.train(ImageSet(frames), extractor=lambda img: img.meanColor(), maxFrames=300, verbose=False)
+    if (len(tct.data['r']) != 300 or tct._window != 30):
+        assert False
+    for img in frames:
+        count = tct.recognize(img)
+    if (count != 10 or len(tct.getSignal()) != 30):
+        assert False
+
+def test_shape_context_index():
+    yy, xx = np.mgrid[0:200, 0:200]
+    disk = np.where((xx-100)**2 + (yy-100)**2 < 60**2, 255, 0).astype(np.uint8)
+    box = np.zeros((200,200), dtype=np.uint8)
+    box[40:160, 70:130] = 255
+    images = [Image(disk), Image(box)]
+    blob = images[0].findBlobs(minsize=50)[0]
+    descriptors, points = blob.getSCDescriptors()
+    if (descriptors.shape[1] != 36 or not np.all(np.isfinite(descriptors))):
+        assert False
+    index = os.path.join(tempfile.mkdtemp(), 'models.pkl')
+    scc = ShapeContextClassifier(images, ['disk', 'box'], indexfile=index)
+    if not os.path.exists(index):
+        assert False
+    name, value, matches, stds = scc.classify(Image(box))
+    if (name != 'box' or value > 1e-6):
+        assert False
+    # a second classifier reads its descriptors back from the index
+    cached = ShapeContextClassifier(images, ['disk', 'box'], indexfile=index)
+    if not np.allclose(cached.descMap['disk'], scc.descMap['disk']):
+        assert False
+    if (cached.classify(Image(disk))[0] != 'disk'):
+        assert False
+    # new model images under the same labels rebuild the index
+    swapped = ShapeContextClassifier([images[1], images[0]], ['disk', 'box'], indexfile=index)
+    if (swapped.classify(Image(box))[0] != 'disk'):
+        assert False
+
+def test_track_manager():
+    # two textured squares that slide 2 pixels a frame in opposite directions
+    np.random.seed(0)
+    texture = (np.random.rand(30,30) * 255).astype(np.uint8)
+    def frame(i):
+        a = np.zeros((200,200), dtype=np.uint8)
+        a[40:70, 20+2*i:50+2*i] = texture
+        a[120:150, 150-2*i:180-2*i] = texture
+        return Image(a, cv2image=True) # rows are y, columns are x
+    img = frame(0)
+    tm = TrackManager(history=10)
+    bb = [(20,40,30,30), (150,120,30,30)]
+    first = tm.addTarget(img, bb[0])
+    second = tm.addTarget(img, bb[1])
+    for i in range(1,21):
+        records = tm.update(frame(i), timestamp=i)
+    if (len(tm.getHistory(first)) != 10 or records[first].image is not None):
+        assert False
+    start = np.array(bb[0][:2]) + 15
+    moved = np.array(records[first].center) - start
+    if not (abs(moved[0] - 40) < 4 and abs(moved[1]) < 4):
+        assert False
+    start = np.array(bb[1][:2]) + 15
+    moved2 = np.array(records[second].center) - start
+    if not (abs(moved2[0] + 40) < 4 and abs(moved2[1]) < 4):
+        assert False
+
+def test_bof_patches_and_codes():
+    img = Image(testimage)
+    bof = BOFFeatureExtractor(patchsz=(11,11), numcodes=16, imglayout=(4,4))
+    patches = bof.extractPatches(img)
+    if (patches.shape != ((img.width/11)*(img.height/11), 121)):
+        assert False
+    # the batched equalization matches cv.EqualizeHist patch by patch
+    lum = cv.CreateImage((img.width,img.height), cv.IPL_DEPTH_8U, 1)
+    patch = cv.CreateImage((11,11), cv.IPL_DEPTH_8U, 1)
+    cv.Split(img.toHLS().getBitmap(), None, lum, None, None)
+    cv.SetImageROI(lum, (11,22,11,11))
+    cv.EqualizeHist(lum, patch)
+    cv.ResetImageROI(lum)
+    expected = np.array(patch[:,:]).reshape(121)
+    if not np.all(patches[img.height/11 + 2] == expected):
+        assert False
+    bof.mCodebook = bof.makeCodebook(patches, 16, batchsize=200, iterations=20)
+    codes = np.argmin(spsd.cdist(patches, bof.mCodebook), axis=1)
+    hist = bof.extract(img)
+    if (len(hist) != bof.getNumFields()):
+        assert False
+    expected = np.bincount(codes, minlength=16) * (16.0/(15*len(codes)))
+    if not np.allclose(hist, expected):
+        assert False
+
 def test_hsv_conversion():
     px = Image((1,1))
     px[0,0] = Color.GREEN
@@ -1892,6 +2286,26 @@ def test_movement_feature():
 
     pass
 
+def test_movement_arrays():
+    current = Image("../sampleimages/flow_simple1.png")
+    prev = Image("../sampleimages/flow_simple2.png")
+
+    fs = current.findMotion(prev, window=7, method='HS')
+    pos, vec, mag = current.findMotion(prev, window=7, method='HS', returnArrays=True)
+    assert len(fs) == len(pos) == len(vec) == len(mag)
+    assert np.allclose([f.vector() for f in fs], vec)
+    assert np.allclose([(f.x,f.y) for f in fs], pos)
+    fs2 = Motion.fromField(current, pos, vec, 7)
+    assert np.allclose([(f.norm_dx,f.norm_dy) for f in fs2], [(f.norm_dx,f.norm_dy) for f in fs])
+
+    # farneback starts from the previous frame's flow when it has one
+    current2 = Image("../sampleimages/flow_simple1.png")
+    fs = prev.findMotion(current, window=7, method='FB')
+    assert prev._mFlow is not None
+    pos, vec, mag = current2.findMotion(prev, window=7, method='FB', returnArrays=True)
+    if( len(pos) == 0 or current2._mFlow.shape != (current2.height,current2.width,2) ):
+        assert False
+
 def test_keypoint_extraction():
     try:
         import cv2
@@ -1970,6 +2384,29 @@ def test_keypoint_match():
     name_stem = "test_find_keypoint_match"
     perform_diff(results,name_stem)
 
+def test_keypoint_library():
+    try:
+        import cv2
+    except:
+        pass
+        return
+
+    lib = KeypointLibrary(quality=300.00)
+    assert lib.addTemplate(Image("../sampleimages/KeypointTemplate2.png"), "template")
+    assert lib.addTemplate(Image("../sampleimages/aerospace.jpg"), "aerospace")
+    assert len(lib) == 2
+
+    found = lib.match(Image("../sampleimages/kptest0.png"))
+    assert "template" in found
+    found["template"].getHomography()
+
+    fname = os.path.join(tempfile.mkdtemp(), "keypoints.lib")
+    lib.save(fname)
+    lib2 = KeypointLibrary.load(fname)
+    assert lib2.mNames == lib.mNames
+    assert lib2.mIndex is not None
+    assert "template" in lib2.match(Image("../sampleimages/kptest0.png"))
+
 
 def test_draw_keypoint_matches():
     try:
@@ -2069,8 +2506,44 @@ def test_palette_blobs():
     else:
         assert False
 
+def test_palette_shared():
+    img = Image(testimageclr)
+    palette = Palette(bins=5, samples=2000)
+    colors = palette.train(img)
+    assert colors.shape == (5,3)
+
+    img2 = palette.apply(Image(testimage2))
+    members = img2._mPaletteMembers
+    assert len(members) == img2.width*img2.height
+    counts = np.bincount(members, minlength=5)/float(len(members))
+    assert np.allclose(img2._mPalettePercentages, counts)
+    assert np.all(img2.getPalette(bins=5) == colors)
+
+    # retraining starts from the last centroids
+    palette.train(img2)
+    assert palette.getColors().shape == (5,3)
+
+    # a second bins value does not throw the first one away
+    p5 = img.getPalette(bins=5)
+    img.getPalette(bins=3)
+    assert img.getPalette(bins=5) is p5
+    img3 = Image(testimage2).rePalette(palette)
+    assert np.allclose(sum(img3._mPalettePercentages), 1.0)
 
 
+
+def test_palette_pickled():
+    img = pickle.loads(pickle.dumps(Image(testimageclr)))
+    if (img.getPalette(bins=4).shape != (4,3) or img.palettize(bins=4).size() != img.size()):
+        assert False
+    if (img.binarizeFromPalette(img.getPalette(bins=4)[0:1]).size() != img.size()):
+        assert False
+    palette = Palette(bins=3)
+    palette.train(Image(testimageclr))
+    img2 = palette.apply(pickle.loads(pickle.dumps(Image(testimage2))))
+    if (len(img2._mPaletteMembers) != img2.width*img2.height):
+        assert False
+
 def test_skeletonize():
     img = Image(logo)
     s = img.skeletonize()
@@ -3737,6 +4210,41 @@ def test_LineScan_div():
     else:
         assert False
 
+def test_LineScan_numpy():
+    img = Image('lenna')
+    ls = img.getLineScan(y=20, channel=1)
+    values = np.asarray(ls)
+    if values is not np.asarray(ls) or len(values) != img.width:
+        assert False
+    # slices are views that keep the metadata
+    part = ls[10:20]
+    part[0] = 7
+    if ls[10] != 7 or part.image is not img or part.channel != 1 or part.pointLoc[0] != ls.pointLoc[10]:
+        assert False
+    if (ls + 1)[10] != 8 or (ls + ls).row != 20:
+        assert False
+    # it still acts like a list
+    ls.append(3)
+    if ls[-1] != 3 or len(ls) != img.width + 1 or list(ls)[-1] != 3:
+        assert False
+
+def test_getLineProfiles():
+    img = Image('lenna')
+    segments = [((10,20),(110,120)), ((50,200),(50,100)), ((300,30),(200,60))]
+    profiles = img.getLineProfiles(segments)
+    if profiles.shape != (3,101):
+        assert False
+    # one sample per pixel of a single line is the same as getLineScan
+    ls = img.getLineScan(pt1=(10,20),pt2=(110,120))
+    if profiles[0].tolist() != list(ls):
+        assert False
+    colors = img.getLineProfiles(segments, samples=32, bilinear=True, channel=None)
+    if colors.shape != (3,32,3) or colors.min() < 0 or colors.max() > 255:
+        assert False
+    pixels = img.getPixelsOnLine((10,20),(110,70))
+    if pixels[0] != img.getPixel(10,20) or pixels[-1] != img.getPixel(110,70):
+        assert False
+
 def test_tvDenoising():
     return # this is way too slow.
     try: